@@ -0,0 +1,223 @@
+"""Asyncio engine for fetching Apaleo pages, partitions and streams concurrently.
+
+With the `engine` setting `asyncio`, page requests run as coroutines on one
+event loop in a background thread, sent with `aiohttp` (the `async` extra)
+instead of a thread per request. The thread syncing the streams still parses
+and writes all records, in the same order as the default thread engine, and
+consumes the pages through bounded buffers.
+"""
+
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+_engine: Optional["AsyncEngine"] = None
+_engine_lock = threading.Lock()
+
+
+async def ordered_map_async(
+    func: Callable[[T], Awaitable[R]], items: Iterable[T], max_concurrency: int
+) -> AsyncIterator[R]:
+    """Await `func` for `items` with bounded concurrency, yielding results in order."""
+    pending: List[asyncio.Future] = []
+    try:
+        for item in items:
+            if len(pending) >= max_concurrency:
+                yield await pending.pop(0)
+            pending.append(asyncio.ensure_future(func(item)))
+        while pending:
+            yield await pending.pop(0)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class AsyncEngine:
+    """Event loop in a background thread with a pooled `aiohttp` session.
+
+    Request units (a time window of a partition) are fetched through
+    `prefetch`. At most `max_parallel_units` of them run at once across all
+    streams, and they start in the order they are consumed in.
+    """
+
+    def __init__(self, pool_size: int, max_parallel_units: int) -> None:
+        """Start the event loop and open the session."""
+        if aiohttp is None:
+            raise RuntimeError(
+                "The asyncio engine needs aiohttp. Install the `async` extra."
+            )
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="apaleo-asyncio", daemon=True
+        )
+        self._thread.start()
+        self._session = self.run(self._create_session(pool_size))
+        self._unit_slots = self.run(self._create_semaphore(max_parallel_units))
+
+    async def _create_session(self, pool_size: int) -> "aiohttp.ClientSession":
+        connector = aiohttp.TCPConnector(limit=pool_size)
+        return aiohttp.ClientSession(connector=connector)
+
+    async def _create_semaphore(self, value: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(max(1, value))
+
+    def run(self, coroutine: Awaitable[T]) -> T:
+        """Run a coroutine on the event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a blocking call in a worker thread, off the event loop."""
+        return await self.loop.run_in_executor(None, func, *args)
+
+    async def send(
+        self, prepared_request: requests.PreparedRequest, timeout: float
+    ) -> requests.Response:
+        """Send a prepared request and return the downloaded response.
+
+        Timeouts and connection errors are raised as their `requests`
+        counterparts, so retries work the same as with the thread engine.
+        """
+        started = time.monotonic()
+        try:
+            async with self._session.request(
+                prepared_request.method,
+                prepared_request.url,
+                headers=dict(prepared_request.headers),
+                data=prepared_request.body,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as client_response:
+                content = await client_response.read()
+        except asyncio.TimeoutError as ex:
+            raise requests.exceptions.ReadTimeout(
+                f"Read timed out after {timeout}s.", request=prepared_request
+            ) from ex
+        except aiohttp.ClientError as ex:
+            raise requests.exceptions.ConnectionError(
+                str(ex), request=prepared_request
+            ) from ex
+
+        response = requests.Response()
+        response.status_code = client_response.status
+        response.reason = client_response.reason
+        response.headers = CaseInsensitiveDict(client_response.headers)
+        response.url = str(client_response.url)
+        response.encoding = client_response.charset
+        response.request = prepared_request
+        response.elapsed = timedelta(seconds=time.monotonic() - started)
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    def iterate(self, items: AsyncIterator[T], max_buffered: int) -> Iterator[T]:
+        """Consume an async iterator from this thread, buffering ahead of it."""
+        buffer = self.run(self._create_queue(max_buffered))
+        drain = asyncio.run_coroutine_threadsafe(self._drain(items, buffer), self.loop)
+        try:
+            yield from self._consume(buffer)
+        finally:
+            drain.cancel()
+
+    def prefetch(
+        self,
+        producers: Sequence[Callable[[], AsyncIterator[T]]],
+        max_buffered: int,
+    ) -> Iterator[Iterator[T]]:
+        """Run `producers` as request units, yielding one iterator per producer.
+
+        The counterpart of `concurrency.prefetch`: the iterators are yielded in
+        the order of `producers` and must be consumed in that order. Units of
+        later calls start after those of earlier calls, so several streams can
+        prefetch at once and the unit consumed next is never starved.
+        """
+        buffers = [self.run(self._create_queue(max_buffered)) for _ in producers]
+        drains = [
+            asyncio.run_coroutine_threadsafe(
+                self._drain_unit(producer, buffer), self.loop
+            )
+            for producer, buffer in zip(producers, buffers)
+        ]
+        try:
+            for buffer in buffers:
+                yield self._consume(buffer)
+        finally:
+            for drain in drains:
+                drain.cancel()
+
+    async def _create_queue(self, max_buffered: int) -> asyncio.Queue:
+        return asyncio.Queue(maxsize=max(1, max_buffered))
+
+    async def _drain(self, items: AsyncIterator[Any], buffer: asyncio.Queue) -> None:
+        try:
+            async for item in items:
+                await buffer.put((item, None))
+            await buffer.put((_DONE, None))
+        except asyncio.CancelledError:
+            raise
+        except BaseException as ex:
+            await buffer.put((None, ex))
+
+    async def _drain_unit(
+        self, producer: Callable[[], AsyncIterator[Any]], buffer: asyncio.Queue
+    ) -> None:
+        async with self._unit_slots:
+            await self._drain(producer(), buffer)
+
+    def _consume(self, buffer: asyncio.Queue) -> Iterator[Any]:
+        while True:
+            item, error = self.run(buffer.get())
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+
+    def close(self) -> None:
+        """Close the session and stop the event loop."""
+        self.run(self._session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def get_engine(pool_size: int, max_parallel_units: int) -> AsyncEngine:
+    """Return the shared engine, starting it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncEngine(pool_size, max_parallel_units)
+        return _engine
+
+
+def close_engine() -> None:
+    """Stop the shared engine, if it was started."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
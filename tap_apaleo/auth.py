@@ -1,30 +1,226 @@
 """Apaleo Authentication."""
 
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
 
-from singer_sdk.authenticators import OAuthAuthenticator, SingletonMeta
+from singer_sdk.authenticators import OAuthAuthenticator
+from singer_sdk.helpers._util import utc_now
 
+from tap_apaleo.session import DEFAULT_POOL_SIZE, get_session
 
-# The SingletonMeta metaclass makes your streams reuse the same authenticator instance.
-# If this behaviour interferes with your use-case, you can remove the metaclass.
-class ApaleoAuthenticator(OAuthAuthenticator, metaclass=SingletonMeta):
-    """Authenticator class for Apaleo."""
+DEFAULT_AUTH_URL = "https://identity.apaleo.com/connect/token"
+# Tokens are refreshed in the background once they expire within this margin,
+DEFAULT_REFRESH_MARGIN = 300
+# and synchronously once they expire within a few seconds.
+MIN_TOKEN_SECONDS = 30
+
+
+class ApaleoAuthenticator(OAuthAuthenticator):
+    """Authenticator class for Apaleo.
+
+    Streams share one authenticator per token endpoint and client, created
+    through `create_for_stream`. Exactly one thread fetches a token at a time;
+    others wait for it and then use the new token. A token close to expiry is
+    refreshed in the background while requests keep using the current one.
+    """
+
+    _instances: Dict[Tuple[str, str], "ApaleoAuthenticator"] = {}
+    _instances_lock = threading.Lock()
+    # Accounts share the cache file, so updates to it are serialized.
+    _cache_lock = threading.Lock()
+
+    def __init__(self, *args, account: Optional[dict] = None, **kwargs) -> None:
+        """Initialize the authenticator without a token.
+
+        With an `account` from the `accounts` setting, its client credentials are
+        used instead of the top-level ones.
+        """
+        super().__init__(*args, **kwargs)
+        self.account = account
+        self.expires_at: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._background_refresh: Optional[threading.Thread] = None
 
     @property
     def oauth_request_body(self) -> dict:
         """Define the OAuth request body for the Apaleo API."""
         # Define the request body needed for the API.
         return {
-            #'resource': 'https://api.apaleo.com/',
-            #'scope': self.oauth_scopes,
-            'client_id': self.config["client_id"],
-            'client_secret': self.config["client_secret"],
+            # 'resource': 'https://api.apaleo.com/',
+            # 'scope': self.oauth_scopes,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
             'grant_type': 'client_credentials',
         }
 
-    @classmethod
-    def create_for_stream(cls, stream) -> "ApaleoAuthenticator":
-        return cls(
-            stream=stream,
-            auth_endpoint="https://identity.apaleo.com/connect/token",
-            #oauth_scopes="OAuth Scopes",
+    @property
+    def client_id(self) -> str:
+        """Return the client id of the account or the top-level setting."""
+        return (self.account or self.config)["client_id"]
+
+    @property
+    def client_secret(self) -> str:
+        """Return the client secret of the account or the top-level setting."""
+        return (self.account or self.config)["client_secret"]
+
+    @property
+    def refresh_margin(self) -> float:
+        """Return the seconds before expiry at which the token is refreshed."""
+        return self.config.get("token_refresh_margin", DEFAULT_REFRESH_MARGIN)
+
+    @property
+    def auth_headers(self) -> dict:
+        """Return the `Authorization` header, refreshing the token if needed."""
+        token = self.access_token
+        seconds_left = self.get_seconds_left()
+        if seconds_left <= MIN_TOKEN_SECONDS:
+            self.refresh(token)
+        elif seconds_left <= self.refresh_margin:
+            self._refresh_in_background(token)
+        return {**self._auth_headers, "Authorization": f"Bearer {self.access_token}"}
+
+    def get_seconds_left(self) -> float:
+        """Return the seconds until the token expires, 0 without a token."""
+        if self.access_token is None or self.expires_at is None:
+            return 0
+        return self.expires_at - time.time()
+
+    def is_token_valid(self) -> bool:
+        """Return True if the token does not expire within the next seconds."""
+        return self.get_seconds_left() > MIN_TOKEN_SECONDS
+
+    def refresh(self, stale_token: Optional[str]) -> None:
+        """Replace `stale_token`, unless another thread already replaced it.
+
+        Threads which find a refresh in progress wait for it and then use its
+        token, so parallel streams never fetch more than one token at a time.
+        """
+        with self._refresh_lock:
+            if self.access_token != stale_token:
+                return
+            if stale_token is None and self.load_cached_token():
+                return
+            self.update_access_token()
+            self.save_cached_token()
+
+    def refresh_rejected(self, authorization: Optional[str]) -> None:
+        """Replace the token of an `Authorization` header which got a 401."""
+        token = (authorization or "").partition("Bearer ")[2] or None
+        self.refresh(token)
+
+    def _refresh_in_background(self, token: Optional[str]) -> None:
+        with self._background_lock:
+            if self._background_refresh and self._background_refresh.is_alive():
+                return
+            self._background_refresh = threading.Thread(
+                target=self._refresh_quietly,
+                args=(token,),
+                name="apaleo-token-refresh",
+                daemon=True,
+            )
+            self._background_refresh.start()
+
+    def _refresh_quietly(self, token: Optional[str]) -> None:
+        try:
+            self.refresh(token)
+        except Exception as ex:
+            # The token is still valid; requests refresh it again before it expires.
+            self.logger.warning(f"Background token refresh failed: {ex}")
+
+    def update_access_token(self):
+        """Update `access_token` through the pooled session shared with the streams."""
+        request_time = utc_now()
+        requested_at = time.time()
+        session = get_session(self.config.get("http_pool_size", DEFAULT_POOL_SIZE))
+        token_response = session.post(
+            self.auth_endpoint, data=self.oauth_request_payload
         )
+        try:
+            token_response.raise_for_status()
+            self.logger.info("OAuth authorization attempt was successful.")
+        except Exception as ex:
+            raise RuntimeError(
+                f"Failed OAuth login, response was '{token_response.json()}'. {ex}"
+            )
+        token_json = token_response.json()
+        self.expires_in = token_json["expires_in"]
+        self.last_refreshed = request_time
+        self.expires_at = requested_at + self.expires_in
+        self.access_token = token_json["access_token"]
+
+    def get_cache_key(self) -> str:
+        """Return the key of this endpoint and client in the token cache."""
+        key = f"{self.auth_endpoint}\n{self.client_id}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _read_token_cache(self, path: str) -> dict:
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def load_cached_token(self) -> bool:
+        """Use the token cached by an earlier run if it is still fresh.
+
+        Returns False if `token_cache_path` is not set or holds no fresh token.
+        """
+        path = self.config.get("token_cache_path")
+        if not path:
+            return False
+        entry = self._read_token_cache(path).get(self.get_cache_key())
+        if not entry or entry["expires_at"] - time.time() <= self.refresh_margin:
+            return False
+        self.expires_at = entry["expires_at"]
+        self.access_token = entry["access_token"]
+        self.logger.info("Using the cached OAuth token.")
+        return True
+
+    def save_cached_token(self) -> None:
+        """Write the token to `token_cache_path`, readable by the owner only."""
+        path = self.config.get("token_cache_path")
+        if not path:
+            return
+        with self._cache_lock:
+            self._write_token_cache(path)
+
+    def _write_token_cache(self, path: str) -> None:
+        tokens = self._read_token_cache(path)
+        now = time.time()
+        tokens = {
+            key: entry for key, entry in tokens.items() if entry["expires_at"] > now
+        }
+        tokens[self.get_cache_key()] = {
+            "access_token": self.access_token,
+            "expires_at": self.expires_at,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+            with os.fdopen(fd, "w") as file:
+                json.dump(tokens, file)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            self.logger.warning(f"Could not cache the OAuth token: {ex}")
+
+    @classmethod
+    def create_for_stream(
+        cls, stream, account: Optional[dict] = None
+    ) -> "ApaleoAuthenticator":
+        """Return the authenticator shared by all streams of the same client."""
+        auth_endpoint = stream.config.get("auth_url", DEFAULT_AUTH_URL)
+        key = (auth_endpoint, (account or stream.config)["client_id"])
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(
+                    stream=stream,
+                    auth_endpoint=auth_endpoint,
+                    account=account,
+                )
+            return cls._instances[key]
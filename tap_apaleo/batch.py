@@ -0,0 +1,267 @@
+"""Batch files written instead of RECORD messages.
+
+With the `batch_format` setting, records are written to local files, and only
+a Singer BATCH message with the file names goes to stdout for each file. Files
+are gzipped JSON lines, or Parquet files with the `parquet` extra, and are
+rotated every `batch_max_records` records per stream.
+
+Parquet columns follow the JSON schema of the stream, so a column has the same
+type in every file even if it is empty or null in some. Objects without
+properties, and values of several types, are stored as JSON text. Records are
+written in row groups of `PARQUET_ROW_GROUP_SIZE` as they come in.
+
+STATE messages must not get ahead of the records they cover, so they are held
+back while a file is open: when files are completed, all open files of all
+streams are closed and announced first, then the latest state is written.
+"""
+
+import copy
+import decimal
+import gzip
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import singer
+
+from tap_apaleo.serialization import dump_record, write_message
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+DEFAULT_BATCH_DIR = "batches"
+DEFAULT_BATCH_MAX_RECORDS = 100000
+GZIP_LEVEL = 6
+PARQUET_ROW_GROUP_SIZE = 10000
+
+_writer: Optional["BatchWriter"] = None
+_writer_lock = threading.Lock()
+
+
+class BatchMessage(singer.Message):
+    """Singer BATCH message, announcing a file of records of a stream."""
+
+    def __init__(self, stream: str, encoding: Dict[str, str], manifest: List[str]):
+        """Initialize the message."""
+        self.stream = stream
+        self.encoding = encoding
+        self.manifest = manifest
+
+    def asdict(self) -> Dict[str, Any]:
+        """Return the message as a dictionary."""
+        return {
+            "type": "BATCH",
+            "stream": self.stream,
+            "encoding": self.encoding,
+            "manifest": self.manifest,
+        }
+
+
+def _to_json_text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _unchanged(value: Any) -> Any:
+    return value
+
+
+def _to_number(kind: type) -> Callable[[Any], Any]:
+    def convert(value: Any) -> Any:
+        if isinstance(value, decimal.Decimal):
+            return kind(value)
+        return value
+
+    return convert
+
+
+def _to_struct(
+    fields: List[Tuple[str, Callable[[Any], Any]]]
+) -> Callable[[Any], Any]:
+    def convert(value: Any) -> Any:
+        if not isinstance(value, dict):
+            return None
+        return {name: field(value.get(name)) for name, field in fields}
+
+    return convert
+
+
+def _to_list(item: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def convert(value: Any) -> Any:
+        if not isinstance(value, list):
+            return None
+        return [item(element) for element in value]
+
+    return convert
+
+
+def get_arrow_type(schema: dict) -> Tuple[Any, Callable[[Any], Any]]:
+    """Return the Arrow type of a JSON schema and a function converting values.
+
+    Every Arrow type is nullable. Date-times stay strings, as conformed records
+    hold them as text.
+    """
+    types = schema.get("type", [])
+    types = [types] if isinstance(types, str) else [t for t in types if t != "null"]
+    if len(types) != 1:
+        return pyarrow.string(), _to_json_text
+    if types[0] == "object" and schema.get("properties"):
+        fields = [
+            (name, get_arrow_type(property_schema))
+            for name, property_schema in schema["properties"].items()
+        ]
+        arrow_type = pyarrow.struct(
+            [pyarrow.field(name, field[0]) for name, field in fields]
+        )
+        return arrow_type, _to_struct([(name, field[1]) for name, field in fields])
+    if types[0] == "array" and schema.get("items"):
+        item_type, convert_item = get_arrow_type(schema["items"])
+        return pyarrow.list_(item_type), _to_list(convert_item)
+    if types[0] == "integer":
+        return pyarrow.int64(), _to_number(int)
+    if types[0] == "number":
+        return pyarrow.float64(), _to_number(float)
+    if types[0] == "boolean":
+        return pyarrow.bool_(), _unchanged
+    return pyarrow.string(), _to_json_text
+
+
+class _BatchFile:
+    """Open batch file of one stream."""
+
+    def __init__(self, path: Path, batch_format: str, schema: dict) -> None:
+        self.path = path
+        self.format = batch_format
+        self.count = 0
+        self._rows: List[dict] = []
+        if batch_format == "jsonl":
+            self._file = gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+            return
+        columns = [
+            (name, get_arrow_type(property_schema))
+            for name, property_schema in schema.get("properties", {}).items()
+        ]
+        self._converters = [(name, column[1]) for name, column in columns]
+        self._schema = pyarrow.schema(
+            [pyarrow.field(name, column[0]) for name, column in columns]
+        )
+        self._file = pyarrow.parquet.ParquetWriter(str(path), self._schema)
+
+    def write(self, record: dict) -> None:
+        if self.format == "jsonl":
+            self._file.write(dump_record(record))
+        else:
+            self._rows.append(record)
+            if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+                self._write_row_group()
+        self.count += 1
+
+    def close(self) -> None:
+        if self.format == "parquet" and self._rows:
+            self._write_row_group()
+        self._file.close()
+
+    def _write_row_group(self) -> None:
+        columns = {
+            name: [convert(row.get(name)) for row in self._rows]
+            for name, convert in self._converters
+        }
+        self._file.write_table(pyarrow.table(columns, schema=self._schema))
+        self._rows = []
+
+
+class BatchWriter:
+    """Writes the records of all streams to rotated batch files."""
+
+    def __init__(self, directory: Path, batch_format: str, max_records: int) -> None:
+        """Initialize the writer. Files are created on first use."""
+        if batch_format not in ("jsonl", "parquet"):
+            raise ValueError(f"Unknown batch format '{batch_format}'.")
+        if batch_format == "parquet" and pyarrow is None:
+            raise RuntimeError(
+                "Parquet batches need pyarrow. Install the `parquet` extra."
+            )
+        self.directory = directory
+        self.format = batch_format
+        self.max_records = max(1, max_records)
+        self.encoding = (
+            {"format": "jsonl", "compression": "gzip"}
+            if batch_format == "jsonl"
+            else {"format": "parquet", "compression": "snappy"}
+        )
+        self._run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self._files: Dict[str, _BatchFile] = {}
+        self._sequence = 0
+        self._pending_state: Optional[dict] = None
+
+    def write_record(self, stream: str, record: dict, schema: dict) -> None:
+        """Add a record to the open file of a stream, completing full files.
+
+        The JSON `schema` of the stream gives the columns of Parquet files.
+        """
+        batch_file = self._files.get(stream)
+        if batch_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._sequence += 1
+            extension = "jsonl.gz" if self.format == "jsonl" else "parquet"
+            name = f"{stream}-{self._run_id}-{self._sequence:05d}.{extension}"
+            batch_file = self._files[stream] = _BatchFile(
+                self.directory / name, self.format, schema
+            )
+        batch_file.write(record)
+        if batch_file.count >= self.max_records:
+            self.flush()
+
+    def write_state(self, state: dict) -> None:
+        """Write a STATE message once the records before it are in completed files.
+
+        A held back state is copied, as the sync keeps changing it.
+        """
+        if self._files:
+            self._pending_state = copy.deepcopy(state)
+        else:
+            singer.write_message(singer.StateMessage(value=state))
+
+    def flush(self) -> None:
+        """Complete and announce all open files, then write the held back state."""
+        for stream, batch_file in self._files.items():
+            batch_file.close()
+            manifest = [batch_file.path.resolve().as_uri()]
+            write_message(BatchMessage(stream, self.encoding, manifest))
+        self._files = {}
+        if self._pending_state is not None:
+            state, self._pending_state = self._pending_state, None
+            singer.write_message(singer.StateMessage(value=state))
+
+
+def get_batch_writer(config: Mapping[str, Any]) -> Optional[BatchWriter]:
+    """Return the writer of the run if `batch_format` is set, else None."""
+    global _writer
+    if not config.get("batch_format"):
+        return None
+    if _writer is not None:
+        return _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BatchWriter(
+                Path(config.get("batch_dir") or DEFAULT_BATCH_DIR),
+                config["batch_format"],
+                config.get("batch_max_records", DEFAULT_BATCH_MAX_RECORDS),
+            )
+        return _writer
+
+
+def close_batch_writer() -> None:
+    """Complete the open files and write the last state, if batches were written."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.flush()
+            _writer = None
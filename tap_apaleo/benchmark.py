@@ -0,0 +1,191 @@
+r"""Benchmark the tap against a recorded cassette.
+
+Each selected stream is synced in its own tap process against a local
+`CassetteServer`, so the numbers of one stream do not include another. The
+report lists records/sec and pages/sec of the sync, and the peak memory and CPU
+time of the tap process:
+
+    python -m tap_apaleo.benchmark reservations.jsonl.gz --latency 0.05 \
+        --stream reservations --setting max_parallel_pages=4
+
+Unix only, as process statistics are read with `os.wait4`.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from tap_apaleo.cassette import Cassette, CassetteServer
+
+TAP_COMMAND = [
+    sys.executable, "-c", "from tap_apaleo.tap import TapApaleo; TapApaleo.cli()"
+]
+# Lines of the tap's log shown when it fails.
+ERROR_LOG_LINES = 20
+
+
+def check_exit_code(action: str, exit_code: int, log: bytes) -> None:
+    """Raise with the end of the tap's log if the tap process failed."""
+    if exit_code != 0:
+        lines = log.decode("utf-8", "replace").splitlines()[-ERROR_LOG_LINES:]
+        raise RuntimeError(
+            f"Tap process for {action} exited with {exit_code}:\n" + "\n".join(lines)
+        )
+
+
+def get_catalog(config_path: str, stream_name: str) -> dict:
+    """Return the discovered catalog with only `stream_name` selected."""
+    process = subprocess.run(
+        TAP_COMMAND + ["--config", config_path, "--discover"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    check_exit_code("discovery", process.returncode, process.stderr)
+    catalog = json.loads(process.stdout)
+    for entry in catalog["streams"]:
+        for metadata in entry["metadata"]:
+            if metadata["breadcrumb"] == []:
+                metadata["metadata"]["selected"] = entry["tap_stream_id"] == stream_name
+    return catalog
+
+
+def benchmark_stream(
+    server: CassetteServer, stream_name: str, settings: Optional[dict] = None
+) -> Dict[str, Any]:
+    """Sync one stream in a tap process and return its throughput and resource use."""
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        with open(config_path, "w") as file:
+            json.dump(server.get_tap_config(settings), file)
+        catalog_path = os.path.join(directory, "catalog.json")
+        with open(catalog_path, "w") as file:
+            json.dump(get_catalog(config_path, stream_name), file)
+
+        records: Counter = Counter()
+        pages_before = server.page_count
+        started = time.monotonic()
+        first_message: Optional[float] = None
+        # The log goes to a file, as a full pipe would block the tap.
+        with tempfile.TemporaryFile() as log:
+            process = subprocess.Popen(
+                TAP_COMMAND + ["--config", config_path, "--catalog", catalog_path],
+                stdout=subprocess.PIPE,
+                stderr=log,
+            )
+            for line in process.stdout:
+                if first_message is None:
+                    first_message = time.monotonic()
+                message = json.loads(line)
+                if message["type"] == "RECORD":
+                    records[message["stream"]] += 1
+            finished = time.monotonic()
+            _, status, usage = os.wait4(process.pid, 0)
+            process.stdout.close()
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+            log.seek(0)
+            check_exit_code(f"'{stream_name}'", process.returncode, log.read())
+
+    seconds = max(finished - (first_message or started), 1e-9)
+    pages = server.page_count - pages_before
+    return {
+        "stream": stream_name,
+        "records": dict(records),
+        "pages": pages,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(sum(records.values()) / seconds, 1),
+        "pages_per_second": round(pages / seconds, 1),
+        "peak_memory_mb": round(usage.ru_maxrss / 1024, 1),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "total_seconds": round(finished - started, 3),
+    }
+
+
+def run_benchmark(
+    cassette_path: str,
+    stream_names: Optional[List[str]] = None,
+    latency: float = 0.0,
+    settings: Optional[dict] = None,
+) -> List[Dict[str, Any]]:
+    """Benchmark each stream of a cassette and return one result per stream."""
+    cassette = Cassette.load(cassette_path)
+    with CassetteServer(cassette, latency=latency) as server:
+        if not stream_names:
+            from tap_apaleo.tap import get_stream_types
+
+            stream_names = [
+                stream_type.name
+                for stream_type in get_stream_types()
+                if not stream_type.parent_stream_type
+            ]
+        return [
+            benchmark_stream(server, stream_name, settings)
+            for stream_name in stream_names
+        ]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the benchmark from the command line and print the report."""
+    parser = argparse.ArgumentParser(prog="python -m tap_apaleo.benchmark")
+    parser.add_argument("cassette")
+    parser.add_argument("--stream", action="append", dest="streams")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per response"
+    )
+    parser.add_argument(
+        "--setting",
+        action="append",
+        default=[],
+        help="tap setting as NAME=JSON, e.g. max_parallel_pages=4",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    for setting in args.setting:
+        name, _, value = setting.partition("=")
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+
+    results = run_benchmark(args.cassette, args.streams, args.latency, settings)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = (
+        "stream",
+        "records/s",
+        "pages/s",
+        "records",
+        "pages",
+        "seconds",
+        "peak MB",
+        "CPU s",
+    )
+    print(f"{columns[0]:<24}" + "".join(f"{column:>12}" for column in columns[1:]))
+    for result in results:
+        values = (
+            result["stream"],
+            result["records_per_second"],
+            result["pages_per_second"],
+            sum(result["records"].values()),
+            result["pages"],
+            result["seconds"],
+            result["peak_memory_mb"],
+            result["cpu_seconds"],
+        )
+        print(f"{values[0]:<24}" + "".join(f"{value:>12}" for value in values[1:]))
+
+
+if __name__ == "__main__":
+    main()
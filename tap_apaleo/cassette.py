@@ -0,0 +1,344 @@
+"""Record Apaleo API responses to a cassette and replay them from a local server.
+
+A cassette is a gzipped JSON Lines file. The first line holds the tap settings
+of the recording, without credentials; every further line is one interaction
+with its method, path including the query, status, content type and body.
+
+Record a cassette by running a full sync against the real API:
+
+    python -m tap_apaleo.cassette record --config config.json reservations.jsonl.gz
+
+Serve it to the tap, with an optional latency per response, by pointing the
+`api_url` and `auth_url` settings at:
+
+    python -m tap_apaleo.cassette serve reservations.jsonl.gz --latency 0.05
+"""
+
+import argparse
+import gzip
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from tap_apaleo.session import DEFAULT_POOL_SIZE, KeepAliveAdapter, get_session
+
+# Settings which are never written to a cassette, at any depth.
+SECRET_SETTINGS = ("client_id", "client_secret")
+# Query parameters which depend on the time of the run, such as window bounds.
+VOLATILE_PARAMS = ("from", "to")
+TOKEN_PATH = "/connect/token"
+REPLAYED_TOKEN = "replayed-access-token"
+
+
+def get_interaction_key(
+    method: str, path: str, ignore: Tuple[str, ...] = ()
+) -> Tuple[str, str, str]:
+    """Return the key of a request, independent of the order of its query."""
+    url = urlsplit(path)
+    params = sorted((k, v) for k, v in parse_qsl(url.query) if k not in ignore)
+    return method.upper(), url.path, urlencode(params)
+
+
+def strip_secrets(value: Any) -> Any:
+    """Return the settings without secrets, also those of every account."""
+    if isinstance(value, dict):
+        return {
+            key: strip_secrets(item)
+            for key, item in value.items()
+            if key not in SECRET_SETTINGS
+        }
+    if isinstance(value, list):
+        return [strip_secrets(item) for item in value]
+    return value
+
+
+class Cassette:
+    """Recorded interactions, looked up by method, path and query."""
+
+    def __init__(self, config: Optional[dict] = None) -> None:
+        """Initialize an empty cassette for a recording with the given settings."""
+        self.config = strip_secrets(config or {})
+        self.interactions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(
+        self, method: str, path: str, status: int, content_type: str, body: str
+    ) -> None:
+        """Record one interaction."""
+        with self._lock:
+            self.interactions.append(
+                {
+                    "method": method.upper(),
+                    "path": path,
+                    "status": status,
+                    "content_type": content_type,
+                    "body": body,
+                }
+            )
+
+    def save(self, path: str) -> None:
+        """Write the cassette to a gzipped JSON Lines file."""
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            file.write(json.dumps({"config": self.config}) + "\n")
+            for interaction in self.interactions:
+                file.write(json.dumps(interaction) + "\n")
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        """Read a cassette written by `save`."""
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            cassette = cls(json.loads(file.readline())["config"])
+            cassette.interactions = [json.loads(line) for line in file if line.strip()]
+        return cassette
+
+
+class RecordingAdapter(KeepAliveAdapter):
+    """Keep-alive adapter which records every response into a cassette."""
+
+    def __init__(self, cassette: Cassette, *args, **kwargs) -> None:
+        """Initialize the adapter, recording into `cassette`."""
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def send(self, request, *args, **kwargs) -> requests.Response:
+        """Send the request and record its response."""
+        response = super().send(request, *args, **kwargs)
+        path = urlsplit(request.url).path
+        body = response.content.decode("utf-8")
+        if path.endswith(TOKEN_PATH) and response.ok:
+            token = json.loads(body)
+            token["access_token"] = REPLAYED_TOKEN
+            body = json.dumps(token)
+        self.cassette.add(
+            request.method,
+            request.path_url,
+            response.status_code,
+            response.headers.get("Content-Type", "application/json"),
+            body,
+        )
+        return response
+
+
+class _Replay:
+    """Responses of a cassette, prepared for serving."""
+
+    def __init__(self, cassette: Cassette) -> None:
+        self.exact: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self.loose: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = defaultdict(list)
+        self.served: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.lock = threading.Lock()
+        for interaction in cassette.interactions:
+            body = interaction["body"].encode("utf-8")
+            response = {**interaction, "body": body, "gzip": gzip.compress(body)}
+            method, path = interaction["method"], interaction["path"]
+            self.exact[get_interaction_key(method, path)] = response
+            self.loose[get_interaction_key(method, path, VOLATILE_PARAMS)].append(
+                response
+            )
+
+    def find(self, method: str, path: str) -> Optional[Dict[str, Any]]:
+        """Return the response for a request.
+
+        Requests whose time bounds differ from the recording get the responses
+        recorded for the same request without bounds, in recorded order.
+        """
+        if urlsplit(path).path == TOKEN_PATH:
+            method, path = "POST", TOKEN_PATH
+        response = self.exact.get(get_interaction_key(method, path))
+        if response is not None:
+            return response
+
+        key = get_interaction_key(method, path, VOLATILE_PARAMS)
+        candidates = self.loose.get(key)
+        if not candidates:
+            return None
+        with self.lock:
+            index = self.served[key]
+            self.served[key] += 1
+        return candidates[index % len(candidates)]
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CassetteServer:
+    """Local stand-in for the Apaleo API and identity server."""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        """Initialize the server; a port of 0 picks a free one."""
+        self.cassette = cassette
+        self.latency = latency
+        self.request_counts: Dict[str, int] = defaultdict(int)
+        self._replay = _Replay(cassette)
+        self._server = _ThreadingHTTPServer((host, port), self._get_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Return the base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def page_count(self) -> int:
+        """Return the number of API requests served, without token requests."""
+        return sum(
+            count for path, count in self.request_counts.items() if path != TOKEN_PATH
+        )
+
+    def get_tap_config(self, config: Optional[dict] = None) -> dict:
+        """Return tap settings which send all requests to this server.
+
+        Credentials removed from the cassette are replaced by stand-ins.
+        """
+        replayed = {key: "replay" for key in SECRET_SETTINGS}
+        tap_config = {
+            **replayed,
+            **self.cassette.config,
+            **(config or {}),
+            "api_url": self.url,
+            "auth_url": self.url + TOKEN_PATH,
+        }
+        if "accounts" in tap_config:
+            tap_config["accounts"] = [
+                {**replayed, **account} for account in tap_config["accounts"]
+            ]
+        return tap_config
+
+    def start(self) -> "CassetteServer":
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve requests in the current thread until `stop` is called."""
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "CassetteServer":
+        """Start the server."""
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        """Stop the server."""
+        self.stop()
+
+    def _get_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                self._replay()
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._replay()
+
+            def _replay(self) -> None:
+                with server._replay.lock:
+                    server.request_counts[urlsplit(self.path).path] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                response = server._replay.find(self.command, self.path)
+                if response is None:
+                    status, content_type = 404, "application/json"
+                    body = json.dumps({"message": f"Not in cassette: {self.path}"})
+                    content = body.encode("utf-8")
+                    encoding = None
+                else:
+                    status, content_type = response["status"], response["content_type"]
+                    encoding = (
+                        "gzip"
+                        if "gzip" in self.headers.get("Accept-Encoding", "")
+                        else None
+                    )
+                    content = response["gzip"] if encoding else response["body"]
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+def record(config: dict, path: str) -> Cassette:
+    """Run a full sync with `config` and record all responses to `path`."""
+    from tap_apaleo.tap import TapApaleo
+
+    cassette = Cassette(config)
+    pool_size = config.get("http_pool_size", DEFAULT_POOL_SIZE)
+    adapter = RecordingAdapter(cassette, pool_connections=4, pool_maxsize=pool_size)
+    session = get_session(pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    with redirect_stdout(io.StringIO()):
+        TapApaleo(config=config).sync_all()
+    cassette.save(path)
+    return cassette
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Record or serve a cassette from the command line."""
+    parser = argparse.ArgumentParser(prog="python -m tap_apaleo.cassette")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    record_parser = commands.add_parser("record", help="record a full sync")
+    record_parser.add_argument("--config", required=True, help="tap config file")
+    record_parser.add_argument("cassette")
+    serve_parser = commands.add_parser("serve", help="serve a recorded cassette")
+    serve_parser.add_argument("cassette")
+    serve_parser.add_argument("--latency", type=float, default=0.0)
+    serve_parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        with open(args.config) as file:
+            cassette = record(json.load(file), args.cassette)
+        print(f"Recorded {len(cassette.interactions)} responses to {args.cassette}")
+        return
+
+    server = CassetteServer(
+        Cassette.load(args.cassette), latency=args.latency, port=args.port
+    )
+    config = server.get_tap_config()
+    print(f"Serving {args.cassette} at {server.url}")
+    print(f"api_url: {config['api_url']}, auth_url: {config['auth_url']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,345 @@
 """REST client handling, including ApaleoStream base class."""
 
+import asyncio
+import hashlib
+import itertools
+import json
+import random
 import requests
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, Optional, Union, List, Iterable
+from weakref import WeakKeyDictionary
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Generator,
+    Iterator,
+    Optional,
+    Union,
+    List,
+    Iterable,
+    Tuple,
+)
 
-from memoization import cached
+import pendulum
 
+from singer.messages import RecordMessage, SchemaMessage, StateMessage
+from singer_sdk.helpers._state import increment_state
 from singer_sdk.helpers.jsonpath import extract_jsonpath
+from singer_sdk.helpers._util import utc_now
 from singer_sdk.streams import RESTStream
 
 from tap_apaleo.auth import ApaleoAuthenticator
+from tap_apaleo.conform import compile_conformer
+from tap_apaleo.concurrency import ordered_map, prefetch, run_ahead
+from tap_apaleo.dedup import DedupIndex
+from tap_apaleo.metrics import PartitionMetrics, get_metrics, timed
+from tap_apaleo.paging import (
+    DEFAULT_TARGET_PAGE_SECONDS,
+    KeysetToken,
+    PageSizer,
+    PageTimeoutError,
+    PageToken,
+    get_request_page_size,
+)
+from tap_apaleo.parsing import can_stream, get_items_key, iter_list_items
+from tap_apaleo.pipeline import DEFAULT_BUFFER_MB, OutputWriter, get_output_writer
+from tap_apaleo.reference import ReferenceCache, get_reference_cache
+from tap_apaleo.ratelimit import (
+    DEFAULT_MAX_CONCURRENT_REQUESTS,
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    THROTTLE_STATUS_CODES,
+    get_rate_limiter,
+    get_retry_after,
+)
+from tap_apaleo.serialization import (
+    JSON_BACKEND,
+    dump_message,
+    loads,
+    write_message,
+)
+from tap_apaleo.session import DEFAULT_POOL_SIZE, get_session, get_session_stats
+from tap_apaleo.windows import get_time_windows
+
+if TYPE_CHECKING:
+    from tap_apaleo.aio import AsyncEngine
+    from tap_apaleo.batch import BatchWriter
 
 
 SCHEMAS_DIR = Path(__file__).parent / Path("./schemas")
+DEFAULT_API_URL = "https://api.apaleo.com"
+API_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+MAX_THROTTLE_RETRIES = 8
+MAX_REQUEST_TRIES = 5
+DEFAULT_REQUEST_TIMEOUT = 300
+# Gateway and request timeouts, after which a page is retried in smaller pages.
+TIMEOUT_STATUS_CODES = (408, 504)
+# Context keys of the request units of a partition, left out of its metrics.
+WINDOW_CONTEXT_KEYS = ("window_from", "window_to")
+
+
+def get_response_size(response: requests.Response) -> int:
+    """Return the number of body bytes received, compressed if sent compressed."""
+    if "Content-Length" in response.headers:
+        return int(response.headers["Content-Length"])
+    if getattr(response, "_content_consumed", False):
+        return len(response.content or b"")
+    return 0
+
+
+def download_body(response: requests.Response) -> int:
+    """Download the whole body of a streamed response, and return its size."""
+    return len(response.content or b"")
+
+
+def get_record_hash(row: dict) -> str:
+    """Return a short, stable hash of the content of a record."""
+    content = json.dumps(row, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+
+class LazySchema:
+    """Stream `schema` class attribute which builds the schema on first access.
+
+    Streams that a run does not instantiate never build their schema.
+    """
+
+    def __init__(self, build: Callable[[], dict]) -> None:
+        """Initialize the attribute with the function building the schema."""
+        self._build = build
+        self._schema: Optional[dict] = None
+
+    def __get__(self, instance: Any, owner: type) -> dict:
+        if self._schema is None:
+            self._schema = self._build()
+        return self._schema
+
+
+class SendAttempts:
+    """Attempts to send one request, shared by the thread and asyncio engines.
+
+    Decides when to retry a request after throttling or a rejected token, and
+    when a timed out page is split. Only the transport and the token refresh
+    differ between the engines.
+    """
+
+    def __init__(
+        self, stream: "ApaleoStream", prepared_request, context: Optional[dict]
+    ) -> None:
+        """Initialize the attempts with the settings of the stream."""
+        config = stream.config
+        self.rate_limiter = get_rate_limiter(
+            config.get("max_requests_per_second"),
+            config.get("max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS),
+        )
+        self.priority = stream.get_request_priority(context)
+        self.timeout = config.get("request_timeout", DEFAULT_REQUEST_TIMEOUT)
+        self.metrics = stream.get_partition_metrics(context)
+        self.logger = stream.logger
+        self.path_url = prepared_request.path_url
+        page_size = get_request_page_size(prepared_request.url)
+        self.can_split = page_size is not None and stream.page_sizer.can_split(
+            page_size
+        )
+        self.max_retries = config.get("max_throttle_retries", MAX_THROTTLE_RETRIES)
+        self.attempt = 0
+        self.reauthenticated = False
+
+    @contextmanager
+    def waiting(self) -> Iterator[None]:
+        """Count the time spent waiting for the rate limiter."""
+        waiting_since = time.monotonic()
+        yield
+        self.metrics.add("throttle_wait_seconds", time.monotonic() - waiting_since)
+
+    @contextmanager
+    def sending(self) -> Iterator[None]:
+        """Release the rate limiter after sending, raise timeouts of split pages."""
+        try:
+            yield
+        except requests.exceptions.Timeout as ex:
+            if self.can_split:
+                raise PageTimeoutError(str(ex)) from ex
+            raise
+        finally:
+            self.rate_limiter.release()
+
+    def needs_new_token(self, response: requests.Response) -> bool:
+        """Return True to refresh a rejected token and send the request again.
+
+        The token may have been revoked or have expired early. This is done once.
+        """
+        if response.status_code != 401 or self.reauthenticated:
+            return False
+        self.reauthenticated = True
+        self.metrics.add("retries")
+        return True
+
+    def needs_retry(self, response: requests.Response) -> bool:
+        """Return True to send a throttled request again, after its `Retry-After`.
+
+        A page which timed out at the gateway raises `PageTimeoutError` if it can
+        be split.
+        """
+        if self.can_split and response.status_code in TIMEOUT_STATUS_CODES:
+            raise PageTimeoutError(f"{response.status_code} {response.reason}")
+        if response.status_code not in THROTTLE_STATUS_CODES:
+            self.rate_limiter.on_success()
+            return False
+        if self.attempt == self.max_retries:
+            return False
+
+        retry_after = get_retry_after(response, self.attempt)
+        self.logger.warning(
+            f"Throttled with {response.status_code} on {self.path_url}, "
+            f"retrying in {retry_after:.1f}s."
+        )
+        self.rate_limiter.on_throttle(retry_after)
+        self.metrics.add("retries")
+        self.attempt += 1
+        return True
 
 
 class ApaleoStream(RESTStream):
     """Apaleo stream class."""
 
-    url_base = "https://api.apaleo.com"
+    # Largest page size requested; `page_sizes` overrides it per stream.
+    page_size = 1000
+    # Page size to start with when `adaptive_page_size` is enabled.
+    initial_page_size: Optional[int] = None
+
+    # Name of the setting that splits the sync into time windows, if supported.
+    window_setting: Optional[str] = None
+    # Window unit used when the `window_setting` is not set, if any.
+    default_window: Optional[str] = None
+    # URL parameter restricting a request to one property, if supported.
+    property_filter: Optional[str] = None
+    # Whether unchanged records can be skipped with the `change_detection` setting.
+    detect_changes = False
+    # Whether records arrive sorted by replication key, so a sync can resume mid-way.
+    resumable = False
+    # Whether responses are kept in the reference cache with `reference_cache_ttl`.
+    reference_data = False
+    # URL parameter which `keyset_pagination` moves to the replication key value
+    # of the last record, if supported.
+    cursor_param: Optional[str] = None
+    # Properties the API only returns when they are listed in the `expand` parameter.
+    expand_properties: List[str] = []
+    # Properties of the parent records which a child stream is built from.
+    parent_properties: List[str] = []
+    # Whether a child stream requests the records of several parent records at once.
+    fan_out = False
 
-    # OR use a dynamic url_base:
-    # @property
-    # def url_base(self) -> str:
-    #     """Return the API URL root, configurable via tap settings."""
-    #     return self.config["api_url"]
+    _partitions: Optional[List[dict]] = None
+    _prefetched_units: Optional[Tuple[list, Iterator, Generator]] = None
+    _record_conformer: Optional[Callable[[dict], Dict[str, Any]]] = None
+    _pruned_properties: Optional[FrozenSet[str]] = None
+    _page_sizer: Optional[PageSizer] = None
+    _dedup_index: Optional[DedupIndex] = None
+    _parent_fed_schema_written = False
+    _parent_fed_record_count = 0
+    _parent_partition: Optional[dict] = None
+    _conform_seconds = 0.0
+    _fan_out_executor: Optional[ThreadPoolExecutor] = None
+    _fanned_out_units: Optional[List[Tuple[Optional[Tuple[str, str]], Future]]] = None
 
-    #records_jsonpath = "$[*]"  # Or override `parse_response`.
-    #next_page_token_jsonpath = "$.next_page"  # Or override `get_next_page_token`.
+    def __init__(self, *args, **kwargs) -> None:
+        """Initialize the stream."""
+        super().__init__(*args, **kwargs)
+        self._record_counts: "WeakKeyDictionary[requests.Response, int]" = (
+            WeakKeyDictionary()
+        )
+        self._decoded_bodies: "WeakKeyDictionary[requests.Response, dict]" = (
+            WeakKeyDictionary()
+        )
+        self._keyset_pages: "WeakKeyDictionary[requests.Response, tuple]" = (
+            WeakKeyDictionary()
+        )
+        self._starting_timestamps: Dict[tuple, Optional[datetime]] = {}
+        self._reference_records: Dict[str, List[dict]] = {}
+        self._fanned_out: Deque[Tuple[dict, list]] = deque()
+        self._accounts = {
+            account["account_id"]: account
+            for account in self.config.get("accounts", [])
+        }
+        if self._accounts:
+            # Ids are only unique within an account, so it is part of every key.
+            self.schema = {
+                **self.schema,
+                "properties": {
+                    "accountId": {"type": ["string", "null"]},
+                    **self.schema["properties"],
+                },
+            }
+            self.primary_keys = ["accountId", *(self.primary_keys or [])]
 
     @property
-    @cached
-    def authenticator(self) -> ApaleoAuthenticator:
-        """Return a new authenticator object."""
+    def url_base(self) -> str:
+        """Return the API URL root, configurable via tap settings."""
+        return self.config.get("api_url", DEFAULT_API_URL)
+
+    # records_jsonpath = "$[*]"  # Or override `parse_response`.
+    # next_page_token_jsonpath = "$.next_page"  # Or override `get_next_page_token`.
+
+    @property
+    def authenticator(self) -> Optional[ApaleoAuthenticator]:
+        """Return the authenticator shared with the other streams.
+
+        With `accounts`, requests are authenticated per partition instead, see
+        `get_authenticator`.
+        """
+        if self._accounts:
+            return None
+        return ApaleoAuthenticator.create_for_stream(self)
+
+    def get_authenticator(self, context: Optional[dict]) -> ApaleoAuthenticator:
+        """Return the authenticator of the account a request context belongs to."""
+        if context and "accountId" in context:
+            return ApaleoAuthenticator.create_for_stream(
+                self, self._accounts[context["accountId"]]
+            )
         return ApaleoAuthenticator.create_for_stream(self)
 
+    def prepare_request(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> requests.PreparedRequest:
+        """Prepare a request, authenticated as the account of its partition."""
+        request = super().prepare_request(context, next_page_token)
+        if self._accounts:
+            request.headers.update(self.get_authenticator(context).auth_headers)
+        return request
+
+    @property
+    def requests_session(self) -> requests.Session:
+        """Return the pooled session shared by all streams."""
+        return get_session(self.config.get("http_pool_size", DEFAULT_POOL_SIZE))
+
+    @property
+    def engine(self) -> Optional["AsyncEngine"]:
+        """Return the asyncio engine if the `engine` setting selects it.
+
+        The engine module, and `aiohttp` with it, is only imported then.
+        """
+        if self.config.get("engine") != "asyncio":
+            return None
+        from tap_apaleo.aio import get_engine
+
+        return get_engine(
+            self.config.get("http_pool_size", DEFAULT_POOL_SIZE),
+            self.config.get("max_parallel_partitions", 1),
+        )
+
     @property
     def http_headers(self) -> dict:
         """Return the http headers needed."""
@@ -43,36 +348,158 @@ class ApaleoStream(RESTStream):
             headers["User-Agent"] = self.config.get("user_agent")
         return headers
 
+    @property
+    def max_page_size(self) -> int:
+        """Return the largest page size of the stream, configurable per stream."""
+        return self.config.get("page_sizes", {}).get(self.name, self.page_size)
+
+    @property
+    def page_sizer(self) -> PageSizer:
+        """Return the page sizer of the stream, which adapts if enabled."""
+        if self._page_sizer is None:
+            self._page_sizer = PageSizer(
+                self.max_page_size,
+                initial_size=self.initial_page_size,
+                adaptive=self.config.get("adaptive_page_size", False),
+                target_seconds=self.config.get(
+                    "target_page_seconds", DEFAULT_TARGET_PAGE_SECONDS
+                ),
+            )
+        return self._page_sizer
+
     def get_next_page_token(
         self, response: requests.Response, previous_token: Optional[Any]
     ) -> Optional[Any]:
         """Return a token for identifying next page or None if no more pages."""
+        previous_token = previous_token or self.get_first_page_token()
+        if isinstance(previous_token, KeysetToken):
+            return self._keyset_pages[response][1]
 
-        if(response.status_code == 204):
+        offset = previous_token.offset + previous_token.size
+        if offset >= self.get_record_count(response):
             return None
 
-        previous_token = previous_token or 1
-        data = response.json()
-        size = 1000
-        count = data["count"]
+        return PageToken(offset, self.page_sizer.get_size(offset))
+
+    def get_first_page_token(self) -> Union[PageToken, KeysetToken]:
+        """Return the token of the first page."""
+        if self.keyset_pagination:
+            return KeysetToken(0, self.page_sizer.get_size(0))
+        return PageToken(0, self.page_sizer.get_size(0))
+
+    @property
+    def keyset_pagination(self) -> bool:
+        """Return True if pages start at the cursor of the previous page."""
+        return bool(self.cursor_param and self.config.get("keyset_pagination"))
+
+    def _get_next_keyset_token(
+        self, response: requests.Response, token: KeysetToken
+    ) -> Optional[KeysetToken]:
+        """Return the page after a keyset page, from the records it returned.
 
-        if previous_token*size >= count:
+        The cursor is the replication key value of the last record, in whole
+        seconds as the API expects, so it may be up to a second before that value.
+        All records at or after the cursor are remembered to be skipped.
+        """
+        records = list(
+            extract_jsonpath(self.records_jsonpath, input=self._decode_body(response))
+        )
+        if not records or token.offset + len(records) >= self.get_record_count(
+            response
+        ):
             return None
 
-        return previous_token + 1
+        last_value = pendulum.parse(records[-1][self.replication_key])
+        cursor = last_value.in_timezone("UTC").strftime(API_DATE_FORMAT)
+        at_cursor = frozenset(
+            record["id"]
+            for record in records
+            if pendulum.parse(record[self.replication_key]) >= pendulum.parse(cursor)
+        )
+        if cursor == token.cursor:
+            # The whole page shares the cursor, which cannot move past it.
+            offset = token.offset + token.size
+            return KeysetToken(
+                offset, self.page_sizer.get_size(offset), cursor, token.seen | at_cursor
+            )
+        return KeysetToken(0, self.page_sizer.get_size(0), cursor, at_cursor)
+
+    def _decode_body(self, response: requests.Response) -> dict:
+        """Return the decoded body, kept until `parse_response` uses it."""
+        if response not in self._decoded_bodies:
+            self._decoded_bodies[response] = loads(response.content)
+        return self._decoded_bodies[response]
+
+    def get_record_count(self, response: requests.Response) -> int:
+        """Return the total number of records announced by the `count` of a response."""
+        if response.status_code == 204:
+            return 0
+
+        count = self._record_counts.get(response)
+        if count is None:
+            # Keep the decoded body for `parse_response`, which may run later.
+            count = self._record_counts[response] = self._decode_body(response)["count"]
+        return count
+
+    def get_paging_params(
+        self, next_page_token: Optional[Union[PageToken, KeysetToken]]
+    ) -> Dict[str, Any]:
+        """Return the `pageSize` and `pageNumber` URL parameters of a page."""
+        token = next_page_token or self.get_first_page_token()
+        params: Dict[str, Any] = {"pageSize": token.size}
+        if token.offset:
+            params["pageNumber"] = token.offset // token.size + 1
+        return params
+
+    def get_cursor_params(self, next_page_token: Optional[Any]) -> Dict[str, Any]:
+        """Return the `cursor_param` of a keyset page after the first, if any.
+
+        It replaces the start of the range the stream requests otherwise.
+        """
+        if isinstance(next_page_token, KeysetToken) and next_page_token.cursor:
+            return {self.cursor_param: next_page_token.cursor}
+        return {}
+
+    def is_property_needed(self, name: str) -> bool:
+        """Return True if a property is selected, or a selected child needs it."""
+        return self.mask[("properties", name)] or any(
+            child_stream.selected and name in child_stream.parent_properties
+            for child_stream in self.child_streams
+        )
+
+    def get_expand_param(self) -> Optional[str]:
+        """Return the `expand` URL parameter for the needed properties, if any."""
+        expand = [
+            name for name in self.expand_properties if self.is_property_needed(name)
+        ]
+        return ",".join(expand) or None
+
+    @property
+    def pruned_properties(self) -> FrozenSet[str]:
+        """Return the top-level properties dropped from records right after parsing.
+
+        These are the properties deselected in the catalog, except for keys and
+        properties a selected child stream is built from.
+        """
+        if self._pruned_properties is None:
+            keys = set(self.primary_keys or []) | {self.replication_key}
+            self._pruned_properties = frozenset(
+                name
+                for name in self.schema["properties"]
+                if name not in keys and not self.is_property_needed(name)
+            )
+        return self._pruned_properties
 
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[Any]
     ) -> Dict[str, Any]:
         """Return a dictionary of values to be used in URL parameterization."""
         params: dict = {}
-        params["pageSize"] = 1000
-        if next_page_token:
-            params["pageNumber"] = next_page_token
+        params.update(self.get_paging_params(next_page_token))
         if self.replication_key:
             params["sort"] = "asc"
             params["order_by"] = self.replication_key
-        self.logger.info(params)    
+        params.update(self.get_partition_params(context))
         return params
 
     def prepare_request_payload(
@@ -85,15 +512,1171 @@ class ApaleoStream(RESTStream):
         # TODO: Delete this method if no payload is required. (Most REST APIs.)
         return None
 
+    @property
+    def partitions(self) -> Optional[List[dict]]:
+        """Return one partition per account and, if enabled, per property.
+
+        Without `accounts` and property partitioning, the stream is not partitioned.
+        """
+        by_property = bool(self.property_filter) and bool(
+            self.config.get("partition_by_property") or self.config.get("property_ids")
+        )
+        if self.parent_stream_type or not (self._accounts or by_property):
+            return super().partitions
+
+        if self._partitions is None:
+            accounts = [{"accountId": account_id} for account_id in self._accounts]
+            partitions = []
+            for account in accounts or [{}]:
+                if not by_property:
+                    partitions.append(account)
+                    continue
+                property_ids = self._get_account_property_ids(account)
+                partitions.extend(
+                    {**account, "propertyId": property_id}
+                    for property_id in property_ids
+                )
+            self._partitions = partitions
+        return self._partitions
+
+    def _get_account_property_ids(self, account: dict) -> List[str]:
+        """Return the configured or else all property ids of an account."""
+        settings = self._accounts.get(account.get("accountId"), self.config)
+        property_ids = settings.get("property_ids") or self.config.get("property_ids")
+        if property_ids:
+            return property_ids
+        return self._tap.streams["properties"].get_property_ids(account or None)
+
+    def get_partition_params(self, context: Optional[dict]) -> Dict[str, Any]:
+        """Return the URL parameters restricting a request to its partition."""
+        if context and "propertyId" in context:
+            return {self.property_filter: context["propertyId"]}
+        return {}
+
+    def get_windows(self, context: Optional[dict]) -> Optional[List[Tuple[str, str]]]:
+        """Return the `(from, to)` time windows to sync, or None if not windowed."""
+        unit = (
+            self.config.get(self.window_setting, self.default_window)
+            if self.window_setting
+            else None
+        )
+        if not unit:
+            return None
+
+        windows = get_time_windows(
+            anchor=pendulum.parse(self.config["start_date"]),
+            start=self.get_starting_timestamp(context),
+            end=self.get_window_end(context),
+            unit=unit,
+        )
+        return [
+            (window_from.strftime(API_DATE_FORMAT), window_to.strftime(API_DATE_FORMAT))
+            for window_from, window_to in windows
+        ]
+
+    def get_window_end(self, context: Optional[dict]) -> datetime:
+        """Return the end of the last time window to sync."""
+        return utc_now()
+
+    def get_window_context(
+        self, context: Optional[dict], window: Optional[Tuple[str, str]]
+    ) -> Optional[dict]:
+        """Return the request context for one time window of a partition."""
+        if window is None:
+            return context
+        return {**(context or {}), "window_from": window[0], "window_to": window[1]}
+
+    def get_partition_metrics(self, context: Optional[dict]) -> PartitionMetrics:
+        """Return the metrics of the partition a request or record context is in.
+
+        Child streams fed by their parent count all their records under the
+        partition of the parent that is being synced.
+        """
+        if self.parent_stream_type:
+            context = self._parent_partition
+        elif context:
+            context = {
+                key: value
+                for key, value in context.items()
+                if key not in WINDOW_CONTEXT_KEYS
+            }
+        return get_metrics().get_partition(self.name, context or None)
+
+    def _write_partition_metrics(self, metrics: PartitionMetrics) -> None:
+        """Log the totals of a finished partition as METRIC lines."""
+        metrics.finish()
+        for metric in metrics.get_metric_logs():
+            self._write_metric_log(metric, extra_tags=None)
+
+    def get_records(self, context: Optional[dict]) -> Iterable[Dict[str, Any]]:
+        """Return a generator of row-type dictionary objects.
+
+        Each partition is synced as a sequence of request units, one per pending
+        time window or a single one for streams without windows. Up to
+        `max_parallel_partitions` units, across all partitions of the stream, are
+        fetched at once, but records are still emitted partition by partition and
+        window by window. Every closed window is recorded in the state once
+        emitted, so an interrupted backfill skips it on resume.
+
+        With change detection enabled, streams that support it only emit records
+        whose content hash differs from the one stored in the partition state.
+
+        With `dedup_index_size`, records emitted before in this sync with the same
+        key and version are dropped, and counted as duplicates in the metrics.
+
+        Resumable streams keep a checkpoint in the partition state: the replication
+        key value of the last emitted record and the keys of all emitted records
+        with that value. A STATE message is written after every `max_page_size`
+        records. A sync interrupted after that resumes from the checkpoint and
+        skips exactly the records which were already emitted.
+
+        Each of these steps is a generator stage of its own, chained here.
+        """
+        state = self.get_context_state(context)
+        metrics = self.get_partition_metrics(context)
+        if not self.parent_stream_type:
+            for child_stream in self.child_streams:
+                child_stream.start_parent_partition(context)
+        rows = self._iter_windows(context, state)
+        rows = self._skip_checkpointed(rows, state)
+        rows = self._drop_duplicates(rows, context, metrics)
+        rows = self._skip_unchanged(rows, context, state)
+        rows = self._checkpoint_emitted(rows, state)
+        yielded = 0
+        try:
+            for row in rows:
+                yielded += 1
+                yield row
+        except BaseException:
+            self._close_prefetched_units()
+            for child_stream in self.child_streams:
+                child_stream.close_fan_out()
+            raise
+        finally:
+            if not self.parent_stream_type:
+                metrics.add("records", yielded)
+                # The SDK conforms each record before it resumes this generator.
+                metrics.add("conform_seconds", self._conform_seconds)
+                self._conform_seconds = 0.0
+        for child_stream in self.child_streams:
+            child_stream.finish_parent_partition(context)
+        if not self.parent_stream_type:
+            self._write_partition_metrics(metrics)
+        self.logger.debug(f"HTTP connection pool: {get_session_stats()}")
+
+    def _iter_windows(self, context: Optional[dict], state: dict) -> Iterator[dict]:
+        """Yield the post-processed records of a partition, window by window.
+
+        A closed window is recorded in `completed_windows` once all its records
+        were emitted. The list is dropped once the partition is done.
+        """
+        completed = set(state.get("completed_windows", []))
+        now = utc_now().strftime(API_DATE_FORMAT)
+        for window, records in self._get_request_units(context):
+            for row in records:
+                yield self.post_process(row, context)
+            if window and window[1] <= now:
+                completed.add(window[1])
+                state["completed_windows"] = sorted(completed)
+        state.pop("completed_windows", None)
+
+    def _skip_checkpointed(self, rows: Iterator[dict], state: dict) -> Iterator[dict]:
+        """Skip the records an interrupted sync delivered up to its checkpoint."""
+        if not self.resumable or "checkpoint" not in state:
+            yield from rows
+            return
+
+        checkpoint = state["checkpoint"]
+        resume_at, keys = pendulum.parse(checkpoint["value"]), set(checkpoint["keys"])
+        for row in rows:
+            value = pendulum.parse(row[self.replication_key])
+            if value > resume_at:
+                yield row
+                break
+            if value == resume_at and self.get_record_key(row) not in keys:
+                yield row
+        yield from rows
+
+    def _drop_duplicates(
+        self, rows: Iterator[dict], context: Optional[dict], metrics: PartitionMetrics
+    ) -> Iterator[dict]:
+        """Drop records emitted before in this sync, if `dedup_index_size` is set."""
+        dedup = self.dedup_index
+        if dedup is None:
+            yield from rows
+            return
+
+        account_id = (context or {}).get("accountId")
+        duplicates = 0
+        try:
+            for row in rows:
+                key, version = self.get_record_key(row), self.get_record_version(row)
+                if dedup.add(account_id, key, version):
+                    yield row
+                else:
+                    duplicates += 1
+        finally:
+            metrics.add("duplicates", duplicates)
+        if duplicates:
+            self.logger.info(f"Dropped {duplicates} repeated records of {self.name}.")
+
+    def _skip_unchanged(
+        self, rows: Iterator[dict], context: Optional[dict], state: dict
+    ) -> Iterator[dict]:
+        """Skip records whose hash is in the state, if `change_detection` is set.
+
+        The children of a skipped record are still synced. A hash is only stored
+        once its record was written, and hashes of records which are gone are
+        dropped at the end, so they are emitted again if restored.
+        """
+        if not (self.detect_changes and self.config.get("change_detection")):
+            yield from rows
+            return
+
+        hashes: Dict[str, str] = state.setdefault("record_hashes", {})
+        seen_hashes: Dict[str, str] = {}
+        for row in rows:
+            key, digest = self.get_record_key(row), get_record_hash(row)
+            seen_hashes[key] = digest
+            if hashes.get(key) != digest:
+                yield row
+                hashes[key] = digest
+            elif self.child_streams:
+                self._sync_children(self.get_child_context(row, context))
+        state["record_hashes"] = seen_hashes
+
+    def _checkpoint_emitted(self, rows: Iterator[dict], state: dict) -> Iterator[dict]:
+        """Advance the checkpoint of resumable streams as records are written.
+
+        A STATE message is written after every `max_page_size` records. Once the
+        partition is done, the checkpoint becomes its bookmark.
+        """
+        if not self.resumable:
+            yield from rows
+            return
+
+        for emitted, row in enumerate(rows, start=1):
+            yield row
+            # The SDK has written the record when the generator resumes.
+            self._advance_checkpoint(state, row)
+            if emitted % self.max_page_size == 0:
+                self._write_state_message()
+        checkpoint = state.pop("checkpoint", None)
+        if checkpoint:
+            # Keep the progress of an interrupted sync, even if nothing was added.
+            increment_state(
+                state,
+                latest_record={self.replication_key: checkpoint["value"]},
+                replication_key=self.replication_key,
+                is_sorted=False,
+            )
+
+    def _advance_checkpoint(self, state: dict, row: dict) -> None:
+        """Record an emitted record in the resume checkpoint of its partition.
+
+        Values are compared as times, as the same time may be written with
+        different offsets.
+        """
+        value = row[self.replication_key]
+        key = self.get_record_key(row)
+        checkpoint = state.get("checkpoint")
+        if checkpoint and (
+            checkpoint["value"] == value
+            or pendulum.parse(checkpoint["value"]) == pendulum.parse(value)
+        ):
+            checkpoint["keys"].append(key)
+        else:
+            state["checkpoint"] = {"value": value, "keys": [key]}
+
+    def get_starting_timestamp(self, context: Optional[dict]) -> Optional[datetime]:
+        """Return the start of the sync of a partition, in UTC.
+
+        The value is fixed at its first call, so it does not move while the state
+        advances during the sync. A checkpoint left by an interrupted sync moves
+        it forward.
+        """
+        key = tuple(sorted((context or {}).items()))
+        if key not in self._starting_timestamps:
+            start = super().get_starting_timestamp(context)
+            checkpoint = self.get_context_state(context).get("checkpoint")
+            if self.resumable and checkpoint:
+                resume_at = pendulum.parse(checkpoint["value"])
+                start = resume_at if start is None else max(start, resume_at)
+            if start is not None:
+                start = pendulum.instance(start).in_timezone("UTC")
+            self._starting_timestamps[key] = start
+        return self._starting_timestamps[key]
+
+    def _sync_children(self, child_context: dict) -> None:
+        """Feed the selected child streams with the context of one parent record."""
+        for child_stream in self.child_streams:
+            if child_stream.selected:
+                child_stream.sync_from_parent(child_context)
+
+    def sync_from_parent(self, context: dict) -> None:
+        """Emit the records of this child stream for one parent record.
+
+        Unlike the SDK's per-parent `sync`, the schema is written once and no
+        state or log messages are written per parent record. The record count is
+        logged by `finish_parent_partition` once the parent partition is done.
+
+        Streams which `fan_out` request the records of up to
+        `max_parallel_partitions` parent records at once in a thread pool, and
+        emit them in the order of the parents as they complete.
+        """
+        if not self._parent_fed_schema_written:
+            self._write_schema_message()
+            self._parent_fed_schema_written = True
+        max_workers = self.config.get("max_parallel_partitions", 1)
+        if not self.fan_out or max_workers <= 1:
+            self._emit_from_parent(context)
+            return
+
+        # Fan out: request the units of this parent now, emit them in parent order.
+        if self._fan_out_executor is None:
+            self._fan_out_executor = ThreadPoolExecutor(max_workers=max_workers)
+        units = [
+            (
+                window,
+                self._fan_out_executor.submit(
+                    self._fetch_unit, self.get_window_context(context, window)
+                ),
+            )
+            for window in self._plan_request_units(context)
+        ]
+        self._fanned_out.append((context, units))
+        self._emit_fanned_out(max_pending=2 * max_workers)
+
+    def _emit_from_parent(self, context: dict) -> None:
+        for row in self.get_records(context):
+            self._write_record_message(row)
+            self._parent_fed_record_count += 1
+
+    def _fetch_unit(self, context: Optional[dict]) -> List[dict]:
+        """Return all records of a request unit, for a fan-out worker thread."""
+        return list(self.request_records(context))
+
+    def _emit_fanned_out(self, max_pending: int) -> None:
+        """Emit the fanned out parents in order, as far as their units are done.
+
+        Waits for the first parent while more than `max_pending` units are pending.
+        """
+        while self._fanned_out:
+            context, units = self._fanned_out[0]
+            pending = sum(len(units) for _, units in self._fanned_out)
+            if pending <= max_pending and not all(
+                future.done() for _, future in units
+            ):
+                return
+            self._fanned_out.popleft()
+            self._fanned_out_units = units
+            self._emit_from_parent(context)
+
+    def close_fan_out(self) -> None:
+        """Cancel the requests of parents which were not emitted."""
+        for _, units in self._fanned_out:
+            for _, future in units:
+                future.cancel()
+        self._fanned_out.clear()
+        self._fanned_out_units = None
+        if self._fan_out_executor is not None:
+            self._fan_out_executor.shutdown(wait=False)
+            self._fan_out_executor = None
+
+    def start_parent_partition(self, context: Optional[dict]) -> None:
+        """Count the metrics of the next records under a parent partition."""
+        self._parent_partition = context
+        self.get_partition_metrics(context)
+        for child_stream in self.child_streams:
+            child_stream.start_parent_partition(context)
+
+    def finish_parent_partition(self, context: Optional[dict]) -> None:
+        """Log the records and metrics of a parent partition, if any.
+
+        Records of the partition which were fanned out are emitted first.
+        """
+        self._emit_fanned_out(max_pending=0)
+        self.close_fan_out()
+        if self._parent_fed_record_count:
+            self._write_record_count_log(self._parent_fed_record_count, context)
+            metrics = self.get_partition_metrics(context)
+            metrics.add("records", self._parent_fed_record_count)
+            metrics.add("conform_seconds", self._conform_seconds)
+            self._write_partition_metrics(metrics)
+            self._parent_fed_record_count = 0
+            self._conform_seconds = 0.0
+
+    def get_record_key(self, row: dict) -> str:
+        """Return the primary key of a record as a single string."""
+        return "|".join(str(row.get(key)) for key in self.primary_keys or [])
+
+    def get_record_version(self, row: dict) -> str:
+        """Return the replication key value of a record, or else its content hash."""
+        if self.replication_key:
+            return str(row.get(self.replication_key))
+        return get_record_hash(row)
+
+    @property
+    def dedup_index(self) -> Optional[DedupIndex]:
+        """Return the index of emitted records if `dedup_index_size` is set."""
+        size = self.config.get("dedup_index_size")
+        if not size:
+            return None
+        if self._dedup_index is None:
+            self._dedup_index = DedupIndex(size)
+        return self._dedup_index
+
+    def _plan_request_units(
+        self, context: Optional[dict]
+    ) -> List[Optional[Tuple[str, str]]]:
+        """Return the pending windows of a partition, or `[None]` if not windowed."""
+        windows = self.get_windows(context)
+        if windows is None:
+            return [None]
+
+        completed = set(self.get_context_state(context).get("completed_windows", []))
+        return [window for window in windows if window[1] not in completed]
+
+    def _get_request_units(
+        self, context: Optional[dict]
+    ) -> Iterable[Tuple[Optional[Tuple[str, str]], Iterable[dict]]]:
+        """Yield `(window, records)` for each request unit of a partition."""
+        if self._fanned_out_units is not None:
+            units, self._fanned_out_units = self._fanned_out_units, None
+            for window, future in units:
+                yield window, future.result()
+            return
+
+        if self.engine is not None:
+            yield from self._get_engine_units(context)
+            return
+
+        max_workers = self.config.get("max_parallel_partitions", 1)
+        if max_workers <= 1:
+            for window in self._plan_request_units(context):
+                window_context = self.get_window_context(context, window)
+                yield window, self.request_records(window_context)
+        elif context not in (self.partitions or []):
+            yield from self._get_window_units(context, max_workers)
+        else:
+            yield from self._get_partition_units(context, max_workers)
+
+    def _get_window_units(
+        self, context: Optional[dict], max_workers: int
+    ) -> Iterable[Tuple[Optional[Tuple[str, str]], Iterable[dict]]]:
+        """Yield the units of a partition, prefetching its windows at once."""
+        windows = self._plan_request_units(context)
+        producers = [
+            partial(self.request_records, self.get_window_context(context, window))
+            for window in windows
+        ]
+        units = prefetch(producers, max_workers, self.max_page_size)
+        try:
+            yield from zip(windows, units)
+        finally:
+            units.close()
+
+    def _get_partition_units(
+        self, context: Optional[dict], max_workers: int
+    ) -> Iterable[Tuple[Optional[Tuple[str, str]], Iterable[dict]]]:
+        """Yield the units of a partition, prefetched with those of all partitions.
+
+        Partitions are synced in order, so the first one starts prefetching the
+        request units of all partitions and each later call picks up its share.
+        """
+        if self._prefetched_units is None:
+            plan = self._plan_all_request_units()
+            producers = [
+                partial(self.request_records, self.get_window_context(*unit))
+                for unit in plan
+            ]
+            units = prefetch(producers, max_workers, self.max_page_size)
+            self._prefetched_units = (plan, iter(zip(plan, units)), units)
+        yield from self._take_prefetched_units(context)
+
+    def _plan_all_request_units(
+        self,
+    ) -> List[Tuple[Optional[dict], Optional[Tuple[str, str]]]]:
+        """Return the `(partition, window)` request units of all partitions."""
+        return [
+            (partition, window)
+            for partition in self.partitions or [None]
+            for window in self._plan_request_units(partition)
+        ]
+
+    def _take_prefetched_units(
+        self, context: Optional[dict]
+    ) -> Iterable[Tuple[Optional[Tuple[str, str]], Iterable[dict]]]:
+        """Yield the prefetched units of a partition, closing them after the last."""
+        plan, prefetched, _ = self._prefetched_units
+        for _ in range(sum(1 for unit_context, _ in plan if unit_context == context)):
+            (_, window), records = next(prefetched)
+            yield window, records
+        if context == (self.partitions or [None])[-1]:
+            self._close_prefetched_units()
+
+    def start_prefetch(self) -> None:
+        """Start fetching the request units of all partitions on the asyncio engine.
+
+        `TapApaleo.sync_all` starts all streams before syncing the first one, so
+        their requests overlap while records are still emitted stream by stream.
+        """
+        if self._prefetched_units is not None:
+            return
+        plan = self._plan_all_request_units()
+        producers = [
+            partial(self._request_responses_async, self.get_window_context(*unit))
+            for unit in plan
+        ]
+        units = self.engine.prefetch(producers, self._get_page_buffer_size())
+        records = (
+            self._parse_responses(responses, context)
+            for (context, _), responses in zip(plan, units)
+        )
+        self._prefetched_units = (plan, iter(zip(plan, records)), units)
+
+    def _get_engine_units(
+        self, context: Optional[dict]
+    ) -> Iterable[Tuple[Optional[Tuple[str, str]], Iterable[dict]]]:
+        """Yield the prefetched `(window, records)` units of a partition."""
+        self.start_prefetch()
+        yield from self._take_prefetched_units(context)
+
+    def _close_prefetched_units(self) -> None:
+        if self._prefetched_units is not None:
+            self._prefetched_units[2].close()
+            self._prefetched_units = None
+
+    def request_records(self, context: Optional[dict]) -> Iterable[dict]:
+        """Request records page by page, fetching pages 2..N concurrently if enabled.
+
+        The first page is always requested on its own to learn the total `count`.
+        With `max_parallel_pages` above one, the remaining pages are then fetched
+        through a bounded thread pool and their records are yielded in page order.
+        With `pipeline`, pages are fetched and parsed on threads of their own,
+        ahead of the records being emitted.
+        """
+        if self.engine is not None:
+            responses = self.engine.iterate(
+                self._request_responses_async(context), self._get_page_buffer_size()
+            )
+            yield from self._parse_responses(responses, context)
+            return
+
+        if self.pipelined:
+            yield from run_ahead(
+                self._parse_responses(self._request_pipelined(context), context),
+                self.max_page_size,
+            )
+            return
+
+        yield from self._parse_responses(self._request_responses(context), context)
+
+    @property
+    def pipelined(self) -> bool:
+        """Return True if pages are fetched and parsed in pipeline stages.
+
+        Child streams request a few records per parent record, which are not
+        worth the threads.
+        """
+        return bool(self.config.get("pipeline")) and not self.parent_stream_type
+
+    def _request_responses(
+        self, context: Optional[dict]
+    ) -> Iterator[requests.Response]:
+        """Yield the responses of all pages of a request unit, in order.
+
+        Pages fetched concurrently are downloaded in their worker thread. Only
+        keyset pages are decoded here, for their cursor. Other pages are decoded
+        when parsed, the first one too, before the pages after it are planned
+        from its `count`.
+        """
+        max_workers = self.config.get("max_parallel_pages", 1)
+        token: Optional[Union[PageToken, KeysetToken]] = self.get_first_page_token()
+        tokens: List[PageToken] = []
+        while token:
+            responses = self._request_page(context, token)
+            yield from responses
+            token, tokens = self._plan_next_pages(responses, token, max_workers)
+        yield from self._request_pages(context, tokens, max_workers)
+
+    def _request_pipelined(
+        self, context: Optional[dict]
+    ) -> Iterator[requests.Response]:
+        """Yield the responses of a request unit, fetched on a thread of their own.
+
+        This runs in the parse stage. The first page is requested here and parsed
+        before the rest is planned from its `count`, then all remaining pages are
+        downloaded ahead by the fetch thread, up to `pipeline_buffer_mb`. Keyset
+        pages each depend on the page before, so they are all fetched ahead.
+        """
+        max_buffered_mb = self.config.get("pipeline_buffer_mb", DEFAULT_BUFFER_MB)
+        max_buffered = max_buffered_mb * 2 ** 20
+        token = self.get_first_page_token()
+        if isinstance(token, KeysetToken):
+            yield from run_ahead(
+                self._request_responses(context), max_buffered, download_body
+            )
+            return
+
+        responses = self._request_page(context, token)
+        yield from responses
+        next_token = self.get_next_page_token(responses[-1], token)
+        if next_token is None:
+            return
+        max_workers = self.config.get("max_parallel_pages", 1)
+        tokens = self._get_remaining_pages(responses[-1], next_token)
+        yield from run_ahead(
+            self._request_pages(context, tokens, max_workers),
+            max_buffered,
+            download_body,
+        )
+
+    def _request_pages(
+        self, context: Optional[dict], tokens: List[PageToken], max_workers: int
+    ) -> Iterator[requests.Response]:
+        """Yield the responses of planned pages in order, downloading them ahead.
+
+        Up to `max_workers` pages are fetched at once.
+        """
+        if not tokens:
+            return
+        fetch_page = partial(self._request_page, context, preload=True)
+        if max_workers <= 1:
+            for token in tokens:
+                yield from fetch_page(token)
+            return
+        for responses in ordered_map(fetch_page, tokens, max_workers):
+            yield from responses
+
+    async def _request_responses_async(
+        self, context: Optional[dict]
+    ) -> AsyncIterator[requests.Response]:
+        """Yield the responses of all pages in order, like `_request_responses`."""
+        max_workers = self.config.get("max_parallel_pages", 1)
+        token: Optional[Union[PageToken, KeysetToken]] = self.get_first_page_token()
+        tokens: List[PageToken] = []
+        while token:
+            responses = await self._request_page_async(context, token)
+            for response in responses:
+                yield response
+            token, tokens = self._plan_next_pages(responses, token, max_workers)
+
+        from tap_apaleo.aio import ordered_map_async
+
+        fetch_page = partial(self._request_page_async, context)
+        async for responses in ordered_map_async(fetch_page, tokens, max_workers):
+            for response in responses:
+                yield response
+
+    def _plan_next_pages(
+        self,
+        responses: List[requests.Response],
+        token: Union[PageToken, KeysetToken],
+        max_workers: int,
+    ) -> Tuple[Optional[Union[PageToken, KeysetToken]], List[PageToken]]:
+        """Return the next page to request on its own, or else the remaining pages.
+
+        With `max_workers` above one, the pages after the first are all known from
+        its `count` and are returned to be fetched concurrently. Keyset pages each
+        depend on the page before, so they are always requested one by one.
+        """
+        next_token = self.get_next_page_token(responses[-1], token)
+        if not next_token or max_workers <= 1 or isinstance(next_token, KeysetToken):
+            return next_token, []
+        return None, self._get_remaining_pages(responses[-1], next_token)
+
+    def _get_remaining_pages(
+        self, response: requests.Response, next_token: PageToken
+    ) -> List[PageToken]:
+        """Return the tokens of all pages from `next_token` on, by the `count`."""
+        count = self.get_record_count(response)
+        size = self.page_sizer.get_size(next_token.offset)
+        offsets = range(next_token.offset, count, size)
+        return [PageToken(offset, size) for offset in offsets]
+
+    def _request_page(
+        self,
+        context: Optional[dict],
+        token: Union[PageToken, KeysetToken],
+        preload: bool = False,
+    ) -> List[requests.Response]:
+        """Request one page, as two smaller pages each time it times out.
+
+        Splitting only happens with `adaptive_page_size`. The responses cover the
+        records of the page in order. A keyset page which times out is requested
+        as its first half only, as the next page starts where that one ended.
+        """
+        prepared_request = self.prepare_request(context, next_page_token=token)
+        try:
+            response = self._request_cached(prepared_request, context)
+        except PageTimeoutError:
+            half = self._split_page(token)
+            responses = self._request_page(context, half, preload)
+            rest = self._get_rest_of_page(token, half, responses)
+            if rest is not None:
+                responses += self._request_page(context, rest, preload)
+            return responses
+
+        self._observe_page(response, token)
+        if preload:
+            # Download the body in the worker thread, not while it is parsed.
+            download_body(response)
+        return [response]
+
+    async def _request_page_async(
+        self, context: Optional[dict], token: Union[PageToken, KeysetToken]
+    ) -> List[requests.Response]:
+        """Request one page on the event loop, like `_request_page`."""
+        # Preparing may fetch an OAuth token, which must not block the loop.
+        prepared_request = await self.engine.run_blocking(
+            partial(self.prepare_request, context, next_page_token=token)
+        )
+        try:
+            response = await self._request_cached_async(prepared_request, context)
+        except PageTimeoutError:
+            half = self._split_page(token)
+            responses = await self._request_page_async(context, half)
+            rest = self._get_rest_of_page(token, half, responses)
+            if rest is not None:
+                responses += await self._request_page_async(context, rest)
+            return responses
+
+        self._observe_page(response, token)
+        return [response]
+
+    def _split_page(
+        self, token: Union[PageToken, KeysetToken]
+    ) -> Union[PageToken, KeysetToken]:
+        """Return the first half of a page which timed out, and shrink later pages."""
+        self.page_sizer.on_timeout(token.size)
+        half = token.size // 2
+        self.logger.warning(
+            f"Page of {token.size} records at {token.offset} timed out, "
+            f"retrying as pages of {half}."
+        )
+        return token._replace(size=half)
+
+    def _get_rest_of_page(
+        self,
+        token: Union[PageToken, KeysetToken],
+        half: Union[PageToken, KeysetToken],
+        responses: List[requests.Response],
+    ) -> Optional[PageToken]:
+        """Return the second half of a split page, or None if there is none.
+
+        Keyset pages have none, as the next page starts after the first half.
+        """
+        if isinstance(token, KeysetToken):
+            return None
+        offset = token.offset + half.size
+        if offset >= self.get_record_count(responses[-1]):
+            return None
+        return PageToken(offset, half.size)
+
+    def _observe_page(
+        self, response: requests.Response, token: Union[PageToken, KeysetToken]
+    ) -> None:
+        """Feed the page sizer, and find the page after a keyset page.
+
+        The next keyset page is found right away, while the body is decoded for
+        it and before `parse_response` drops it. The ids to skip are kept with it.
+        """
+        self.page_sizer.observe(
+            token.size,
+            response.elapsed.total_seconds(),
+            int(response.headers.get("Content-Length") or 0),
+        )
+        if isinstance(token, KeysetToken):
+            self._keyset_pages[response] = (
+                token.seen,
+                self._get_next_keyset_token(response, token),
+            )
+
+    def _parse_responses(
+        self, responses: Iterable[requests.Response], context: Optional[dict]
+    ) -> Iterable[dict]:
+        """Parse responses, counting the time spent in the partition metrics.
+
+        Bodies parsed while they download count their download time as well.
+        """
+        for response in responses:
+            yield from timed(
+                self.parse_response(response),
+                self.get_partition_metrics(context),
+                "parse_seconds",
+            )
+
+    def _get_page_buffer_size(self) -> int:
+        """Return how many pages the asyncio engine buffers ahead per request unit."""
+        return max(2, self.config.get("max_parallel_pages", 1))
+
+    @property
+    def reference_cache(self) -> Optional[ReferenceCache]:
+        """Return the cache of reference data, if enabled and used by this stream."""
+        if not self.reference_data:
+            return None
+        return get_reference_cache(self.config)
+
+    def _request_cached(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request, or answer it from the reference cache while fresh."""
+        cache = self.reference_cache
+        if cache is None:
+            return self._request_with_backoff(prepared_request, context)
+        key, entry, cached = self._read_reference_cache(
+            cache, prepared_request, context
+        )
+        if cached is not None:
+            return cached
+        response = self._request_with_backoff(prepared_request, context)
+        return self._update_reference_cache(cache, key, entry, response, context)
+
+    async def _request_cached_async(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request on the event loop, like `_request_cached`."""
+        cache = self.reference_cache
+        if cache is None:
+            return await self._request_with_backoff_async(prepared_request, context)
+        key, entry, cached = self._read_reference_cache(
+            cache, prepared_request, context
+        )
+        if cached is not None:
+            return cached
+        response = await self._request_with_backoff_async(prepared_request, context)
+        return self._update_reference_cache(cache, key, entry, response, context)
+
+    def _read_reference_cache(
+        self, cache: ReferenceCache, prepared_request, context: Optional[dict]
+    ) -> Tuple[str, Optional[dict], Optional[requests.Response]]:
+        """Return the cache key and entry of a request, and the response if fresh.
+
+        A stale entry's validators are added to the request, so the API can
+        answer `304 Not Modified` instead of sending the body again.
+        """
+        client_id = self.get_authenticator(context).client_id
+        key = cache.get_key(client_id, prepared_request.url)
+        entry = cache.get(key)
+        if entry is not None and cache.is_fresh(entry):
+            self.get_partition_metrics(context).add("cache_hits")
+            return key, entry, cache.to_response(entry, prepared_request)
+        if entry is not None:
+            prepared_request.headers.update(cache.get_validators(entry))
+        return key, entry, None
+
+    def _update_reference_cache(
+        self,
+        cache: ReferenceCache,
+        key: str,
+        entry: Optional[dict],
+        response: requests.Response,
+        context: Optional[dict],
+    ) -> requests.Response:
+        """Cache a new response, or return the cached body if it is unchanged."""
+        if response.status_code == 304 and entry is not None:
+            cache.touch(key, entry)
+            self.get_partition_metrics(context).add("cache_hits")
+            return cache.to_response(entry, response.request)
+        if response.status_code == 200:
+            cache.put(key, response)
+        return response
+
+    def get_reference_records(
+        self, stream_name: str, context: Optional[dict] = None
+    ) -> List[dict]:
+        """Return the records of a reference stream, e.g. to enrich or plan with.
+
+        The records of each stream and context are requested once per run, through
+        the reference cache if it is enabled. Properties deselected in the catalog
+        are left out of them.
+        """
+        stream = self._tap.streams.get(stream_name)
+        if stream is None:
+            # Streams which are not selected are not built for a sync.
+            from tap_apaleo.tap import get_stream_types
+
+            stream_type = next(t for t in get_stream_types() if t.name == stream_name)
+            stream = self._tap.streams[stream_name] = stream_type(tap=self._tap)
+        key = json.dumps(context or {}, sort_keys=True)
+        if key not in stream._reference_records:
+            stream._reference_records[key] = list(stream.request_records(context))
+        return stream._reference_records[key]
+
+    def get_request_priority(self, context: Optional[dict]) -> int:
+        """Return the scheduling priority of a request for the given context.
+
+        Requests for closed time windows are backfill and yield to all others.
+        """
+        window_to = (context or {}).get("window_to")
+        if window_to and window_to <= utc_now().strftime(API_DATE_FORMAT):
+            return PRIORITY_BACKFILL
+        return PRIORITY_INTERACTIVE
+
+    def _request_with_backoff(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request through the shared scheduler, retrying failed requests."""
+        for attempt in itertools.count():
+            try:
+                response = self._send_scheduled(prepared_request, context)
+                break
+            except requests.exceptions.RequestException as ex:
+                delay = self._get_retry_delay(ex, attempt, context)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+        self._check_response(prepared_request, response, context)
+        return response
+
+    async def _request_with_backoff_async(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request on the event loop, retried like `_request_with_backoff`."""
+        for attempt in itertools.count():
+            try:
+                response = await self._send_scheduled_async(prepared_request, context)
+                break
+            except requests.exceptions.RequestException as ex:
+                delay = self._get_retry_delay(ex, attempt, context)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+        self._check_response(prepared_request, response, context)
+        return response
+
+    def _get_retry_delay(
+        self,
+        error: requests.exceptions.RequestException,
+        attempt: int,
+        context: Optional[dict],
+    ) -> Optional[float]:
+        """Return the seconds to wait before retrying a failed request, or None.
+
+        Client errors are not retried, others up to `MAX_REQUEST_TRIES` times with
+        full jitter on 2, 4, 8... seconds.
+        """
+        response = error.response
+        if response is not None and 400 <= response.status_code < 500:
+            return None
+        if attempt + 1 >= MAX_REQUEST_TRIES:
+            return None
+        self.get_partition_metrics(context).add("retries")
+        return random.uniform(0, 2 * 2 ** attempt)
+
+    def _check_response(
+        self, prepared_request, response: requests.Response, context: Optional[dict]
+    ) -> None:
+        """Record the request in the metrics and raise for unsuccessful responses."""
+        self.get_partition_metrics(context).observe_request(
+            response.elapsed.total_seconds(), get_response_size(response)
+        )
+        if self._LOG_REQUEST_METRICS:
+            extra_tags = {}
+            if self._LOG_REQUEST_METRIC_URLS:
+                extra_tags["url"] = prepared_request.path_url
+            self._write_request_duration_log(
+                endpoint=self.path,
+                response=response,
+                context=context,
+                extra_tags=extra_tags,
+            )
+        if response.status_code in [401, 403]:
+            self.logger.info("Failed request for {}".format(prepared_request.url))
+            self.logger.info(
+                f"Reason: {response.status_code} - {str(response.content)}"
+            )
+            raise RuntimeError(
+                "Requested resource was unauthorized, forbidden, or not found."
+            )
+        elif response.status_code >= 400:
+            raise RuntimeError(
+                f"Error making request to API: {prepared_request.url} "
+                f"[{response.status_code} - {str(response.content)}]"
+            )
+
+    def _send_scheduled(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request when the rate limiter allows, retrying throttled ones."""
+        attempts = SendAttempts(self, prepared_request, context)
+        while True:
+            with attempts.waiting():
+                attempts.rate_limiter.acquire(attempts.priority)
+            with attempts.sending():
+                response = self.requests_session.send(
+                    prepared_request,
+                    stream=self.stream_responses,
+                    timeout=attempts.timeout,
+                )
+            if attempts.needs_new_token(response):
+                authenticator = self.get_authenticator(context)
+                authenticator.refresh_rejected(
+                    prepared_request.headers.get("Authorization")
+                )
+                prepared_request.headers.update(authenticator.auth_headers)
+            elif not attempts.needs_retry(response):
+                return response
+
+    async def _send_scheduled_async(
+        self, prepared_request, context: Optional[dict]
+    ) -> requests.Response:
+        """Send a request on the event loop, like `_send_scheduled`."""
+        attempts = SendAttempts(self, prepared_request, context)
+        while True:
+            with attempts.waiting():
+                await attempts.rate_limiter.acquire_async(attempts.priority)
+            with attempts.sending():
+                response = await self.engine.send(prepared_request, attempts.timeout)
+            if attempts.needs_new_token(response):
+                authenticator = self.get_authenticator(context)
+                await self.engine.run_blocking(
+                    authenticator.refresh_rejected,
+                    prepared_request.headers.get("Authorization"),
+                )
+                prepared_request.headers.update(
+                    await self.engine.run_blocking(lambda: authenticator.auth_headers)
+                )
+            elif not attempts.needs_retry(response):
+                return response
+
     def parse_response(self, response: requests.Response) -> Iterable[dict]:
-        """Parse the response and return an iterator of result rows."""
-        # TODO: Parse response body and return a set of records.
-        if(response.status_code == 204):
+        """Parse the response and return an iterator of result rows.
+
+        If possible, records are parsed incrementally from the body while it
+        downloads. Bodies which are already in memory are decoded in one go when
+        the fast JSON backend is installed. The `count` of the page is kept for
+        `get_record_count`, so the body is parsed only once. Properties which are
+        not needed are dropped from the records right away.
+        """
+        if response.status_code == 204:
+            return None
+
+        items_key = get_items_key(self.records_jsonpath)
+        downloaded = getattr(response, "_content_consumed", False)
+        if (
+            not self.stream_responses
+            or items_key is None
+            or (downloaded and JSON_BACKEND == "orjson")
+            or response in self._decoded_bodies
+        ):
+            data = self._decoded_bodies.pop(response, None) or loads(response.content)
+            self._record_counts[response] = data.get("count", 0)
+            pruned = self.pruned_properties
+            seen = self._keyset_pages.get(response, ((), None))[0]
+            for row in extract_jsonpath(self.records_jsonpath, input=data):
+                if row.get("id") in seen:
+                    # Returned by the previous keyset page already.
+                    continue
+                for name in pruned:
+                    row.pop(name, None)
+                yield row
+            return
+
+        meta: Dict[str, Any] = {}
+        if downloaded:
+            body: Any = response.content
+        else:
+            response.raw.decode_content = True
+            body = response.raw
+        try:
+            yield from iter_list_items(body, items_key, meta, self.pruned_properties)
+        except BaseException:
+            response.close()
+            raise
+        self._record_counts[response] = meta.get("count", 0)
+
+    @property
+    def stream_responses(self) -> bool:
+        """Return True if response bodies are parsed while they download."""
+        return can_stream(self.records_jsonpath)
+
+    @property
+    def batch_writer(self) -> Optional["BatchWriter"]:
+        """Return the writer of batch files if `batch_format` is set.
+
+        The batch module, and `pyarrow` with it, is only imported then.
+        """
+        if not self.config.get("batch_format"):
             return None
-        
-        yield from extract_jsonpath(self.records_jsonpath, input=response.json())
+        from tap_apaleo.batch import get_batch_writer
+
+        return get_batch_writer(self.config)
+
+    @property
+    def output_writer(self) -> Optional[OutputWriter]:
+        """Return the writer of the output thread if `pipeline` is set."""
+        return get_output_writer(self.config)
+
+    def _write_state_message(self) -> None:
+        """Write out a STATE message, after the batch files it covers if any."""
+        batch_writer = self.batch_writer
+        output_writer = self.output_writer
+        if batch_writer is not None:
+            batch_writer.write_state(self.tap_state)
+        elif output_writer is not None:
+            output_writer.write(dump_message(StateMessage(value=self.tap_state)))
+        else:
+            super()._write_state_message()
+
+    def _write_schema_message(self) -> None:
+        """Write out a SCHEMA message, through the output thread if pipelined."""
+        output_writer = self.output_writer
+        if output_writer is None:
+            super()._write_schema_message()
+            return
+
+        bookmark_keys = [self.replication_key] if self.replication_key else None
+        for stream_map in self.stream_maps:
+            output_writer.write(
+                SchemaMessage(
+                    stream_map.stream_alias,
+                    stream_map.transformed_schema,
+                    self.primary_keys,
+                    bookmark_keys,
+                )
+            )
+
+    def _write_record_message(self, record: dict) -> None:
+        """Write out a RECORD message, encoded with the fast JSON backend if present.
+
+        Records are conformed by a function compiled once from the schema and the
+        selection of the stream, instead of walking the schema for each record.
+        With `batch_format`, the record goes to a batch file instead, and with
+        `pipeline` it is encoded and written by the output thread.
+        """
+        if self._record_conformer is None:
+            self._record_conformer = compile_conformer(
+                self.name, self.schema, self.mask, self.logger
+            )
+        conforming_since = time.perf_counter()
+        record = self._record_conformer(record)
+        self._conform_seconds += time.perf_counter() - conforming_since
+        batch_writer = self.batch_writer
+        output_writer = self.output_writer
+        for stream_map in self.stream_maps:
+            mapped_record = stream_map.transform(record)
+            # Emit record if not filtered
+            if mapped_record is not None and batch_writer is not None:
+                batch_writer.write_record(
+                    stream_map.stream_alias,
+                    mapped_record,
+                    stream_map.transformed_schema,
+                )
+            elif mapped_record is not None:
+                record_message = RecordMessage(
+                    stream=stream_map.stream_alias,
+                    record=mapped_record,
+                    version=None,
+                    time_extracted=utc_now(),
+                )
+                if output_writer is None:
+                    write_message(record_message)
+                else:
+                    output_writer.write(record_message)
 
-    #def post_process(self, row: dict, context: Optional[dict]) -> dict:
-    #    """As needed, append or transform raw data to match expected structure."""
-    #    # Delete this method if not needed.
-    #    return row
+    # def post_process(self, row: dict, context: Optional[dict]) -> dict:
+    #     """As needed, append or transform raw data to match expected structure."""
+    #     # Delete this method if not needed.
+    #     return row
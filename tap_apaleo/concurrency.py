@@ -0,0 +1,213 @@
+"""Thread pool helpers for fetching Apaleo pages and partitions concurrently."""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def ordered_map(
+    func: Callable[[T], R], items: Iterable[T], max_workers: int
+) -> Iterator[R]:
+    """Apply `func` to `items` in a bounded thread pool, yielding results in order.
+
+    At most `max_workers` calls are in flight at any time, so results are never
+    buffered for more than a pool's worth of items ahead of the consumer.
+    """
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(func, item))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+_DONE = object()
+
+
+def _put(
+    buffer: queue.Queue,
+    item: Tuple[Any, Optional[BaseException]],
+    closed: threading.Event,
+) -> bool:
+    """Put an item once there is room, or return False once `closed` is set."""
+    while not closed.is_set():
+        try:
+            buffer.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(
+    producer: Callable[[], Iterable[T]], buffer: queue.Queue, closed: threading.Event
+) -> None:
+    """Move the items of a producer into its buffer, then its end or error."""
+    try:
+        for item in producer():
+            if not _put(buffer, (item, None), closed):
+                return
+        _put(buffer, (_DONE, None), closed)
+    except BaseException as ex:
+        _put(buffer, (_DONE, ex), closed)
+
+
+def _consume(buffer: queue.Queue) -> Iterator[T]:
+    """Yield the items of a producer from its buffer, re-raising its error."""
+    while True:
+        item, error = buffer.get()
+        if error is not None:
+            raise error
+        if item is _DONE:
+            return
+        yield item
+
+
+def prefetch(
+    producers: Sequence[Callable[[], Iterable[T]]],
+    max_workers: int,
+    max_buffered: int,
+) -> Iterator[Iterator[T]]:
+    """Run `producers` in a bounded thread pool, yielding one iterator per producer.
+
+    The iterators are yielded in the order of `producers` and must be consumed in
+    that order. Each producer buffers at most `max_buffered` items ahead of the
+    consumer. Errors raised by a producer are re-raised when its iterator reaches
+    them, and closing the returned generator stops all producers.
+    """
+    closed = threading.Event()
+    queues: List[queue.Queue] = [
+        queue.Queue(maxsize=max_buffered) for _ in producers
+    ]
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for producer, buffer in zip(producers, queues):
+            executor.submit(_drain, producer, buffer, closed)
+        for buffer in queues:
+            yield _consume(buffer)
+    finally:
+        closed.set()
+        executor.shutdown(wait=True)
+
+
+class _AheadBuffer:
+    """Items passed from the thread of `run_ahead` to its consumer, in order."""
+
+    def __init__(self, max_buffered: int, weigh: Callable[[Any], int]) -> None:
+        """Initialize an empty buffer holding items weighing `max_buffered`."""
+        self.max_buffered = max_buffered
+        self.weigh = weigh
+        self.condition = threading.Condition()
+        self.items: Deque[Tuple[Any, int, Optional[BaseException]]] = deque()
+        self.buffered = 0
+        self.closed = False
+
+    def put(self, item: Any) -> bool:
+        """Add an item once there is room, or return False if the buffer is closed.
+
+        An item heavier than the whole buffer is added once the buffer is empty.
+        """
+        weight = self.weigh(item)
+        with self.condition:
+            while (
+                self.items
+                and self.buffered + weight > self.max_buffered
+                and not self.closed
+            ):
+                self.condition.wait()
+            if self.closed:
+                return False
+            self.items.append((item, weight, None))
+            self.buffered += weight
+            self.condition.notify_all()
+        return True
+
+    def finish(self, error: Optional[BaseException]) -> None:
+        """Add the end of the items, with the error which ended them if any."""
+        with self.condition:
+            self.items.append((_DONE, 0, error))
+            self.condition.notify_all()
+
+    def get(self) -> Any:
+        """Remove and return the next item, re-raising the error which ended them."""
+        with self.condition:
+            while not self.items:
+                self.condition.wait()
+            item, weight, error = self.items.popleft()
+            self.buffered -= weight
+            self.condition.notify_all()
+        if error is not None:
+            raise error
+        return item
+
+    def close(self) -> None:
+        """Stop accepting items, so that a waiting producer gives up."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def _produce(items: Iterable[T], buffer: _AheadBuffer) -> None:
+    """Move `items` into `buffer` until they end or the buffer is closed."""
+    iterator = iter(items)
+    error: Optional[BaseException] = None
+    try:
+        for item in iterator:
+            if not buffer.put(item):
+                return
+    except BaseException as ex:
+        error = ex
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+    buffer.finish(error)
+
+
+def run_ahead(
+    items: Iterable[T],
+    max_buffered: int,
+    weigh: Optional[Callable[[T], int]] = None,
+) -> Iterator[T]:
+    """Iterate `items` on a thread of its own, yielding them in order.
+
+    The thread runs ahead of the consumer by at most `max_buffered` items or, with
+    `weigh`, by items weighing at most `max_buffered` in total. An item heavier
+    than that is still passed on, but only once the buffer is empty. Errors are
+    re-raised when the consumer reaches them, and closing the returned generator
+    stops the thread after its current item.
+    """
+    buffer = _AheadBuffer(max_buffered, weigh or (lambda item: 1))
+    thread = threading.Thread(target=_produce, args=(items, buffer), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        buffer.close()
+        thread.join()
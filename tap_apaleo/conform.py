@@ -0,0 +1,170 @@
+"""Record conformance compiled once per stream schema and selection.
+
+The SDK walks every record against the schema and the selection mask: nested
+objects are searched for deselected properties and each top-level value is
+checked for datetime, bytes and boolean handling. `compile_conformer` does that
+analysis once and returns a function that applies the result to each record. The
+output is the same as the SDK's `pop_deselected_record_properties` followed by
+`conform_record_data_types`.
+"""
+
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from singer_sdk.helpers._singer import SelectionMask
+from singer_sdk.helpers._typing import (
+    _warn_unmapped_property,
+    conform_record_data_types,
+    is_boolean_type,
+)
+
+# Values of these types are written as they are, unless the property is boolean.
+JSON_VALUE_TYPES = (str, int, float, bool, list, dict, type(None))
+
+# Deselected nested properties: None drops a property, a dict descends into it.
+PruneTree = Dict[str, Optional["PruneTree"]]
+
+# Results of a property conformer which leave the property out of the row.
+_DROP = object()
+_SKIP = object()
+
+
+def get_prune_tree(mask: SelectionMask) -> PruneTree:
+    """Return the nested properties which the selection mask deselects.
+
+    Properties without metadata inherit the selection of their parent, so only
+    explicit deselections below a selected parent need to be applied.
+    """
+    tree: PruneTree = {}
+    for breadcrumb, selected in mask.items():
+        if (
+            selected
+            or len(breadcrumb) < 4
+            or any(key != "properties" for key in breadcrumb[::2])
+            or not mask[breadcrumb[:-2]]
+        ):
+            continue
+        node = tree
+        names = breadcrumb[1::2]
+        for name in names[:-1]:
+            child = node.setdefault(name, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[names[-1]] = None
+    return tree
+
+
+def prune_record(record: dict, tree: PruneTree) -> None:
+    """Remove deselected nested properties from a record.
+
+    The record is changed in place. Nested objects on the way are copied first,
+    as they may be shared with a parent record which is still to be written.
+    """
+    for name, subtree in tree.items():
+        if subtree is None:
+            record.pop(name, None)
+        else:
+            value = record.get(name)
+            if isinstance(value, dict):
+                record[name] = value = dict(value)
+                prune_record(value, subtree)
+
+
+def _drop(value: Any) -> Any:
+    """Drop a deselected property from the record."""
+    return _DROP
+
+
+def _build_conformer(
+    stream_name: str, name: str, schema: dict, logger: logging.Logger
+) -> Callable[[Any], Any]:
+    """Return the function conforming the values of a selected property.
+
+    JSON values stay as they are, or become booleans for boolean properties.
+    Other values, such as dates and times or bytes, are converted by the SDK.
+    """
+
+    def conform_other(value: Any) -> Any:
+        row = {name: value}
+        return conform_record_data_types(stream_name, row, schema, logger)[name]
+
+    def conform_plain(value: Any) -> Any:
+        if isinstance(value, JSON_VALUE_TYPES):
+            return value
+        return conform_other(value)
+
+    def conform_boolean(value: Any) -> Any:
+        if not isinstance(value, JSON_VALUE_TYPES):
+            return conform_other(value)
+        return None if value is None else value != 0
+
+    if is_boolean_type(schema["properties"][name]):
+        return conform_boolean
+    return conform_plain
+
+
+def _build_unmapped_conformer(
+    stream_name: str, name: str, mask: SelectionMask, logger: logging.Logger
+) -> Callable[[Any], Any]:
+    """Return the function handling a property which is not in the schema.
+
+    It is dropped from the record if deselected, or else left out of the row
+    with a warning.
+    """
+    if not mask[("properties", name)]:
+        return _drop
+
+    def warn(value: Any) -> Any:
+        _warn_unmapped_property(stream_name, name, logger)
+        return _SKIP
+
+    return warn
+
+
+def compile_conformer(
+    stream_name: str, schema: dict, mask: SelectionMask, logger: logging.Logger
+) -> Callable[[dict], Dict[str, Any]]:
+    """Return a function conforming records of a stream to its schema and selection.
+
+    The returned function removes deselected properties from the record in place
+    and returns a new dictionary with the conformed top-level values. Each
+    property gets a conformer of its own, built once. JSON values of properties
+    which are not boolean are taken as they are, without calling it.
+    """
+    properties = schema["properties"]
+    selected = [name for name in properties if mask[("properties", name)]]
+    plain = frozenset(
+        name for name in selected if not is_boolean_type(properties[name])
+    )
+    conformers: Dict[str, Callable[[Any], Any]] = dict.fromkeys(properties, _drop)
+    for name in selected:
+        conformers[name] = _build_conformer(stream_name, name, schema, logger)
+    tree = {
+        name: subtree
+        for name, subtree in get_prune_tree(mask).items()
+        if conformers.get(name) is not _drop
+    }
+
+    def conform(record: dict) -> Dict[str, Any]:
+        if tree:
+            prune_record(record, tree)
+        row: Dict[str, Any] = {}
+        for name, value in list(record.items()):
+            if name in plain and isinstance(value, JSON_VALUE_TYPES):
+                row[name] = value
+                continue
+            conform_value = conformers.get(name)
+            if conform_value is None:
+                conform_value = conformers[name] = _build_unmapped_conformer(
+                    stream_name, name, mask, logger
+                )
+            value = conform_value(value)
+            if value is _DROP:
+                del record[name]
+            elif value is not _SKIP:
+                row[name] = value
+        return row
+
+    return conform
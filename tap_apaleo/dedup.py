@@ -0,0 +1,43 @@
+"""Bounded index of emitted records, to drop repeats within a sync.
+
+Records can be returned more than once in a sync: pages shift when records are
+modified while a stream is paged, and time windows or resumed syncs overlap.
+The index remembers a short digest of the primary key and version (the
+replication key value) of recently emitted records, and forgets the least
+recently seen digest once it holds `max_size` of them. A record whose digest
+is remembered is an exact repeat and is dropped before it is conformed and
+written.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Any
+
+DIGEST_SIZE = 12
+
+
+class DedupIndex:
+    """Least recently used set of record digests. Not thread-safe."""
+
+    def __init__(self, max_size: int) -> None:
+        """Initialize an empty index which remembers up to `max_size` records."""
+        self.max_size = max(1, max_size)
+        self.suppressed = 0
+        self._digests: "OrderedDict[bytes, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def add(self, *parts: Any) -> bool:
+        """Remember a record by its key parts, or return False if it is a repeat."""
+        digest = hashlib.blake2b(
+            "\x1f".join(str(part) for part in parts).encode(), digest_size=DIGEST_SIZE
+        ).digest()
+        if digest in self._digests:
+            self._digests.move_to_end(digest)
+            self.suppressed += 1
+            return False
+        self._digests[digest] = None
+        if len(self._digests) > self.max_size:
+            self._digests.popitem(last=False)
+        return True
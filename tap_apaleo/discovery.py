@@ -0,0 +1,62 @@
+"""Discovery output cached on disk between runs.
+
+The catalog only changes with the code of the tap and the `accounts` setting,
+so with the `catalog_cache_dir` setting `--discover` writes it once per
+installed version to that directory and later runs print the cached text,
+without building any stream or schema. The cache key also covers the size and
+modification time of the package sources, so edits to an unreleased checkout
+are picked up without a version bump.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Mapping, Optional
+
+PACKAGE_DIR = Path(__file__).parent
+
+
+def get_cache_dir(config: Mapping[str, Any]) -> Path:
+    """Return the `cache_dir` setting, or the user's cache directory."""
+    if config.get("cache_dir"):
+        return Path(config["cache_dir"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "tap-apaleo"
+
+
+def get_catalog_cache_key(version: str, config: Mapping[str, Any]) -> str:
+    """Return the key of the catalog for this tap version and config."""
+    key = hashlib.sha256(f"{version}\n{bool(config.get('accounts'))}".encode())
+    for path in sorted(PACKAGE_DIR.glob("*.py")):
+        stat = path.stat()
+        key.update(f"\n{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return key.hexdigest()[:16]
+
+
+def get_catalog_cache_path(
+    version: str, config: Mapping[str, Any]
+) -> Optional[Path]:
+    """Return the file the catalog of this tap version and config is cached in.
+
+    Returns None if `catalog_cache_dir` is not set.
+    """
+    if not config.get("catalog_cache_dir"):
+        return None
+    key = get_catalog_cache_key(version, config)
+    return Path(config["catalog_cache_dir"]) / f"catalog-{key}.json"
+
+
+def read_cached_catalog(path: Path) -> Optional[str]:
+    """Return the cached catalog text, or None if it was not cached yet."""
+    try:
+        return path.read_text()
+    except OSError:
+        return None
+
+
+def write_cached_catalog(path: Path, catalog_text: str) -> None:
+    """Cache the catalog text, replacing the file in one step."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}")
+    temp_path.write_text(catalog_text)
+    os.replace(temp_path, path)
@@ -0,0 +1,215 @@
+"""Performance metrics per stream and partition.
+
+Each partition counts its requests, a histogram of their latency, the bytes
+received, retries, reference cache hits, the time spent waiting for the
+request scheduler, the time spent parsing and conforming records, and the
+records emitted and dropped as repeats. When a partition finishes, its totals
+are logged as Singer METRIC lines. With the `metrics_path` setting, the totals
+of every partition and stream are also written to a JSON file at the end of the
+run.
+
+Together they tell whether a slow sync waits for the network (latency, bytes),
+the API (throttle waits, retries) or the CPU (parse and conform time).
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds. The last bucket
+# counts everything slower.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: Optional["MetricsRegistry"] = None
+_registry_lock = threading.Lock()
+
+
+class PartitionMetrics:
+    """Counters of one partition of a stream, safe to update from any thread."""
+
+    def __init__(self, stream_name: str, context: Optional[dict]) -> None:
+        """Start the clock of the partition."""
+        self.stream_name = stream_name
+        self.context = context
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.requests = 0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.throttle_wait_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.conform_seconds = 0.0
+        self.records = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def observe_request(self, seconds: float, size: int) -> None:
+        """Count a response, its latency and body size."""
+        with self._lock:
+            self.requests += 1
+            self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.latency_seconds += seconds
+            self.max_latency_seconds = max(self.max_latency_seconds, seconds)
+            self.bytes_received += size
+
+    def add(self, name: str, value: float = 1) -> None:
+        """Add to one of the counters, e.g. `retries` or `parse_seconds`."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def finish(self) -> None:
+        """Stop the clock of the partition."""
+        self.finished = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the totals of the partition."""
+        with self._lock:
+            return _summarize(
+                [self], {"stream": self.stream_name, "context": self.context}
+            )
+
+    def get_metric_logs(self) -> List[Dict[str, Any]]:
+        """Return the totals as Singer metrics, to be logged with `METRIC:`."""
+        totals = self.to_dict()
+        tags = {"stream": self.stream_name}
+        if self.context:
+            tags["context"] = self.context
+        partition_tags = {**tags, "records_per_second": totals["records_per_second"]}
+        return [
+            _metric("timer", "http_request_latency", totals["latency_seconds"], {
+                **tags,
+                "count": totals["requests"],
+                "max": totals["max_latency_seconds"],
+                "buckets": totals["latency_buckets"],
+            }),
+            _metric("counter", "http_request_count", totals["requests"], tags),
+            _metric("counter", "http_bytes_received", totals["bytes_received"], tags),
+            _metric("counter", "http_retry_count", totals["retries"], tags),
+            _metric("counter", "reference_cache_hits", totals["cache_hits"], tags),
+            _metric("timer", "throttle_wait", totals["throttle_wait_seconds"], tags),
+            _metric("timer", "parse_duration", totals["parse_seconds"], tags),
+            _metric("timer", "conform_duration", totals["conform_seconds"], tags),
+            _metric("counter", "duplicate_record_count", totals["duplicates"], tags),
+            _metric(
+                "timer", "partition_duration", totals["elapsed_seconds"], partition_tags
+            ),
+        ]
+
+
+class MetricsRegistry:
+    """The partition metrics of all streams of a run."""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._partitions: Dict[Tuple[str, str], PartitionMetrics] = {}
+        self._lock = threading.Lock()
+
+    def get_partition(
+        self, stream_name: str, context: Optional[dict]
+    ) -> PartitionMetrics:
+        """Return the metrics of a partition, starting them on first use."""
+        key = (stream_name, json.dumps(context or {}, sort_keys=True, default=str))
+        with self._lock:
+            if key not in self._partitions:
+                self._partitions[key] = PartitionMetrics(stream_name, context)
+            return self._partitions[key]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the totals per stream, each with the totals of its partitions."""
+        with self._lock:
+            partitions = list(self._partitions.values())
+        streams: Dict[str, Any] = {}
+        for stream_name in sorted({p.stream_name for p in partitions}):
+            stream_partitions = [p for p in partitions if p.stream_name == stream_name]
+            streams[stream_name] = {
+                **_summarize(stream_partitions, {}),
+                "partitions": [p.to_dict() for p in stream_partitions],
+            }
+        return {"streams": streams}
+
+    def write(self, path: str) -> None:
+        """Write the totals to a JSON file, replacing it in one step."""
+        temp_path = f"{path}.{os.getpid()}"
+        with open(temp_path, "w") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2, default=str)
+        os.replace(temp_path, path)
+
+
+def _metric(
+    metric_type: str, name: str, value: float, tags: Dict[str, Any]
+) -> Dict[str, Any]:
+    return {"type": metric_type, "metric": name, "value": value, "tags": tags}
+
+
+def _summarize(
+    partitions: List[PartitionMetrics], summary: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Return the sums over partitions, with the wall time they spanned."""
+    now = time.monotonic()
+    started = min(p.started for p in partitions)
+    finished = max(p.finished or now for p in partitions)
+    elapsed = finished - started
+    records = sum(p.records for p in partitions)
+    buckets = [sum(counts) for counts in zip(*(p.latency_buckets for p in partitions))]
+    bounds = [f"<={bound:g}s" for bound in LATENCY_BUCKETS] + ["slower"]
+    summary.update(
+        requests=sum(p.requests for p in partitions),
+        latency_seconds=round(sum(p.latency_seconds for p in partitions), 6),
+        max_latency_seconds=round(max(p.max_latency_seconds for p in partitions), 6),
+        latency_buckets=dict(zip(bounds, buckets)),
+        bytes_received=sum(p.bytes_received for p in partitions),
+        retries=sum(p.retries for p in partitions),
+        cache_hits=sum(p.cache_hits for p in partitions),
+        throttle_wait_seconds=round(
+            sum(p.throttle_wait_seconds for p in partitions), 6
+        ),
+        parse_seconds=round(sum(p.parse_seconds for p in partitions), 6),
+        conform_seconds=round(sum(p.conform_seconds for p in partitions), 6),
+        records=records,
+        duplicates=sum(p.duplicates for p in partitions),
+        elapsed_seconds=round(elapsed, 6),
+        records_per_second=round(records / elapsed, 1) if elapsed > 0 else None,
+    )
+    return summary
+
+
+def timed(items: Iterable[Any], metrics: PartitionMetrics, name: str) -> Iterator[Any]:
+    """Yield from `items`, adding the time spent producing them to a counter."""
+    iterator = iter(items)
+    seconds = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - started
+            yield item
+    finally:
+        metrics.add(name, seconds)
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the registry of the run, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def reset_metrics() -> MetricsRegistry:
+    """Start a new registry, e.g. at the start of a run."""
+    global _registry
+    with _registry_lock:
+        _registry = MetricsRegistry()
+        return _registry
@@ -0,0 +1,124 @@
+"""Adaptive page sizes for Apaleo list endpoints.
+
+Apaleo pages with `pageNumber` and `pageSize`, so a page starts at record
+`(pageNumber - 1) * pageSize`. Page sizes are successive halvings of the largest
+size, which keeps every offset reachable when the size changes between pages: a
+page can always shrink, and grows again once its offset is a multiple of the
+larger size.
+
+With keyset pagination, a stream sorted by its replication key requests each
+page from the replication key value of the previous page's last record instead
+of at a deeper `pageNumber`. Every page then costs the API the same, and
+records modified during the sync cannot shift between pages. Records at the
+cursor which the previous page already returned are skipped by id. Only when a
+whole page shares one value does the next page use an offset again, within that
+value.
+"""
+
+import threading
+from typing import FrozenSet, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_TARGET_PAGE_SECONDS = 5.0
+DEFAULT_TARGET_PAGE_BYTES = 4 * 1024 * 1024
+MIN_PAGE_SIZE = 25
+
+
+class PageToken(NamedTuple):
+    """Offset of the first record of a page and the page size to request."""
+
+    offset: int
+    size: int
+
+
+class KeysetToken(NamedTuple):
+    """Page of a keyset paginated stream, starting at a replication key value.
+
+    `offset` counts the records at or after `cursor` to skip, which is only
+    needed when a whole page shares the value of the cursor. `seen` holds the
+    ids at the cursor which an earlier page already returned.
+    """
+
+    offset: int
+    size: int
+    cursor: Optional[str] = None
+    seen: FrozenSet[str] = frozenset()
+
+
+class PageTimeoutError(Exception):
+    """A page request timed out and can be retried as smaller pages."""
+
+
+def get_page_sizes(max_size: int, min_size: int = MIN_PAGE_SIZE) -> List[int]:
+    """Return the page sizes from `max_size` down, halving while they stay whole."""
+    sizes = [max_size]
+    while sizes[-1] % 2 == 0 and sizes[-1] // 2 >= min_size:
+        sizes.append(sizes[-1] // 2)
+    return sizes
+
+
+def get_request_page_size(url: str) -> Optional[int]:
+    """Return the `pageSize` of a request URL, or None for unpaged requests."""
+    values = parse_qs(urlsplit(url).query).get("pageSize")
+    return int(values[0]) if values else None
+
+
+class PageSizer:
+    """Picks the page size of a stream from the time and size of earlier pages."""
+
+    def __init__(
+        self,
+        max_size: int,
+        initial_size: Optional[int] = None,
+        adaptive: bool = False,
+        target_seconds: float = DEFAULT_TARGET_PAGE_SECONDS,
+        target_bytes: int = DEFAULT_TARGET_PAGE_BYTES,
+    ) -> None:
+        """Initialize the sizer. Without `adaptive`, pages always have `max_size`."""
+        self.sizes = get_page_sizes(max_size) if adaptive else [max_size]
+        self.adaptive = adaptive
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self._level = 0
+        if adaptive and initial_size:
+            while (
+                self._level + 1 < len(self.sizes)
+                and self.sizes[self._level] > initial_size
+            ):
+                self._level += 1
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Return the current target page size."""
+        return self.sizes[self._level]
+
+    def get_size(self, offset: int) -> int:
+        """Return the largest size up to the target for a page at `offset`."""
+        for size in self.sizes[self._level:]:
+            if offset % size == 0:
+                return size
+        return self.sizes[-1]
+
+    def can_split(self, size: int) -> bool:
+        """Return True if a timed-out page of `size` can be retried as two halves."""
+        return self.adaptive and size % 2 == 0 and size // 2 >= self.sizes[-1]
+
+    def observe(self, size: int, seconds: float, content_length: Optional[int]) -> None:
+        """Move the target size one step towards the page time and body size targets."""
+        if not self.adaptive or size <= 0 or seconds <= 0:
+            return
+        ideal = size * self.target_seconds / seconds
+        if content_length:
+            ideal = min(ideal, size * self.target_bytes / content_length)
+        with self._lock:
+            if ideal < self.size and self._level + 1 < len(self.sizes):
+                self._level += 1
+            elif self._level > 0 and ideal >= self.sizes[self._level - 1]:
+                self._level -= 1
+
+    def on_timeout(self, size: int) -> None:
+        """Drop the target below the size of a page which timed out."""
+        with self._lock:
+            while self._level + 1 < len(self.sizes) and self.size >= size:
+                self._level += 1
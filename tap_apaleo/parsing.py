@@ -0,0 +1,77 @@
+"""Incremental parsing of Apaleo list responses.
+
+Apaleo list endpoints return `{"<items>": [...], "count": <n>}`. With the optional
+`ijson` package installed, records are built one at a time from the raw body as
+it downloads, and `count` is picked up on the way. Without it, the tap falls back
+to decoding the whole body at once.
+"""
+
+import re
+from typing import IO, AbstractSet, Any, Dict, Iterator, Optional, Union
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - optional dependency
+    ijson = None
+
+_SIMPLE_LIST_JSONPATH = re.compile(r"^\$\.(\w+)\[\*\]$")
+
+
+def get_items_key(records_jsonpath: str) -> Optional[str]:
+    """Return the items key of a `$.<key>[*]` JSONPath, or None for other paths."""
+    match = _SIMPLE_LIST_JSONPATH.match(records_jsonpath)
+    return match.group(1) if match else None
+
+
+def can_stream(records_jsonpath: str) -> bool:
+    """Return True if records at this JSONPath can be parsed incrementally."""
+    return ijson is not None and get_items_key(records_jsonpath) is not None
+
+
+def iter_list_items(
+    body: Union[IO[bytes], bytes],
+    items_key: str,
+    meta: Dict[str, Any],
+    skip: AbstractSet[str] = frozenset(),
+) -> Iterator[dict]:
+    """Yield the items of a list response, storing other scalars in `meta`.
+
+    Only one record is held in memory at a time. Top-level scalar fields such as
+    `count` are written to `meta` as they are encountered. Properties of an item
+    named in `skip` are passed over without building their values.
+    """
+    item_prefix = f"{items_key}.item"
+    builder = None
+    skip_depth = -1
+    for prefix, event, value in ijson.parse(body, use_float=True):
+        if skip_depth >= 0:
+            skip_depth = _get_skip_depth(event, skip_depth)
+        elif builder is not None:
+            if prefix != item_prefix:
+                builder.event(event, value)
+            elif event == "map_key" and value in skip:
+                skip_depth = 0
+            elif event == "end_map":
+                yield builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+        elif prefix == item_prefix and event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif _is_top_level_scalar(prefix, event):
+            meta[prefix] = value
+
+
+def _get_skip_depth(event: str, depth: int) -> int:
+    """Return the depth within a skipped value after an event, or -1 at its end."""
+    if event in ("start_map", "start_array"):
+        depth += 1
+    elif event in ("end_map", "end_array"):
+        depth -= 1
+    return -1 if depth == 0 else depth
+
+
+def _is_top_level_scalar(prefix: str, event: str) -> bool:
+    """Return True for a number or string directly in the response object."""
+    return bool(prefix) and "." not in prefix and event in ("number", "string")
@@ -0,0 +1,108 @@
+"""Pipelined sync, overlapping requests, parsing and writing to stdout.
+
+With the `pipeline` setting, each request unit runs in three stages connected by
+bounded buffers: a fetch thread requests and downloads the pages, a parse thread
+decodes them into records, and the sync thread post-processes and conforms the
+records as before. The messages are then encoded and written to stdout by an
+output thread. Every stage waits when the buffer after it is full, so a slow
+target slows down the requests instead of filling memory. Downloaded pages
+waiting to be parsed are limited to `pipeline_buffer_mb` megabytes.
+
+SCHEMA, RECORD and STATE messages all go through the output thread in the order
+they are written. A STATE message is encoded right away, as the state keeps
+changing while it waits.
+"""
+
+import queue
+import sys
+import threading
+from typing import Any, Mapping, Optional, Union
+
+import singer
+
+from tap_apaleo.serialization import dump_message, write_line
+
+DEFAULT_BUFFER_MB = 64
+MAX_BUFFERED_MESSAGES = 1000
+
+_CLOSE = object()
+
+_writer: Optional["OutputWriter"] = None
+_writer_lock = threading.Lock()
+
+
+class OutputWriter:
+    """Writes Singer messages to stdout on a thread of its own."""
+
+    def __init__(self, max_buffered: int = MAX_BUFFERED_MESSAGES) -> None:
+        """Start the output thread, buffering up to `max_buffered` messages."""
+        self._queue: queue.Queue = queue.Queue(maxsize=max_buffered)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, message: Union[singer.Message, bytes]) -> None:
+        """Queue a message or an encoded line, waiting while the buffer is full.
+
+        An error of the output thread, like a closed pipe, is raised here.
+        """
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        """Write the queued messages and stop the output thread."""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        sys.stdout.flush()
+
+    def _run(self) -> None:
+        while True:
+            message: Any = self._queue.get()
+            if message is _CLOSE:
+                return
+            if self._error is not None:
+                # Keep draining, so writers are not blocked on a full buffer.
+                continue
+            try:
+                if not isinstance(message, bytes):
+                    message = dump_message(message)
+                write_line(message)
+                if self._queue.empty():
+                    # Caught up with the sync: hand everything to the target.
+                    sys.stdout.flush()
+            except BaseException as ex:
+                self._error = ex
+
+
+def get_output_writer(config: Mapping[str, Any]) -> Optional[OutputWriter]:
+    """Return the output writer of the run if `pipeline` is set, else None.
+
+    Batch files are written by the sync thread, so there is none with
+    `batch_format`.
+    """
+    global _writer
+    if not config.get("pipeline") or config.get("batch_format"):
+        return None
+    if _writer is not None:
+        return _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = OutputWriter()
+        return _writer
+
+
+def close_output_writer() -> None:
+    """Write the queued messages and stop the output thread, if one was started."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
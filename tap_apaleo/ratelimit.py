@@ -0,0 +1,184 @@
+"""Adaptive request scheduler shared by all Apaleo streams.
+
+Apaleo answers with 429 (or 503) and a `Retry-After` header when a client sends
+too many requests. The scheduler spaces requests with a token bucket, caps the
+number of requests in flight and halves that cap whenever the API throttles. The
+cap grows back by one after a run of successful requests. Waiting requests are
+served by priority, so incremental work is not stuck behind a large backfill.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Iterator, List, Optional, Tuple
+
+import requests
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKFILL = 1
+
+THROTTLE_STATUS_CODES = (429, 503)
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+DEFAULT_RETRY_AFTER = 5.0
+# How often coroutines waiting for a request slot check again.
+ASYNC_POLL_SECONDS = 0.01
+
+_rate_limiter: Optional["RateLimiter"] = None
+_rate_limiter_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Token bucket with an adaptive concurrency cap and prioritised waiters."""
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+    ) -> None:
+        """Initialize the scheduler. A rate of None disables the token bucket."""
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.throttle_count = 0
+        self.throttle_wait = 0.0
+        self._capacity = max(1.0, requests_per_second or 1.0)
+        self._tokens = self._capacity
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._successes = 0
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def request(self, priority: int = PRIORITY_INTERACTIVE) -> Iterator[None]:
+        """Hold a request slot for the duration of the `with` block."""
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Block until a request with the given priority may be sent."""
+        waiter = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, waiter)
+            while True:
+                delay = self._get_delay(waiter)
+                if delay == 0:
+                    break
+                self._condition.wait(delay)
+            self._grant()
+
+    async def acquire_async(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait on the event loop until a request with the given priority may be sent.
+
+        Waiting is done by polling, so the event loop is never blocked.
+        """
+        waiter = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, waiter)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._get_delay(waiter)
+                    if delay == 0:
+                        self._grant()
+                        return
+                await asyncio.sleep(ASYNC_POLL_SECONDS if delay is None else delay)
+        except asyncio.CancelledError:
+            with self._condition:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            raise
+
+    def _grant(self) -> None:
+        """Hand the slot to the first waiter, which `_get_delay` just let go."""
+        heapq.heappop(self._waiters)
+        if self.requests_per_second:
+            self._tokens -= 1
+        self.in_flight += 1
+        self._condition.notify_all()
+
+    def release(self) -> None:
+        """Free the slot of a finished request."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        """Grow the concurrency cap by one after a run of successful requests."""
+        with self._condition:
+            self._successes += 1
+            if self.concurrency < self.max_concurrency and (
+                self._successes >= self.concurrency
+            ):
+                self.concurrency += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self, retry_after: float) -> None:
+        """Halve the concurrency cap and pause all requests for `retry_after`."""
+        with self._condition:
+            self.throttle_count += 1
+            self.throttle_wait += retry_after
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def _get_delay(self, waiter: Tuple[int, int]) -> Optional[float]:
+        """Return 0 if `waiter` may go now, else how long to wait.
+
+        None means waiting until woken.
+        """
+        now = time.monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self._waiters[0] != waiter or self.in_flight >= self.concurrency:
+            return None
+        if not self.requests_per_second:
+            return 0
+
+        self._tokens = min(
+            self._capacity,
+            self._tokens + (now - self._refilled_at) * self.requests_per_second,
+        )
+        self._refilled_at = now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.requests_per_second
+
+
+def get_rate_limiter(
+    requests_per_second: Optional[float] = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+) -> RateLimiter:
+    """Return the shared scheduler, creating it on first use."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(requests_per_second, max_concurrency)
+        return _rate_limiter
+
+
+def get_retry_after(response: requests.Response, attempt: int) -> float:
+    """Return the seconds to wait from `Retry-After`, or an exponential fallback."""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return DEFAULT_RETRY_AFTER * 2 ** attempt
@@ -0,0 +1,103 @@
+"""On-disk cache of slowly changing reference data, like properties and units.
+
+With the `reference_cache_ttl` setting, the responses of the inventory
+endpoints are kept in the cache directory. Within the TTL a run reads them from
+disk without a request. After it, the request is sent with the `ETag` and
+`Last-Modified` validators of the cached response, and a `304 Not Modified`
+reuses the cached body. Entries are keyed by the OAuth client and the request
+URL, so accounts and partitions never share an entry.
+"""
+
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from tap_apaleo.discovery import get_cache_dir
+
+
+class ReferenceCache:
+    """Cached responses in a directory, one JSON file per request."""
+
+    def __init__(self, path: Path, ttl: float) -> None:
+        """Initialize the cache. Entries older than `ttl` seconds are revalidated."""
+        self.path = path
+        self.ttl = ttl
+
+    def get_key(self, client_id: str, url: str) -> str:
+        """Return the key of a request of an OAuth client."""
+        return hashlib.sha256(f"{client_id}\n{url}".encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry, or None if there is none or it is unreadable."""
+        try:
+            return json.loads((self.path / f"{key}.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """Return True if the entry can be used without revalidation."""
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def get_validators(self, entry: Dict[str, Any]) -> Dict[str, str]:
+        """Return the conditional request headers to revalidate an entry."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, key: str, response: requests.Response) -> None:
+        """Cache a successful response, downloading its body if needed."""
+        self._write(key, {
+            "fetched_at": time.time(),
+            "url": response.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type"),
+            "body": response.content.decode("utf-8"),
+        })
+
+    def touch(self, key: str, entry: Dict[str, Any]) -> None:
+        """Restart the TTL of an entry the API confirmed as unchanged."""
+        self._write(key, {**entry, "fetched_at": time.time()})
+
+    def to_response(
+        self, entry: Dict[str, Any], prepared_request: requests.PreparedRequest
+    ) -> requests.Response:
+        """Return the cached body as a downloaded response to the request."""
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = prepared_request.url
+        response.request = prepared_request
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": entry.get("content_type") or "application/json"}
+        )
+        response.encoding = "utf-8"
+        response.elapsed = timedelta(0)
+        response._content = entry["body"].encode("utf-8")
+        response._content_consumed = True
+        return response
+
+    def _write(self, key: str, entry: Dict[str, Any]) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path / f"{key}.json"
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        temp_path.write_text(json.dumps(entry))
+        os.replace(temp_path, path)
+
+
+def get_reference_cache(config: Mapping[str, Any]) -> Optional[ReferenceCache]:
+    """Return the reference cache if `reference_cache_ttl` is set, else None."""
+    ttl = config.get("reference_cache_ttl")
+    if ttl is None:
+        return None
+    return ReferenceCache(get_cache_dir(config) / "reference", ttl)
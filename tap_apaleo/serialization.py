@@ -0,0 +1,70 @@
+"""JSON encoding and decoding with an optional fast backend.
+
+With the optional `orjson` package installed, API pages are decoded and RECORD
+messages are encoded with it. Otherwise the standard library is used. Both
+backends produce the same JSON values; anything orjson cannot encode, such as
+`Decimal` values or integers beyond 64 bits, is written by the standard Singer
+encoder instead.
+"""
+
+import json
+import sys
+from typing import Any, Union
+
+import simplejson
+import singer
+from singer.messages import format_message
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode a JSON document."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dump_message(message: singer.Message) -> bytes:
+    """Return a Singer message as one UTF-8 encoded line of JSON."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(message.asdict(), option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (format_message(message) + "\n").encode()
+
+
+def dump_record(record: dict) -> bytes:
+    """Return a record as one UTF-8 encoded line of JSON, as in RECORD messages."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (simplejson.dumps(record, use_decimal=True) + "\n").encode()
+
+
+def write_message(message: singer.Message) -> None:
+    """Write a Singer message to stdout.
+
+    The line goes straight to the binary buffer of stdout and is not flushed on
+    its own. Messages written by the SDK flush the text layer, and with it this
+    buffer, so the order of all messages is kept.
+    """
+    write_line(dump_message(message))
+
+
+def write_line(line: bytes) -> None:
+    """Write an encoded message line to stdout, without flushing it."""
+    stdout = getattr(sys.stdout, "buffer", None)
+    if stdout is None:
+        sys.stdout.write(line.decode())
+        sys.stdout.flush()
+    else:
+        stdout.write(line)
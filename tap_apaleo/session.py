@@ -0,0 +1,71 @@
+"""Process-wide HTTP session shared by all Apaleo streams and the authenticator."""
+
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+DEFAULT_POOL_SIZE = 10
+
+# Probe idle connections after 60s, every 15s, and drop them after 4 misses.
+KEEPALIVE_OPTIONS: List[Tuple[int, int, int]] = [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+] + [
+    (socket.IPPROTO_TCP, getattr(socket, name), value)
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 15), ("TCP_KEEPCNT", 4))
+    if hasattr(socket, name)
+]
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTP adapter whose pooled connections use TCP keep-alive."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager with keep-alive socket options."""
+        kwargs["socket_options"] = (
+            HTTPConnection.default_socket_options + KEEPALIVE_OPTIONS
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Return the shared session, creating it on first use.
+
+    The pool size of the first call wins. It should cover the largest number of
+    concurrent requests the tap makes to one host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = KeepAliveAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Accept-Encoding"] = "gzip"
+            _session = session
+        return _session
+
+
+def get_session_stats() -> Dict[str, int]:
+    """Return request and connection counters of the shared session's pools.
+
+    `reused` is the number of requests which did not need a new connection.
+    """
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    if _session is None:
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+    stats["reused"] = max(0, stats["requests"] - stats["connections"])
+    return stats
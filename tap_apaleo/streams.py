@@ -1,11 +1,12 @@
 """Stream type classes for tap-apaleo."""
 
-from pathlib import Path
-from typing import Any, Dict, Optional, Union, List, Iterable
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, List, Iterable, Tuple
 
-from singer_sdk import typing as th  # JSON Schema typing helpers
+import pendulum
+from singer_sdk.helpers._util import utc_now
 
-from tap_apaleo.client import ApaleoStream
+from tap_apaleo.client import API_DATE_FORMAT, ApaleoStream, LazySchema
 
 from singer_sdk.typing import (
     ArrayType,
@@ -19,7 +20,73 @@ from singer_sdk.typing import (
     StringType,
 )
 
-API_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Days from today up to which rates are synced, unless `rates_days_ahead` is set.
+DEFAULT_RATES_DAYS_AHEAD = 365
+
+# Nightly slice of a reservation, nested in reservations and flat in its child stream.
+TIME_SLICE_TYPE = ObjectType(
+    Property("from", DateTimeType),
+    Property("to", DateTimeType),
+    Property("serviceDate", DateTimeType),
+    Property("ratePlan", ObjectType(
+        Property("id", StringType),
+        Property("code", StringType),
+        Property("name", StringType),
+        Property("description", StringType),
+        Property("isSubjectToCityTax", BooleanType),
+    )),
+    Property("unitGroup", ObjectType(
+        Property("id", StringType),
+        Property("code", StringType),
+        Property("name", StringType),
+        Property("description", StringType),
+        Property("type", StringType),
+    )),
+    Property("unit", ObjectType(
+        Property("id", StringType),
+        Property("name", StringType),
+        Property("description", StringType),
+        Property("unitGroupId", StringType),
+    )),
+    Property("baseAmount", ObjectType(
+        Property("grossAmount", NumberType),
+        Property("netAmount", NumberType),
+        Property("vatType", StringType),
+        Property("vatPercent", NumberType),
+        Property("currency", StringType),
+    )),
+    Property("totalGrossAmount", ObjectType(
+        Property("amount", NumberType),
+        Property("currency", StringType),
+    )),
+    Property("includedServices", ArrayType(ObjectType(
+        Property("service", ObjectType(
+            Property("id", StringType),
+            Property("code", StringType),
+            Property("name", StringType),
+            Property("description", StringType),
+        )),
+        Property("serviceDate", DateTimeType),
+        Property("count", IntegerType),
+        Property("amount", ObjectType(
+            Property("grossAmount", NumberType),
+            Property("netAmount", NumberType),
+            Property("vatType", StringType),
+            Property("vatPercent", NumberType),
+            Property("currency", StringType),
+        )),
+        Property("bookedAsExtra", BooleanType),
+    ))),
+    Property("actions", ArrayType(ObjectType(
+        Property("action", StringType),
+        Property("isAllowed", BooleanType),
+        Property("reasons", ArrayType(ObjectType(
+            Property("code", StringType),
+            Property("message", StringType),
+        ))),
+    )))
+)
 
 
 class PropertiesStream(ApaleoStream):
@@ -30,7 +97,17 @@ class PropertiesStream(ApaleoStream):
     replication_key = None
     records_jsonpath = "$.properties[*]"
 
-    schema = PropertiesList(
+    reference_data = True
+
+    def get_property_ids(self, context: Optional[dict] = None) -> List[str]:
+        """Return the ids of all properties of an account, requested once per run."""
+        account_id = (context or {}).get("accountId")
+        account = {"accountId": account_id} if account_id else None
+        return [
+            record["id"] for record in self.get_reference_records(self.name, account)
+        ]
+
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
         Property("code", StringType),
         Property("propertyTemplateId", StringType),
@@ -64,7 +141,7 @@ class PropertiesStream(ApaleoStream):
         Property("created", DateTimeType),
         Property("status", StringType),
         Property("isArchived", BooleanType),
-    ).to_dict()
+    ).to_dict())
 
 
 class ReservationsStream(ApaleoStream):
@@ -74,30 +151,50 @@ class ReservationsStream(ApaleoStream):
     primary_keys = ["id"]
     replication_key = "modified"
     records_jsonpath = "$.reservations[*]"
+    property_filter = "propertyIds"
+    window_setting = "reservations_window"
+    expand_properties = ["timeSlices"]
+    # Expanded reservations are heavy, so adaptive paging starts small.
+    initial_page_size = 250
+    # Reservations are requested sorted by modification (`updated:asc`).
+    resumable = True
+    cursor_param = "from"
 
     def get_url_params(
         self, context: Optional[dict], next_page_token: Optional[Any]
     ) -> Dict[str, Any]:
         """Return a dictionary of values to be used in URL parameterization."""
-        starting_timestamp = self.get_starting_timestamp(context)
-        self.logger.info(starting_timestamp)
-
-        self.logger.info(next_page_token)
         params: dict = {}
-        params["pageSize"] = 1000
-        if next_page_token:
-            params["pageNumber"] = next_page_token
+        params.update(self.get_paging_params(next_page_token))
 
-        params['expand'] = 'timeSlices'
+        expand = self.get_expand_param()
+        if expand:
+            params['expand'] = expand
         params['dateFilter'] = 'Modification'
-        params['from'] = starting_timestamp.strftime(API_DATE_FORMAT)
+        if context and "window_from" in context:
+            params['from'] = context["window_from"]
+            params['to'] = context["window_to"]
+        else:
+            starting_timestamp = self.get_starting_timestamp(context)
+            params['from'] = starting_timestamp.strftime(API_DATE_FORMAT)
+        params.update(self.get_cursor_params(next_page_token))
         params["sort"] = 'updated:asc'
-
-        self.logger.info(params)
+        params.update(self.get_partition_params(context))
         return params
 
-    schema = PropertiesList(
+    def get_child_context(self, record: dict, context: Optional[dict]) -> dict:
+        """Pass the time slices of a reservation on to its child stream."""
+        child_context = {
+            "reservationId": record["id"],
+            "timeSlices": record.get("timeSlices") or [],
+        }
+        if context and "accountId" in context:
+            child_context["accountId"] = context["accountId"]
+        return child_context
+
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
+        Property("propertyId", StringType),
         Property("bookingId", StringType),
         Property("blockId", StringType),
         Property("groupName", StringType),
@@ -285,69 +382,7 @@ class ReservationsStream(ApaleoStream):
                 Property("to", DateTimeType),
             )))
         ))),
-        Property("timeSlices", ArrayType(ObjectType(
-            Property("from", DateTimeType),
-            Property("to", DateTimeType),
-            Property("serviceDate", DateTimeType),
-            Property("ratePlan", ObjectType(
-                Property("id", StringType),
-                Property("code", StringType),
-                Property("name", StringType),
-                Property("description", StringType),
-                Property("isSubjectToCityTax", BooleanType),
-            )),
-            Property("unitGroup", ObjectType(
-                Property("id", StringType),
-                Property("code", StringType),
-                Property("name", StringType),
-                Property("description", StringType),
-                Property("type", StringType),
-            )),
-            Property("unit", ObjectType(
-                Property("id", StringType),
-                Property("name", StringType),
-                Property("description", StringType),
-                Property("unitGroupId", StringType),
-            )),
-            Property("baseAmount", ObjectType(
-                Property("grossAmount", NumberType),
-                Property("netAmount", NumberType),
-                Property("vatType", StringType),
-                Property("vatPercent", NumberType),
-                Property("currency", StringType),
-            )),
-            Property("totalGrossAmount", ObjectType(
-                Property("amount", NumberType),
-                Property("currency", StringType),
-            )),
-            Property("includedServices", ArrayType(ObjectType(
-                Property("service", ObjectType(
-                    Property("id", StringType),
-                    Property("code", StringType),
-                    Property("name", StringType),
-                    Property("description", StringType),
-                )),
-                Property("serviceDate", DateTimeType),
-                Property("count", IntegerType),
-                Property("amount", ObjectType(
-                    Property("grossAmount", NumberType),
-                    Property("netAmount", NumberType),
-                    Property("vatType", StringType),
-                    Property("vatPercent", NumberType),
-                    Property("currency", StringType),
-                )),
-                Property("bookedAsExtra", BooleanType),
-
-            ))),
-            Property("actions", ArrayType(ObjectType(
-                Property("action", StringType),
-                Property("isAllowed", BooleanType),
-                Property("reasons", ArrayType(ObjectType(
-                    Property("code", StringType),
-                    Property("message", StringType),
-                ))),
-            )))
-        ))),
+        Property("timeSlices", ArrayType(TIME_SLICE_TYPE)),
         Property("services", ArrayType(ObjectType(
             Property("service", ObjectType(
                 Property("id", StringType),
@@ -413,7 +448,33 @@ class ReservationsStream(ApaleoStream):
             )),
         )),
         Property("promoCode", StringType),
-    ).to_dict()
+    ).to_dict())
+
+
+class ReservationTimeSlicesStream(ApaleoStream):
+    """Nightly time slices of reservations, one row per reservation and night.
+
+    The rows are taken from the reservations already fetched by the parent
+    stream, so this stream makes no requests of its own.
+    """
+    name = "reservation_time_slices"
+    parent_stream_type = ReservationsStream
+    parent_properties = ["timeSlices"]
+    primary_keys = ["reservationId", "serviceDate"]
+    replication_key = None
+
+    def get_records(self, context: Optional[dict]) -> Iterable[Dict[str, Any]]:
+        """Return one row per time slice of the parent reservation."""
+        parent = {"reservationId": context["reservationId"]}
+        if "accountId" in context:
+            parent["accountId"] = context["accountId"]
+        for time_slice in context["timeSlices"]:
+            yield {**parent, **time_slice}
+
+    schema = LazySchema(lambda: PropertiesList(
+        Property("reservationId", StringType),
+        *TIME_SLICE_TYPE.wrapped,
+    ).to_dict())
 
 
 class UnitGroupsStream(ApaleoStream):
@@ -423,9 +484,13 @@ class UnitGroupsStream(ApaleoStream):
     primary_keys = ["id"]
     replication_key = None
     records_jsonpath = "$.unitGroups[*]"
+    detect_changes = True
+    property_filter = "propertyId"
+    reference_data = True
 
-    schema = PropertiesList(
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
+        Property("propertyId", StringType),
         Property("code", StringType),
         Property("name", StringType),
         Property("description", StringType),
@@ -439,7 +504,7 @@ class UnitGroupsStream(ApaleoStream):
             Property("name", StringType),
             Property("description", StringType),
         )),
-    ).to_dict()
+    ).to_dict())
 
 
 class UnitsStream(ApaleoStream):
@@ -449,9 +514,13 @@ class UnitsStream(ApaleoStream):
     primary_keys = ["id"]
     replication_key = None
     records_jsonpath = "$.units[*]"
+    detect_changes = True
+    property_filter = "propertyId"
+    reference_data = True
 
-    schema = PropertiesList(
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
+        Property("propertyId", StringType),
         Property("name", StringType),
         Property("description", StringType),
         Property("property", ObjectType(
@@ -483,7 +552,7 @@ class UnitsStream(ApaleoStream):
             Property("description", StringType),
         )))
 
-    ).to_dict()
+    ).to_dict())
 
 
 class RatePlansStream(ApaleoStream):
@@ -493,9 +562,19 @@ class RatePlansStream(ApaleoStream):
     primary_keys = ["id"]
     replication_key = None
     records_jsonpath = "$.ratePlans[*]"
+    detect_changes = True
+    property_filter = "propertyIds"
 
-    schema = PropertiesList(
+    def get_child_context(self, record: dict, context: Optional[dict]) -> dict:
+        """Pass the id of a rate plan on to its rates."""
+        child_context = {"ratePlanId": record["id"]}
+        if context and "accountId" in context:
+            child_context["accountId"] = context["accountId"]
+        return child_context
+
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
+        Property("propertyId", StringType),
         Property("code", StringType),
         Property("name", StringType),
         Property("description", StringType),
@@ -615,7 +694,101 @@ class RatePlansStream(ApaleoStream):
             Property("validFrom", DateTimeType),
         ))),
 
-    ).to_dict()
+    ).to_dict())
+
+
+class RatesStream(ApaleoStream):
+    """Daily prices and restrictions of rate plans, one row per rate plan and day.
+
+    Rates are requested per rate plan in date windows, from the bookmark of the
+    rate plan up to `rates_days_ahead` days from today. The first sync of a rate
+    plan has no bookmark and starts at `start_date`. With
+    `max_parallel_partitions` above one, the windows of that many rate plans are
+    requested concurrently. Rates of past days are final, so the bookmark moves
+    to today once a rate plan is synced, and later runs only request the rates
+    from today on.
+    """
+    name = "rates"
+    parent_stream_type = RatePlansStream
+    path = "/rateplan/v1/rate-plans/{ratePlanId}/rates"
+    primary_keys = ["ratePlanId", "from"]
+    replication_key = "from"
+    records_jsonpath = "$.rates[*]"
+    window_setting = "rates_window"
+    default_window = "month"
+    fan_out = True
+
+    def get_window_end(self, context: Optional[dict]) -> datetime:
+        """Return the last day of rates to sync, `rates_days_ahead` from today."""
+        days_ahead = self.config.get("rates_days_ahead", DEFAULT_RATES_DAYS_AHEAD)
+        return utc_now() + timedelta(days=days_ahead)
+
+    def get_windows(self, context: Optional[dict]) -> Optional[List[Tuple[str, str]]]:
+        """Return the date windows to sync, the last one ending with the last day.
+
+        Windows lie on the grid of `rates_window` from `start_date`, but no rates
+        after the `rates_days_ahead` day are requested.
+        """
+        windows = super().get_windows(context)
+        if windows is None:
+            return None
+        last_day = pendulum.instance(self.get_window_end(context)).start_of("day")
+        end = last_day.add(days=1).strftime(API_DATE_FORMAT)
+        return [(window[0], min(window[1], end)) for window in windows]
+
+    def get_url_params(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> Dict[str, Any]:
+        """Return the paging parameters and the days of the window, both inclusive."""
+        params: dict = {}
+        params.update(self.get_paging_params(next_page_token))
+        last_day = pendulum.parse(context["window_to"]).subtract(days=1)
+        params["from"] = context["window_from"][:10]
+        params["to"] = max(last_day.strftime("%Y-%m-%d"), params["from"])
+        return params
+
+    def post_process(self, row: dict, context: Optional[dict]) -> dict:
+        """Add the rate plan, and the account if any, to a rate."""
+        row["ratePlanId"] = context["ratePlanId"]
+        if "accountId" in context:
+            row["accountId"] = context["accountId"]
+        return row
+
+    def get_records(self, context: Optional[dict]) -> Iterable[Dict[str, Any]]:
+        """Return the rates of a rate plan, and bookmark the start of today."""
+        today = utc_now().strftime("%Y-%m-%dT00:00:00Z")
+        yield from super().get_records(context)
+        state = self.get_context_state(context)
+        state["replication_key"] = self.replication_key
+        state["replication_key_value"] = today
+
+    schema = LazySchema(lambda: PropertiesList(
+        Property("ratePlanId", StringType),
+        Property("from", DateTimeType),
+        Property("to", DateTimeType),
+        Property("price", ObjectType(
+            Property("amount", NumberType),
+            Property("currency", StringType),
+        )),
+        Property("restrictions", ObjectType(
+            Property("minLengthOfStay", IntegerType),
+            Property("maxLengthOfStay", IntegerType),
+            Property("closed", BooleanType),
+            Property("closedOnArrival", BooleanType),
+            Property("closedOnDeparture", BooleanType),
+        )),
+        Property("calculatedPrices", ArrayType(ObjectType(
+            Property("adults", IntegerType),
+            Property("price", ObjectType(
+                Property("amount", NumberType),
+                Property("currency", StringType),
+            )),
+        ))),
+        Property("includedServicesPrice", ObjectType(
+            Property("amount", NumberType),
+            Property("currency", StringType),
+        )),
+    ).to_dict())
 
 
 class MaintenancesStream(ApaleoStream):
@@ -625,9 +798,28 @@ class MaintenancesStream(ApaleoStream):
     primary_keys = ["id"]
     replication_key = None
     records_jsonpath = "$.maintenances[*]"
+    detect_changes = True
+    property_filter = "propertyId"
 
-    schema = PropertiesList(
+    def get_url_params(
+        self, context: Optional[dict], next_page_token: Optional[Any]
+    ) -> Dict[str, Any]:
+        """Return a dictionary of values to be used in URL parameterization.
+
+        With `maintenances_lookback_days`, only maintenances overlapping the last
+        days and the future are requested. Older maintenances are finished and
+        do not change any more.
+        """
+        params = super().get_url_params(context, next_page_token)
+        lookback_days = self.config.get("maintenances_lookback_days")
+        if lookback_days is not None:
+            since = utc_now() - timedelta(days=lookback_days)
+            params["from"] = since.strftime(API_DATE_FORMAT)
+        return params
+
+    schema = LazySchema(lambda: PropertiesList(
         Property("id", StringType),
+        Property("propertyId", StringType),
         Property("unit", ObjectType(
             Property("id", StringType),
             Property("name", StringType),
@@ -640,7 +832,19 @@ class MaintenancesStream(ApaleoStream):
         Property("type", StringType),
         Property("description", StringType),
 
-    ).to_dict()
+    ).to_dict())
+
+
+STREAM_TYPES = [
+    ReservationsStream,
+    ReservationTimeSlicesStream,
+    PropertiesStream,
+    UnitGroupsStream,
+    UnitsStream,
+    RatePlansStream,
+    RatesStream,
+    MaintenancesStream
+]
 
 
 """         Property("", StringType),
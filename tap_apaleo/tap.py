@@ -1,27 +1,30 @@
 """Apaleo tap class."""
 
-from typing import List
+import json
+from typing import List, Optional, Set, Type
 
 from singer_sdk import Tap, Stream
+from singer_sdk.helpers._singer import Catalog
 from singer_sdk import typing as th  # JSON schema typing helpers
 
-from tap_apaleo.streams import (
-    ReservationsStream,
-    PropertiesStream,
-    UnitGroupsStream,
-    UnitsStream,
-    RatePlansStream,
-    MaintenancesStream
+from tap_apaleo.discovery import (
+    get_catalog_cache_path,
+    read_cached_catalog,
+    write_cached_catalog,
 )
+from tap_apaleo.metrics import reset_metrics
+from tap_apaleo.pipeline import close_output_writer
 
-STREAM_TYPES = [
-    ReservationsStream,
-    PropertiesStream,
-    UnitGroupsStream,
-    UnitsStream,
-    RatePlansStream,
-    MaintenancesStream
-]
+
+def get_stream_types() -> List[Type[Stream]]:
+    """Return the stream classes.
+
+    The stream module is imported on first use, as `--about` and `--version`
+    do not need it.
+    """
+    from tap_apaleo.streams import STREAM_TYPES
+
+    return STREAM_TYPES
 
 
 class TapApaleo(Tap):
@@ -29,11 +32,167 @@ class TapApaleo(Tap):
     name = "tap-apaleo"
 
     config_jsonschema = th.PropertiesList(
-        th.Property("client_id", th.StringType, required=True),
-        th.Property("client_secret", th.StringType, required=True),
+        th.Property("client_id", th.StringType),
+        th.Property("client_secret", th.StringType),
+        th.Property("accounts", th.ArrayType(th.ObjectType(
+            th.Property("account_id", th.StringType, required=True),
+            th.Property("client_id", th.StringType, required=True),
+            th.Property("client_secret", th.StringType, required=True),
+            th.Property("property_ids", th.ArrayType(th.StringType)),
+        ))),
         th.Property("start_date", th.DateTimeType, required=True),
+        th.Property("max_parallel_pages", th.IntegerType),
+        th.Property("page_sizes", th.ObjectType()),
+        th.Property("adaptive_page_size", th.BooleanType),
+        th.Property("target_page_seconds", th.NumberType),
+        th.Property("request_timeout", th.NumberType),
+        th.Property("max_parallel_partitions", th.IntegerType),
+        th.Property("reservations_window", th.StringType),
+        th.Property("partition_by_property", th.BooleanType),
+        th.Property("property_ids", th.ArrayType(th.StringType)),
+        th.Property("change_detection", th.BooleanType),
+        th.Property("maintenances_lookback_days", th.IntegerType),
+        th.Property("rates_window", th.StringType),
+        th.Property("rates_days_ahead", th.IntegerType),
+        th.Property("http_pool_size", th.IntegerType),
+        th.Property("max_requests_per_second", th.NumberType),
+        th.Property("max_concurrent_requests", th.IntegerType),
+        th.Property("max_throttle_retries", th.IntegerType),
+        th.Property("api_url", th.StringType),
+        th.Property("auth_url", th.StringType),
+        th.Property("token_cache_path", th.StringType),
+        th.Property("token_refresh_margin", th.IntegerType),
+        th.Property("cache_dir", th.StringType),
+        th.Property("catalog_cache_dir", th.StringType),
+        th.Property("engine", th.StringType),
+        th.Property("metrics_path", th.StringType),
+        th.Property("reference_cache_ttl", th.IntegerType),
+        th.Property("keyset_pagination", th.BooleanType),
+        th.Property("dedup_index_size", th.IntegerType),
+        th.Property("batch_format", th.StringType),
+        th.Property("batch_dir", th.StringType),
+        th.Property("batch_max_records", th.IntegerType),
+        th.Property("pipeline", th.BooleanType),
+        th.Property("pipeline_buffer_mb", th.IntegerType),
     ).to_dict()
+    # Either the credentials of one client or a list of accounts are required.
+    config_jsonschema["anyOf"] = [
+        {"required": ["client_id", "client_secret"]},
+        {"required": ["accounts"]},
+    ]
 
     def discover_streams(self) -> List[Stream]:
-        """Return a list of discovered streams."""
-        return [stream_class(tap=self) for stream_class in STREAM_TYPES]
+        """Return a list of discovered streams.
+
+        With an input catalog, streams which are neither selected nor needed by
+        a selected stream are left out, so their schemas are never built.
+        """
+        stream_types = get_stream_types()
+        if self.input_catalog is not None:
+            needed = self.get_needed_stream_names()
+            stream_types = [
+                stream_type
+                for stream_type in stream_types
+                if stream_type.name in needed
+            ]
+        return [stream_class(tap=self) for stream_class in stream_types]
+
+    def get_needed_stream_names(self) -> Set[str]:
+        """Return the streams which the input catalog selects or depends on.
+
+        Streams missing from the catalog are kept, as are the parents of selected
+        child streams. With `partition_by_property`, `properties` is kept too, as
+        the property partitions are read from it.
+        """
+        stream_types = get_stream_types()
+        needed = {"properties"} if self.config.get("partition_by_property") else set()
+        for stream_type in stream_types:
+            entry = self.input_catalog.get(stream_type.name)
+            if entry is None or entry.metadata.resolve_selection()[()]:
+                needed.add(stream_type.name)
+        for stream_type in stream_types:
+            parent_type = stream_type.parent_stream_type
+            if stream_type.name in needed and parent_type:
+                needed.add(parent_type.name)
+        return needed
+
+    def sync_all(self) -> None:
+        """Sync all streams.
+
+        With the `asyncio` engine, the requests of every stream to be synced are
+        started before the first stream is emitted, in the order of the sync.
+        With `batch_format`, the last batch files and the final state are written
+        at the end, and with `pipeline` the messages still queued for the output
+        thread. With `metrics_path`, the metrics of the run are written there
+        at the end, also if the sync fails.
+        """
+        metrics = reset_metrics()
+        try:
+            if self.config.get("engine") == "asyncio":
+                self._sync_all_async()
+            else:
+                super().sync_all()
+        finally:
+            if self.config.get("batch_format"):
+                from tap_apaleo.batch import close_batch_writer
+
+                close_batch_writer()
+            close_output_writer()
+            if self.config.get("metrics_path"):
+                metrics.write(self.config["metrics_path"])
+
+    def _sync_all_async(self) -> None:
+        # Only imported for this engine, as it imports `aiohttp`.
+        from tap_apaleo.aio import close_engine
+
+        # The SDK does this at the start of `sync_all`, but units are planned
+        # from the state before that.
+        self._reset_state_progress_markers()
+        self._set_compatible_replication_methods()
+        try:
+            for stream in self.streams.values():
+                if not stream.parent_stream_type and (
+                    stream.selected or stream.has_selected_descendents
+                ):
+                    stream.start_prefetch()
+            super().sync_all()
+        finally:
+            close_engine()
+
+    @property
+    def cached_catalog_text(self) -> Optional[str]:
+        """Return the catalog text cached by an earlier discovery, or None.
+
+        Only discovery without an input catalog and with `catalog_cache_dir`
+        uses the cache. The file is read once per tap.
+        """
+        if self.input_catalog is not None:
+            return None
+        if not hasattr(self, "_cached_catalog_text"):
+            path = get_catalog_cache_path(self.plugin_version, self.config)
+            self._cached_catalog_text = read_cached_catalog(path) if path else None
+        return self._cached_catalog_text
+
+    @property
+    def _singer_catalog(self) -> Catalog:
+        """Return the catalog, without building any stream if it was cached."""
+        catalog_text = self.cached_catalog_text
+        if catalog_text is not None:
+            return Catalog.from_dict(json.loads(catalog_text))
+        return super()._singer_catalog
+
+    @property
+    def catalog_json_text(self) -> str:
+        """Return the catalog as formatted JSON, cached per tap version."""
+        catalog_text = self.cached_catalog_text
+        if catalog_text is not None:
+            return catalog_text
+
+        catalog_text = super().catalog_json_text
+        path = get_catalog_cache_path(self.plugin_version, self.config)
+        if self.input_catalog is None and path is not None:
+            try:
+                write_cached_catalog(path, catalog_text)
+            except OSError as ex:
+                self.logger.warning(f"Could not cache the catalog: {ex}")
+        return catalog_text
@@ -0,0 +1,171 @@
+"""Shared fixtures: replayed API responses, catalogs and syncs against them."""
+
+import json
+from typing import Callable, Iterable, List, Optional, Union
+
+import pytest
+
+from tap_apaleo.auth import ApaleoAuthenticator
+from tap_apaleo.cassette import Cassette, CassetteServer
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+START_DATE = "2021-01-01T00:00:00Z"
+RESERVATIONS_PATH = (
+    "/booking/v1/reservations?pageSize=2&expand=timeSlices"
+    f"&dateFilter=Modification&from={START_DATE}&sort=updated%3Aasc"
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_authenticators(monkeypatch):
+    """Do not share authenticators, and their tokens, between tests."""
+    monkeypatch.setattr(ApaleoAuthenticator, "_instances", {})
+
+
+@pytest.fixture
+def start_date() -> str:
+    """Return the `start_date` of the cassettes."""
+    return START_DATE
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    """Request reservations in pages of two."""
+    monkeypatch.setattr("tap_apaleo.streams.ReservationsStream.page_size", 2)
+
+
+@pytest.fixture
+def new_cassette() -> Callable[..., Cassette]:
+    """Return a factory of cassettes which already answer the token request."""
+
+    def new_cassette(config: Optional[dict] = None) -> Cassette:
+        cassette = Cassette({"start_date": START_DATE, **(config or {})})
+        token = {"access_token": "token", "expires_in": 3600}
+        cassette.add(
+            "POST", "/connect/token", 200, "application/json", json.dumps(token)
+        )
+        return cassette
+
+    return new_cassette
+
+
+@pytest.fixture
+def add_reservation_pages() -> Callable[..., None]:
+    """Return a function adding reservation pages of two to a cassette.
+
+    Each page is a list of reservations, and pages after the first are requested
+    by `pageNumber`. The `count` defaults to the number of reservations.
+    """
+
+    def add_reservation_pages(
+        cassette: Cassette, pages: List[List[dict]], count: Optional[int] = None
+    ) -> None:
+        if count is None:
+            count = sum(len(page) for page in pages)
+        for number, page in enumerate(pages, start=1):
+            path = RESERVATIONS_PATH
+            if number > 1:
+                path += f"&pageNumber={number}"
+            body = json.dumps({"reservations": page, "count": count})
+            cassette.add("GET", path, 200, "application/json", body)
+
+    return add_reservation_pages
+
+
+@pytest.fixture
+def reservations_cassette(
+    new_cassette, add_reservation_pages
+) -> Callable[..., Cassette]:
+    """Return a factory of cassettes with `count` reservations in pages of two."""
+
+    def reservations_cassette(count: int = 3) -> Cassette:
+        cassette = new_cassette({"client_secret": "secret"})
+        reservations = [
+            {"id": f"R{i}", "modified": f"2021-01-0{i + 1}T00:00:00Z"}
+            for i in range(count)
+        ]
+        pages = [reservations[i:i + 2] for i in range(0, count, 2)]
+        add_reservation_pages(cassette, pages)
+        return cassette
+
+    return reservations_cassette
+
+
+@pytest.fixture
+def select_streams() -> Callable[..., dict]:
+    """Return a factory of catalogs in which only the named streams are selected.
+
+    `deselected_properties` are properties of reservations to deselect.
+    """
+
+    def select_streams(
+        *stream_names: str, deselected_properties: Iterable[str] = ()
+    ) -> dict:
+        catalog = TapApaleo(config=SAMPLE_CONFIG).catalog_dict
+        for entry in catalog["streams"]:
+            for metadata in entry["metadata"]:
+                breadcrumb = tuple(metadata["breadcrumb"])
+                if breadcrumb == ():
+                    selected = entry["tap_stream_id"] in stream_names
+                    metadata["metadata"]["selected"] = selected
+                elif entry["tap_stream_id"] == "reservations" and breadcrumb in {
+                    ("properties", name) for name in deselected_properties
+                }:
+                    metadata["metadata"]["selected"] = False
+        return catalog
+
+    return select_streams
+
+
+@pytest.fixture
+def read_messages(capsys) -> Callable[[], List[dict]]:
+    """Return a function reading the messages written to stdout so far."""
+
+    def read_messages() -> List[dict]:
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    return read_messages
+
+
+@pytest.fixture
+def sync(select_streams, read_messages) -> Callable[..., List[dict]]:
+    """Return a function running a full sync of some streams against a cassette.
+
+    It takes a cassette, or a running server to inspect its request counts
+    afterwards, and an optional input state, and returns the messages written.
+    """
+
+    def sync(
+        cassette: Union[Cassette, CassetteServer],
+        settings: Optional[dict] = None,
+        streams: Iterable[str] = ("reservations",),
+        state: Optional[dict] = None,
+    ) -> List[dict]:
+        # Every sync starts with a token request of its own.
+        ApaleoAuthenticator._instances = {}
+        catalog = select_streams(*streams)
+        if isinstance(cassette, CassetteServer):
+            config = cassette.get_tap_config(settings)
+            TapApaleo(config=config, catalog=catalog, state=state).sync_all()
+        else:
+            with CassetteServer(cassette) as server:
+                config = server.get_tap_config(settings)
+                TapApaleo(config=config, catalog=catalog, state=state).sync_all()
+        return read_messages()
+
+    return sync
+
+
+@pytest.fixture
+def get_records() -> Callable[..., List[dict]]:
+    """Return a function picking the records of a stream among sync messages."""
+
+    def get_records(messages: List[dict], stream: str = "reservations") -> List[dict]:
+        return [
+            message["record"]
+            for message in messages
+            if message["type"] == "RECORD" and message["stream"] == stream
+        ]
+
+    return get_records
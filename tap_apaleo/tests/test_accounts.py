@@ -0,0 +1,39 @@
+"""Tests for syncing several accounts in one tap process."""
+
+from tap_apaleo.auth import ApaleoAuthenticator
+from tap_apaleo.cassette import CassetteServer
+from tap_apaleo.tap import TapApaleo
+
+ACCOUNTS = [
+    {"account_id": "north", "client_id": "north-client", "client_secret": "a"},
+    {"account_id": "south", "client_id": "south-client", "client_secret": "b"},
+]
+
+
+def test_accounts_are_synced_as_partitions(
+    small_pages, reservations_cassette, read_messages, get_records
+):
+    """Each account gets its own token, state and `accountId` column."""
+    with CassetteServer(reservations_cassette()) as server:
+        config = server.get_tap_config({"accounts": ACCOUNTS})
+        del config["client_id"], config["client_secret"]
+        tap = TapApaleo(config={**config, "max_parallel_partitions": 2})
+        reservations = tap.streams["reservations"]
+        assert reservations.primary_keys == ["accountId", "id"]
+        reservations.sync()
+
+    authenticators = ApaleoAuthenticator._instances.values()
+    assert sorted(a.client_id for a in authenticators) == [
+        "north-client", "south-client"
+    ]
+    keys = [
+        (record["accountId"], record["id"]) for record in get_records(read_messages())
+    ]
+    assert keys == [
+        ("north", "R0"), ("north", "R1"), ("north", "R2"),
+        ("south", "R0"), ("south", "R1"), ("south", "R2"),
+    ]
+    partitions = tap.state["bookmarks"]["reservations"]["partitions"]
+    assert [partition["context"] for partition in partitions] == [
+        {"accountId": "north"}, {"accountId": "south"}
+    ]
@@ -0,0 +1,36 @@
+"""Tests for the asyncio engine."""
+
+import asyncio
+
+import pytest
+
+from tap_apaleo.aio import ordered_map_async
+
+
+def test_ordered_map_async_keeps_the_order():
+    """Results come in the order of the items, whichever finishes first."""
+
+    async def delayed(item):
+        await asyncio.sleep((3 - item) / 100)
+        return item * 2
+
+    async def collect():
+        return [item async for item in ordered_map_async(delayed, range(4), 3)]
+
+    assert asyncio.new_event_loop().run_until_complete(collect()) == [0, 2, 4, 6]
+
+
+def test_asyncio_engine_emits_the_same_messages(
+    small_pages, reservations_cassette, sync, get_records
+):
+    """The asyncio engine writes the records and state of the thread engine."""
+    pytest.importorskip("aiohttp")
+    cassette = reservations_cassette(count=5)
+    expected = sync(cassette)
+    messages = sync(cassette, {"engine": "asyncio", "max_parallel_pages": 3})
+
+    records = get_records(messages)
+    assert [r["id"] for r in records] == ["R0", "R1", "R2", "R3", "R4"]
+    assert records == get_records(expected)
+    assert messages[-1]["type"] == "STATE"
+    assert messages[-1]["value"] == expected[-1]["value"]
@@ -0,0 +1,79 @@
+"""Tests for the OAuth token lifecycle."""
+
+import threading
+import time
+
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+
+def _get_authenticator(monkeypatch, config=None, expires_in=3600):
+    """Return a fresh authenticator whose token requests are counted."""
+    stream = TapApaleo(config={**SAMPLE_CONFIG, **(config or {})}).streams["units"]
+    authenticator = stream.authenticator
+    requests = []
+
+    def update_access_token():
+        time.sleep(0.05)
+        requests.append(time.time())
+        authenticator.access_token = f"token-{len(requests)}"
+        authenticator.expires_at = time.time() + expires_in
+
+    monkeypatch.setattr(authenticator, "update_access_token", update_access_token)
+    return authenticator, requests
+
+
+def test_streams_share_one_authenticator_per_client(monkeypatch):
+    """Streams of the same client share the authenticator, other clients do not."""
+    streams = TapApaleo(config=SAMPLE_CONFIG).streams
+    assert streams["units"].authenticator is streams["reservations"].authenticator
+    other = TapApaleo(config={**SAMPLE_CONFIG, "client_id": "other"}).streams
+    assert other["units"].authenticator is not streams["units"].authenticator
+
+
+def test_parallel_requests_fetch_one_token(monkeypatch):
+    """Threads needing a token at the same time wait for a single request."""
+    authenticator, requests = _get_authenticator(monkeypatch)
+    headers = []
+    threads = [
+        threading.Thread(target=lambda: headers.append(authenticator.auth_headers))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(requests) == 1
+    assert {h["Authorization"] for h in headers} == {"Bearer token-1"}
+
+
+def test_expiring_token_is_refreshed_in_the_background(monkeypatch):
+    """A token close to expiry is still used while its successor is fetched."""
+    authenticator, requests = _get_authenticator(monkeypatch, expires_in=120)
+    assert authenticator.auth_headers["Authorization"] == "Bearer token-1"
+    assert authenticator.auth_headers["Authorization"] == "Bearer token-1"
+    authenticator._background_refresh.join()
+    assert len(requests) == 2
+    assert authenticator.access_token == "token-2"
+
+
+def test_rejected_token_is_replaced_once(monkeypatch):
+    """A 401 replaces the token it was sent with, but not a newer one."""
+    authenticator, requests = _get_authenticator(monkeypatch)
+    authenticator.auth_headers
+    authenticator.refresh_rejected("Bearer token-1")
+    authenticator.refresh_rejected("Bearer token-1")
+    assert len(requests) == 2
+    assert authenticator.access_token == "token-2"
+
+
+def test_tokens_are_cached_between_runs(monkeypatch, tmp_path):
+    """A later run reuses the cached token instead of requesting one."""
+    config = {"token_cache_path": str(tmp_path / "tokens.json")}
+    authenticator, requests = _get_authenticator(monkeypatch, config)
+    authenticator.auth_headers
+    assert (tmp_path / "tokens.json").stat().st_mode & 0o077 == 0
+
+    authenticator, requests = _get_authenticator(monkeypatch, config)
+    assert authenticator.auth_headers["Authorization"] == "Bearer token-1"
+    assert requests == []
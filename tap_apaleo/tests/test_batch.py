@@ -0,0 +1,111 @@
+"""Tests for writing records to batch files."""
+
+import gzip
+import json
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+import pytest
+from singer_sdk.typing import (
+    IntegerType,
+    NumberType,
+    ObjectType,
+    PropertiesList,
+    Property,
+    StringType,
+)
+
+from tap_apaleo.batch import BatchWriter
+
+
+def test_records_go_to_rotated_jsonl_files(
+    small_pages, reservations_cassette, sync, tmp_path
+):
+    """Only BATCH messages are written, and STATE never precedes its records."""
+    settings = {
+        "batch_format": "jsonl",
+        "batch_dir": str(tmp_path),
+        "batch_max_records": 2,
+    }
+    messages = sync(reservations_cassette(count=5), settings)
+
+    types = [message["type"] for message in messages]
+    assert "RECORD" not in types
+    assert types.count("BATCH") == 3
+    assert types[-2:] == ["BATCH", "STATE"]
+    ids = []
+    for message in messages:
+        if message["type"] == "BATCH":
+            assert message["encoding"] == {"format": "jsonl", "compression": "gzip"}
+            path = urlsplit(message["manifest"][0]).path
+            with gzip.open(path, "rt") as batch_file:
+                ids += [json.loads(line)["id"] for line in batch_file]
+    assert ids == ["R0", "R1", "R2", "R3", "R4"]
+    bookmark = messages[-1]["value"]["bookmarks"]["reservations"]
+    assert bookmark["replication_key_value"] == "2021-01-05T00:00:00Z"
+
+
+def test_records_go_to_parquet_files(
+    small_pages, reservations_cassette, sync, tmp_path
+):
+    """Parquet batches hold the same records."""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    settings = {"batch_format": "parquet", "batch_dir": str(tmp_path)}
+    messages = sync(reservations_cassette(count=5), settings)
+
+    batches = [message for message in messages if message["type"] == "BATCH"]
+    assert len(batches) == 1
+    table = parquet.read_table(urlsplit(batches[0]["manifest"][0]).path)
+    assert table.column("id").to_pylist() == ["R0", "R1", "R2", "R3", "R4"]
+
+
+def test_parquet_columns_follow_the_stream_schema(monkeypatch, tmp_path, capsys):
+    """Null and loosely typed columns keep their type, row groups fill as they go."""
+    parquet = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr("tap_apaleo.batch.PARQUET_ROW_GROUP_SIZE", 2)
+    schema = PropertiesList(
+        Property("id", StringType),
+        Property("adults", IntegerType),
+        Property("price", ObjectType(Property("amount", NumberType))),
+        Property("comment", StringType),
+        Property("extras", ObjectType()),
+    ).to_dict()
+    records = [
+        {"id": "R0", "adults": 2, "price": {"amount": Decimal("99.5")}},
+        {"id": "R1", "adults": None, "extras": {"crib": True}},
+        {"id": "R2", "adults": 1, "price": None, "comment": None},
+    ]
+    writer = BatchWriter(tmp_path, "parquet", max_records=10)
+    for record in records:
+        writer.write_record("reservations", record, schema)
+    state = {"bookmarks": {"reservations": {"replication_key_value": "R2"}}}
+    writer.write_state(state)
+    state["bookmarks"]["reservations"]["replication_key_value"] = "R3"
+    writer.flush()
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert messages[-1]["value"]["bookmarks"]["reservations"] == {
+        "replication_key_value": "R2"
+    }
+    path = urlsplit(messages[0]["manifest"][0]).path
+    assert parquet.ParquetFile(path).num_row_groups == 2
+    table = parquet.read_table(path)
+    assert str(table.schema.field("adults").type) == "int64"
+    assert str(table.schema.field("comment").type) == "string"
+    assert table.to_pylist() == [
+        {
+            "id": "R0",
+            "adults": 2,
+            "price": {"amount": 99.5},
+            "comment": None,
+            "extras": None,
+        },
+        {
+            "id": "R1",
+            "adults": None,
+            "price": None,
+            "comment": None,
+            "extras": '{"crib": true}',
+        },
+        {"id": "R2", "adults": 1, "price": None, "comment": None, "extras": None},
+    ]
@@ -0,0 +1,26 @@
+"""Tests for benchmarking the tap against a cassette."""
+
+import pytest
+
+from tap_apaleo.benchmark import run_benchmark
+
+SETTINGS = {"page_sizes": {"reservations": 2}}
+
+
+def test_benchmark_syncs_a_stream_in_a_tap_process(reservations_cassette, tmp_path):
+    """The report counts the records and pages of the stream."""
+    path = str(tmp_path / "cassette.jsonl.gz")
+    reservations_cassette().save(path)
+    [result] = run_benchmark(path, ["reservations"], settings=SETTINGS)
+    assert result["stream"] == "reservations"
+    assert result["records"] == {"reservations": 3}
+    assert result["pages"] == 2
+    assert result["records_per_second"] > 0
+
+
+def test_benchmark_reports_the_log_of_a_failed_tap(new_cassette, tmp_path):
+    """A tap process failing on a request missing from the cassette is reported."""
+    path = str(tmp_path / "cassette.jsonl.gz")
+    new_cassette().save(path)
+    with pytest.raises(RuntimeError, match="Not in cassette"):
+        run_benchmark(path, ["reservations"], settings=SETTINGS)
@@ -0,0 +1,73 @@
+"""Tests for recording and replaying API responses."""
+
+import gzip
+import json
+
+import requests
+
+from tap_apaleo.cassette import Cassette, CassetteServer, RecordingAdapter
+from tap_apaleo.tap import TapApaleo
+
+
+def test_cassettes_round_trip_without_credentials(
+    reservations_cassette, start_date, tmp_path
+):
+    """Saved cassettes keep their interactions but drop secret settings."""
+    path = str(tmp_path / "cassette.jsonl.gz")
+    reservations_cassette().save(path)
+    cassette = Cassette.load(path)
+    assert cassette.config == {"start_date": start_date}
+    assert [i["method"] for i in cassette.interactions] == ["POST", "GET", "GET"]
+
+
+def test_tap_syncs_from_the_replay_server(
+    small_pages, reservations_cassette, read_messages, get_records
+):
+    """The tap syncs all pages from the stand-in server, in order."""
+    with CassetteServer(reservations_cassette()) as server:
+        tap = TapApaleo(config=server.get_tap_config())
+        tap.streams["reservations"].sync()
+        assert server.page_count == 2
+
+    ids = [record["id"] for record in get_records(read_messages())]
+    assert ids == ["R0", "R1", "R2"]
+
+
+def test_recording_adapter_hides_access_tokens(reservations_cassette):
+    """Recorded token responses never contain the real access token."""
+    cassette = Cassette()
+    with CassetteServer(reservations_cassette()) as server:
+        session = requests.Session()
+        session.mount("http://", RecordingAdapter(cassette))
+        session.post(server.url + "/connect/token", data={"grant_type": "x"})
+    token = json.loads(cassette.interactions[0]["body"])
+    assert token["access_token"] != "token"
+
+
+def test_cassettes_drop_the_credentials_of_every_account(
+    small_pages,
+    new_cassette,
+    add_reservation_pages,
+    get_records,
+    read_messages,
+    tmp_path,
+):
+    """No client id or secret of an account is saved, replays use stand-ins."""
+    accounts = [
+        {"account_id": "north", "client_id": "north-id", "client_secret": "n-key"},
+        {"account_id": "south", "client_id": "south-id", "client_secret": "s-key"},
+    ]
+    cassette = new_cassette({"accounts": accounts, "client_secret": "secret"})
+    add_reservation_pages(cassette, [[{"id": "R0", "modified": "2021-01-02"}]])
+    path = tmp_path / "cassette.jsonl.gz"
+    cassette.save(str(path))
+    with gzip.open(path, "rt") as file:
+        text = file.read()
+    for secret in ["north-id", "n-key", "south-id", "s-key", "secret"]:
+        assert secret not in text
+
+    with CassetteServer(Cassette.load(str(path))) as server:
+        tap = TapApaleo(config=server.get_tap_config())
+        tap.streams["reservations"].sync()
+    keys = [(r["accountId"], r["id"]) for r in get_records(read_messages())]
+    assert keys == [("north", "R0"), ("south", "R0")]
@@ -0,0 +1,44 @@
+"""Tests for skipping unchanged records with change detection."""
+
+import json
+
+import pendulum
+
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+UNIT_GROUPS_PATH = "/inventory/v1/unit-groups?pageSize=1000"
+
+
+def test_only_changed_records_are_emitted_again(new_cassette, sync, get_records):
+    """A second sync skips unchanged unit groups and emits the changed one."""
+    settings = {"change_detection": True}
+    unit_groups = [{"id": "DBL", "name": "Double"}, {"id": "SGL", "name": "Single"}]
+    cassette = new_cassette()
+    body = json.dumps({"unitGroups": unit_groups, "count": 2})
+    cassette.add("GET", UNIT_GROUPS_PATH, 200, "application/json", body)
+    messages = sync(cassette, settings, streams=["unit-groups"])
+    assert [r["id"] for r in get_records(messages, "unit-groups")] == ["DBL", "SGL"]
+    state = [message for message in messages if message["type"] == "STATE"][-1]
+
+    unit_groups[1]["name"] = "Single room"
+    cassette = new_cassette()
+    body = json.dumps({"unitGroups": unit_groups, "count": 2})
+    cassette.add("GET", UNIT_GROUPS_PATH, 200, "application/json", body)
+    messages = sync(cassette, settings, streams=["unit-groups"], state=state["value"])
+    assert get_records(messages, "unit-groups") == [
+        {"id": "SGL", "name": "Single room"}
+    ]
+
+
+def test_maintenances_are_requested_from_the_lookback(monkeypatch):
+    """Only maintenances of the last `maintenances_lookback_days` are requested."""
+    monkeypatch.setattr(
+        "tap_apaleo.streams.utc_now", lambda: pendulum.datetime(2021, 3, 10, 12)
+    )
+    config = {**SAMPLE_CONFIG, "maintenances_lookback_days": 7}
+    maintenances = TapApaleo(config=config).streams["maintenances"]
+    assert maintenances.get_url_params(None, None)["from"] == "2021-03-03T12:00:00Z"
+
+    maintenances = TapApaleo(config=SAMPLE_CONFIG).streams["maintenances"]
+    assert "from" not in maintenances.get_url_params(None, None)
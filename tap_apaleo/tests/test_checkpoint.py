@@ -0,0 +1,70 @@
+"""Tests for resumable reservation syncs."""
+
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+CONFIG = {**SAMPLE_CONFIG, "start_date": "2020-01-01T00:00:00Z"}
+
+RESERVATIONS = [
+    {"id": "A", "modified": "2021-01-01T10:00:00Z"},
+    {"id": "B", "modified": "2021-01-02T10:00:00Z"},
+    {"id": "C", "modified": "2021-01-02T10:00:00Z"},
+    {"id": "D", "modified": "2021-01-03T10:00:00Z"},
+]
+
+
+def _get_stream(monkeypatch, state=None, reservations=RESERVATIONS):
+    tap = TapApaleo(config=CONFIG, state=state or {})
+    stream = tap.streams["reservations"]
+    monkeypatch.setattr(
+        stream, "_get_request_units", lambda context: [(None, iter(reservations))]
+    )
+    monkeypatch.setattr(stream, "_write_state_message", lambda: None)
+    return stream
+
+
+def test_checkpoint_follows_emitted_records(monkeypatch):
+    """The checkpoint holds the last value and all keys emitted with it."""
+    stream = _get_stream(monkeypatch)
+    records = stream.get_records(None)
+    state = stream.get_context_state(None)
+
+    next(records), next(records), next(records)
+    assert state["checkpoint"] == {"value": "2021-01-02T10:00:00Z", "keys": ["B"]}
+    next(records)
+    assert state["checkpoint"] == {"value": "2021-01-02T10:00:00Z", "keys": ["B", "C"]}
+
+
+def test_checkpoint_compares_times_across_offsets(monkeypatch):
+    """The same time written with another offset extends the checkpoint."""
+    reservations = [
+        {"id": "B", "modified": "2021-01-02T10:00:00Z"},
+        {"id": "C", "modified": "2021-01-02T11:00:00+01:00"},
+        {"id": "D", "modified": "2021-01-03T10:00:00Z"},
+    ]
+    stream = _get_stream(monkeypatch, reservations=reservations)
+    records = stream.get_records(None)
+    next(records), next(records), next(records)
+    checkpoint = stream.get_context_state(None)["checkpoint"]
+    assert checkpoint == {"value": "2021-01-02T10:00:00Z", "keys": ["B", "C"]}
+
+
+def test_resume_skips_exactly_the_emitted_records(monkeypatch):
+    """A resumed sync starts at the checkpoint and skips records emitted before."""
+    state = {
+        "bookmarks": {
+            "reservations": {
+                "checkpoint": {"value": "2021-01-02T11:00:00+01:00", "keys": ["C"]}
+            }
+        }
+    }
+    stream = _get_stream(monkeypatch, state)
+    start = stream.get_starting_timestamp(None)
+    assert start.isoformat() == "2021-01-02T10:00:00+00:00"
+
+    assert [row["id"] for row in stream.get_records(None)] == ["B", "D"]
+    stream_state = stream.get_context_state(None)
+    assert "checkpoint" not in stream_state
+    assert stream_state["progress_markers"]["replication_key_value"] == (
+        "2021-01-03T10:00:00Z"
+    )
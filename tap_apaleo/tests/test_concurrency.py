@@ -0,0 +1,102 @@
+"""Tests for the thread pool helpers."""
+
+import threading
+import time
+
+import pytest
+
+from tap_apaleo.concurrency import ordered_map, prefetch, run_ahead
+
+
+def test_ordered_map_keeps_input_order():
+    """Results are yielded in input order even if later items finish first."""
+    def slow_for_small(item):
+        time.sleep(0.01 * (5 - item))
+        return item * 2
+
+    assert list(ordered_map(slow_for_small, range(5), max_workers=3)) == [
+        0, 2, 4, 6, 8
+    ]
+
+
+def test_ordered_map_bounds_in_flight_calls():
+    """No more than `max_workers` calls run at the same time."""
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def track(item):
+        with lock:
+            running.append(item)
+            peak.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            running.remove(item)
+        return item
+
+    assert list(ordered_map(track, range(20), max_workers=4)) == list(range(20))
+    assert max(peak) <= 4
+
+
+def test_prefetch_yields_producers_in_order():
+    """Each producer's items arrive on its own iterator, in producer order."""
+    producers = [lambda n=n: iter(range(n * 10, n * 10 + 3)) for n in range(4)]
+    batches = [list(items) for items in prefetch(producers, 2, max_buffered=1)]
+    assert batches == [[0, 1, 2], [10, 11, 12], [20, 21, 22], [30, 31, 32]]
+
+
+def test_prefetch_reraises_producer_errors():
+    """A failing producer raises when the consumer reaches its items."""
+    def failing():
+        yield 1
+        raise RuntimeError("boom")
+
+    iterators = prefetch([failing], 1, max_buffered=5)
+    items = next(iterators)
+    assert next(items) == 1
+    with pytest.raises(RuntimeError):
+        next(items)
+    iterators.close()
+
+
+def test_run_ahead_bounds_buffered_weight():
+    """The thread stays within the weight limit, but passes on heavy items alone."""
+    produced = []
+
+    def items():
+        for item in [1, 1, 5, 1]:
+            produced.append(item)
+            yield item
+
+    results = run_ahead(items(), max_buffered=2, weigh=lambda item: item)
+    assert next(results) == 1
+    time.sleep(0.05)
+    # 1 buffered, 5 taken but waiting for the buffer to empty.
+    assert produced == [1, 1, 5]
+    assert list(results) == [1, 5, 1]
+
+
+def test_run_ahead_reraises_errors_and_stops_on_close():
+    """Errors reach the consumer, and closing stops the producing thread."""
+    def failing():
+        yield 1
+        raise RuntimeError("boom")
+
+    results = run_ahead(failing(), max_buffered=5)
+    assert next(results) == 1
+    with pytest.raises(RuntimeError):
+        next(results)
+
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                yield 0
+        finally:
+            closed.set()
+
+    results = run_ahead(endless(), max_buffered=3)
+    assert next(results) == 0
+    results.close()
+    assert closed.is_set()
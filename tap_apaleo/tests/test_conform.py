@@ -0,0 +1,103 @@
+"""Tests for compiled record conformance."""
+
+import copy
+import datetime
+import logging
+
+from singer_sdk.helpers._catalog import pop_deselected_record_properties
+from singer_sdk.helpers._singer import SelectionMask
+from singer_sdk.helpers._typing import conform_record_data_types
+from singer_sdk.typing import (
+    ArrayType,
+    BooleanType,
+    DateTimeType,
+    ObjectType,
+    PropertiesList,
+    Property,
+    StringType,
+)
+
+from tap_apaleo.conform import compile_conformer
+
+LOGGER = logging.getLogger("tap-apaleo")
+
+SCHEMA = PropertiesList(
+    Property("id", StringType),
+    Property("isPreCheckedIn", BooleanType),
+    Property("arrival", DateTimeType),
+    Property("comment", StringType),
+    Property(
+        "guest",
+        ObjectType(
+            Property("name", StringType),
+            Property(
+                "address",
+                ObjectType(
+                    Property("city", StringType), Property("street", StringType)
+                ),
+            ),
+        ),
+    ),
+    Property(
+        "timeSlices",
+        ArrayType(ObjectType(Property("serviceDate", StringType))),
+    ),
+).to_dict()
+
+
+def _sdk_conform(record: dict, mask: SelectionMask) -> dict:
+    pop_deselected_record_properties(record, SCHEMA, mask, LOGGER)
+    return conform_record_data_types("reservations", record, SCHEMA, LOGGER)
+
+
+def _records():
+    return [
+        {
+            "id": "ABC-1",
+            "isPreCheckedIn": 0,
+            "arrival": datetime.datetime(2021, 1, 1, 14),
+            "comment": "late",
+            "guest": {
+                "name": "Jane",
+                "address": {"city": "Munich", "street": "Main", "zip": "80331"},
+                "phone": "123",
+            },
+            "timeSlices": [{"serviceDate": "2021-01-01"}],
+            "unknown": 1,
+        },
+        {"id": "ABC-2", "isPreCheckedIn": None, "guest": None, "comment": None},
+        {"id": "ABC-3", "isPreCheckedIn": "yes", "guest": {"name": "John"}},
+    ]
+
+
+def test_same_output_as_the_sdk_with_everything_selected():
+    """Without deselections, records match the SDK's generic conformance."""
+    mask = SelectionMask({(): True})
+    conform = compile_conformer("reservations", SCHEMA, mask, LOGGER)
+    for record in _records():
+        expected = _sdk_conform(copy.deepcopy(record), mask)
+        assert conform(record) == expected
+
+
+def test_same_output_as_the_sdk_with_nested_deselections():
+    """Deselected top-level and nested properties are removed like the SDK does."""
+    mask = SelectionMask(
+        {
+            (): True,
+            ("properties", "comment"): False,
+            (
+                "properties", "guest", "properties", "address", "properties", "street"
+            ): False,
+            ("properties", "guest", "properties", "phone"): False,
+        }
+    )
+    conform = compile_conformer("reservations", SCHEMA, mask, LOGGER)
+    rows = []
+    for record in _records():
+        expected = _sdk_conform(copy.deepcopy(record), mask)
+        rows.append(conform(record))
+        assert rows[-1] == expected
+    assert rows[0]["guest"] == {
+        "name": "Jane", "address": {"city": "Munich", "zip": "80331"}
+    }
+    assert "comment" not in rows[0]
@@ -0,0 +1,38 @@
+"""Tests for dropping repeated records with the dedup index."""
+
+from tap_apaleo.cassette import CassetteServer
+from tap_apaleo.dedup import DedupIndex
+from tap_apaleo.metrics import reset_metrics
+from tap_apaleo.tap import TapApaleo
+
+
+def test_index_forgets_the_least_recently_seen_records():
+    """Repeats are reported until the index is full and evicts them."""
+    index = DedupIndex(max_size=2)
+    assert index.add("R1", "2021-01-01")
+    assert index.add("R2", "2021-01-01")
+    assert not index.add("R1", "2021-01-01")
+    assert index.add("R1", "2021-01-02")
+    assert index.add("R2", "2021-01-01")
+    assert len(index) == 2
+    assert index.suppressed == 1
+
+
+def test_repeats_on_shifted_pages_are_dropped(
+    small_pages, new_cassette, add_reservation_pages, read_messages, get_records
+):
+    """A record returned again on the next page is only emitted once."""
+    reservations = [
+        {"id": f"R{i}", "modified": f"2021-01-0{i + 1}T00:00:00Z"} for i in range(3)
+    ]
+    cassette = new_cassette()
+    add_reservation_pages(cassette, [reservations[0:2], reservations[1:3]], count=4)
+
+    metrics = reset_metrics()
+    with CassetteServer(cassette) as server:
+        config = server.get_tap_config({"dedup_index_size": 100})
+        TapApaleo(config=config).streams["reservations"].sync()
+
+    ids = [record["id"] for record in get_records(read_messages())]
+    assert ids == ["R0", "R1", "R2"]
+    assert metrics.get_partition("reservations", None).duplicates == 1
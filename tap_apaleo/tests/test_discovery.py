@@ -0,0 +1,53 @@
+"""Tests for the cached discovery and the streams built for a catalog."""
+
+import pytest
+
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+
+def test_catalog_is_cached_per_version(monkeypatch, tmp_path):
+    """A second discovery returns the cached catalog without building streams."""
+    config = {**SAMPLE_CONFIG, "catalog_cache_dir": str(tmp_path)}
+    catalog_text = TapApaleo(config=config).catalog_json_text
+    assert len(list(tmp_path.glob("catalog-*.json"))) == 1
+
+    def discover_streams(self):
+        raise AssertionError("Streams were built on a cache hit.")
+
+    monkeypatch.setattr(TapApaleo, "discover_streams", discover_streams)
+    assert TapApaleo(config=config).catalog_json_text == catalog_text
+
+
+def test_catalog_is_only_cached_with_a_cache_dir(monkeypatch, tmp_path):
+    """Without `catalog_cache_dir` nothing is read or written."""
+    monkeypatch.setattr(
+        "tap_apaleo.tap.write_cached_catalog",
+        lambda path, text: pytest.fail("The catalog was cached."),
+    )
+    assert TapApaleo(config=SAMPLE_CONFIG).catalog_json_text
+
+
+def test_only_needed_streams_are_built_for_a_catalog(select_streams):
+    """Deselected streams are skipped, parents of selected children are kept."""
+    catalog = select_streams("properties", "reservations")
+    tap = TapApaleo(config=SAMPLE_CONFIG, catalog=catalog)
+    assert set(tap.streams) == {"properties", "reservations"}
+
+    catalog = select_streams("properties", "reservation_time_slices")
+    tap = TapApaleo(config=SAMPLE_CONFIG, catalog=catalog)
+    assert set(tap.streams) == {
+        "properties", "reservations", "reservation_time_slices"
+    }
+    assert tap.streams["reservations"].child_streams
+
+
+def test_properties_are_only_built_for_property_partitions(select_streams):
+    """`properties` is needed for a sync only to list the property partitions."""
+    catalog = select_streams("reservations")
+    tap = TapApaleo(config=SAMPLE_CONFIG, catalog=catalog)
+    assert set(tap.streams) == {"reservations"}
+
+    config = {**SAMPLE_CONFIG, "partition_by_property": True}
+    tap = TapApaleo(config=config, catalog=catalog)
+    assert set(tap.streams) == {"properties", "reservations"}
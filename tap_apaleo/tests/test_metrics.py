@@ -0,0 +1,35 @@
+"""Tests for the performance metrics per stream and partition."""
+
+import json
+
+from tap_apaleo.metrics import PartitionMetrics, timed
+
+
+def test_partition_metrics_count_latency_and_time():
+    """Latencies land in their histogram bucket and timed iteration is summed."""
+    metrics = PartitionMetrics("units", {"propertyId": "MUC"})
+    metrics.observe_request(0.07, 100)
+    metrics.observe_request(120, 50)
+    assert list(timed(range(3), metrics, "parse_seconds")) == [0, 1, 2]
+
+    totals = metrics.to_dict()
+    assert totals["requests"] == 2
+    assert totals["bytes_received"] == 150
+    assert totals["latency_buckets"]["<=0.1s"] == 1
+    assert totals["latency_buckets"]["slower"] == 1
+    assert totals["parse_seconds"] > 0
+    names = [metric["metric"] for metric in metrics.get_metric_logs()]
+    assert "http_request_latency" in names and "throttle_wait" in names
+
+
+def test_sync_writes_metrics_file(small_pages, reservations_cassette, sync, tmp_path):
+    """A sync with `metrics_path` writes the totals of each stream and partition."""
+    path = tmp_path / "metrics.json"
+    sync(reservations_cassette(), {"metrics_path": str(path)})
+
+    reservations = json.loads(path.read_text())["streams"]["reservations"]
+    assert reservations["requests"] == 2
+    assert reservations["records"] == 3
+    assert reservations["bytes_received"] > 0
+    assert reservations["retries"] == 0
+    assert [p["context"] for p in reservations["partitions"]] == [None]
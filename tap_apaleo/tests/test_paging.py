@@ -0,0 +1,105 @@
+"""Tests for adaptive page sizes and keyset pagination."""
+
+import json
+
+from tap_apaleo.cassette import CassetteServer
+from tap_apaleo.paging import PageSizer, PageToken, get_page_sizes
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+
+def test_page_sizes_halve_down_to_the_minimum():
+    """Sizes halve while they stay whole and above the minimum page size."""
+    assert get_page_sizes(1000) == [1000, 500, 250, 125]
+    assert get_page_sizes(100, min_size=10) == [100, 50, 25]
+
+
+def test_sizer_only_grows_at_aligned_offsets():
+    """A larger size is only used where a page of that size starts."""
+    sizer = PageSizer(1000, initial_size=250, adaptive=True)
+    assert sizer.size == 250
+    sizer.observe(250, seconds=0.5, content_length=None)
+    assert sizer.size == 500
+    assert sizer.get_size(250) == 250
+    assert sizer.get_size(500) == 500
+
+
+def test_sizer_shrinks_on_slow_or_heavy_pages():
+    """Slow pages, large bodies and timeouts each lower the target size."""
+    sizer = PageSizer(1000, adaptive=True, target_seconds=5.0, target_bytes=1000)
+    sizer.observe(1000, seconds=10.0, content_length=None)
+    assert sizer.size == 500
+    sizer.observe(500, seconds=1.0, content_length=5000)
+    assert sizer.size == 250
+    sizer.on_timeout(250)
+    assert sizer.size == 125
+    assert not sizer.can_split(125)
+
+
+def test_fixed_sizer_keeps_its_size():
+    """Without `adaptive_page_size`, pages are never resized or split."""
+    sizer = PageSizer(1000, initial_size=250)
+    sizer.observe(1000, seconds=60.0, content_length=None)
+    assert sizer.size == 1000
+    assert not sizer.can_split(1000)
+
+
+def test_paging_params_follow_the_page_token():
+    """`pageNumber` is derived from the offset and the size of the page."""
+    config = {**SAMPLE_CONFIG, "page_sizes": {"reservations": 400}}
+    reservations = TapApaleo(config=config).streams["reservations"]
+    assert reservations.get_paging_params(None) == {"pageSize": 400}
+    assert reservations.get_paging_params(PageToken(1200, 200)) == {
+        "pageSize": 200,
+        "pageNumber": 7,
+    }
+
+
+def test_keyset_pages_start_at_the_last_modification(
+    small_pages, new_cassette, start_date, read_messages, get_records
+):
+    """Pages move `from` forward, skip repeated ids and use offsets only on ties."""
+    days = ["01", "02", "02", "03", "04"]
+    reservations = [
+        {"id": f"R{i}", "modified": f"2021-01-{day}T00:00:00Z"}
+        for i, day in enumerate(days)
+    ]
+    cassette = new_cassette()
+    path = (
+        "/booking/v1/reservations?pageSize=2&expand=timeSlices"
+        "&dateFilter=Modification&sort=updated%3Aasc&from="
+    )
+    for query, page, count in [
+        (start_date, reservations[0:2], 5),
+        ("2021-01-02T00:00:00Z", reservations[1:3], 4),
+        ("2021-01-02T00:00:00Z&pageNumber=2", reservations[3:5], 4),
+    ]:
+        body = json.dumps({"reservations": page, "count": count})
+        cassette.add("GET", path + query, 200, "application/json", body)
+
+    with CassetteServer(cassette) as server:
+        config = server.get_tap_config({"keyset_pagination": True})
+        TapApaleo(config=config).streams["reservations"].sync()
+        assert server.page_count == 3
+
+    ids = [record["id"] for record in get_records(read_messages())]
+    assert ids == ["R0", "R1", "R2", "R3", "R4"]
+
+
+def test_parallel_pages_keep_the_records_in_order(
+    small_pages, reservations_cassette, sync, get_records
+):
+    """Pages fetched at once yield the records and state of a sequential sync."""
+    with CassetteServer(reservations_cassette(count=7), latency=0.02) as server:
+        sequential = sync(server)
+        parallel = sync(server, {"max_parallel_pages": 3})
+        assert server.request_counts["/booking/v1/reservations"] == 8
+
+    assert [r["id"] for r in get_records(parallel)] == [f"R{i}" for i in range(7)]
+    assert get_records(parallel) == get_records(sequential)
+    bookmarks = [
+        messages[-1]["value"]["bookmarks"] for messages in (sequential, parallel)
+    ]
+    for bookmark in bookmarks:
+        bookmark["reservations"].pop("replication_key_signpost", None)
+    assert bookmarks[0] == bookmarks[1]
@@ -0,0 +1,39 @@
+"""Tests for incremental parsing of list responses."""
+
+import io
+import json
+
+import pytest
+
+from tap_apaleo.parsing import get_items_key, iter_list_items
+
+pytest.importorskip("ijson")
+
+
+def test_items_key_only_for_simple_list_paths():
+    """Only `$.<key>[*]` paths can be parsed incrementally."""
+    assert get_items_key("$.reservations[*]") == "reservations"
+    assert get_items_key("$[*]") is None
+
+
+def test_list_items_and_count_are_read_in_one_pass():
+    """Records come out whole, in order, and `count` lands in `meta`."""
+    records = [
+        {"id": "A", "timeSlices": [{"serviceDate": "2021-01-01"}], "amount": 1.5},
+        {"id": "B", "timeSlices": [], "amount": 2},
+    ]
+    body = io.BytesIO(json.dumps({"reservations": records, "count": 2}).encode())
+    meta: dict = {}
+    assert list(iter_list_items(body, "reservations", meta)) == records
+    assert meta == {"count": 2}
+
+
+def test_skipped_properties_are_not_built():
+    """Skipped properties are left out, whether they hold scalars or containers."""
+    records = [
+        {"id": "A", "timeSlices": [{"serviceDate": "2021-01-01"}], "comment": "x"},
+        {"id": "B", "comment": None, "timeSlices": []},
+    ]
+    body = json.dumps({"reservations": records, "count": 2}).encode()
+    items = list(iter_list_items(body, "reservations", {}, {"timeSlices", "comment"}))
+    assert items == [{"id": "A"}, {"id": "B"}]
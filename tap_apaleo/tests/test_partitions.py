@@ -0,0 +1,71 @@
+"""Tests for partitioning streams by property."""
+
+import json
+
+from tap_apaleo.cassette import Cassette, CassetteServer
+
+PROPERTY_IDS = ["MUC", "BER", "HAM"]
+MAINTENANCES_PATH = "/operations/v1/maintenances?pageSize=1000&propertyId="
+
+
+def _maintenances_cassette(new_cassette) -> Cassette:
+    cassette = new_cassette()
+    properties = {"properties": [{"id": id} for id in PROPERTY_IDS], "count": 3}
+    cassette.add(
+        "GET",
+        "/inventory/v1/properties?pageSize=1000",
+        200,
+        "application/json",
+        json.dumps(properties),
+    )
+    for property_id in PROPERTY_IDS:
+        maintenances = [
+            {"id": f"{property_id}-{i}", "propertyId": property_id} for i in range(2)
+        ]
+        body = json.dumps({"maintenances": maintenances, "count": 2})
+        path = MAINTENANCES_PATH + property_id
+        cassette.add("GET", path, 200, "application/json", body)
+    return cassette
+
+
+def test_each_property_is_a_partition(new_cassette, sync, get_records):
+    """Properties are synced in order, each with its own state."""
+    settings = {"partition_by_property": True}
+    messages = sync(_maintenances_cassette(new_cassette), settings, ["maintenances"])
+
+    assert [r["id"] for r in get_records(messages, "maintenances")] == [
+        f"{property_id}-{i}" for property_id in PROPERTY_IDS for i in range(2)
+    ]
+    state = [message for message in messages if message["type"] == "STATE"][-1]
+    partitions = state["value"]["bookmarks"]["maintenances"]["partitions"]
+    assert [partition["context"] for partition in partitions] == [
+        {"propertyId": property_id} for property_id in PROPERTY_IDS
+    ]
+
+
+def test_property_ids_only_sync_those_properties(new_cassette, sync, get_records):
+    """With `property_ids`, the properties themselves are not requested."""
+    with CassetteServer(_maintenances_cassette(new_cassette)) as server:
+        messages = sync(server, {"property_ids": ["HAM", "MUC"]}, ["maintenances"])
+        assert server.request_counts["/inventory/v1/properties"] == 0
+        assert server.request_counts["/operations/v1/maintenances"] == 2
+
+    assert [r["id"] for r in get_records(messages, "maintenances")] == [
+        "HAM-0", "HAM-1", "MUC-0", "MUC-1"
+    ]
+
+
+def test_parallel_partitions_write_the_same_messages(new_cassette, sync):
+    """Partitions fetched at once are emitted as in a sequential sync."""
+    cassette = _maintenances_cassette(new_cassette)
+    settings = {"partition_by_property": True}
+    with CassetteServer(cassette, latency=0.02) as server:
+        sequential = sync(server, settings, ["maintenances"])
+        parallel = sync(
+            server, {**settings, "max_parallel_partitions": 3}, ["maintenances"]
+        )
+
+    for message in sequential + parallel:
+        message.pop("time_extracted", None)
+    assert [message["type"] for message in sequential].count("RECORD") == 6
+    assert parallel == sequential
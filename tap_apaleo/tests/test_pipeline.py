@@ -0,0 +1,64 @@
+"""Tests for the pipelined sync."""
+
+import threading
+
+from tap_apaleo import client
+from tap_apaleo.client import ApaleoStream
+
+
+def _strip_run_timestamps(messages: list) -> list:
+    for message in messages:
+        # Timestamps of the run differ between syncs.
+        message.pop("time_extracted", None)
+        if message["type"] == "STATE":
+            for bookmark in message["value"]["bookmarks"].values():
+                bookmark.pop("replication_key_signpost", None)
+    return messages
+
+
+def test_pipelined_sync_writes_the_same_messages(
+    small_pages, reservations_cassette, sync
+):
+    """Records and states arrive in the same order as in a sequential sync."""
+    cassette = reservations_cassette(count=5)
+    sequential = _strip_run_timestamps(sync(cassette))
+    pipelined = _strip_run_timestamps(
+        sync(cassette, {"pipeline": True, "pipeline_buffer_mb": 1})
+    )
+
+    assert [message["type"] for message in sequential].count("RECORD") == 5
+    assert pipelined == sequential
+
+
+def test_pipelined_pages_are_decoded_in_the_parse_stage(
+    monkeypatch, small_pages, reservations_cassette, sync, get_records
+):
+    """The fetch thread only downloads pages, each body is decoded once to parse."""
+    threads: dict = {"decode": [], "parse": [], "request": []}
+
+    def record_thread(kind, func):
+        def wrapper(*args, **kwargs):
+            threads[kind].append(threading.current_thread().name)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(client, "loads", record_thread("decode", client.loads))
+    monkeypatch.setattr(
+        client, "iter_list_items", record_thread("decode", client.iter_list_items)
+    )
+    for kind, name in [("parse", "parse_response"), ("request", "_request_page")]:
+        monkeypatch.setattr(
+            ApaleoStream, name, record_thread(kind, getattr(ApaleoStream, name))
+        )
+    messages = sync(reservations_cassette(count=7), {"pipeline": True})
+
+    assert len(get_records(messages)) == 7
+    assert len(threads["decode"]) == len(threads["parse"]) == 4
+    parse_threads = set(threads["parse"])
+    assert len(parse_threads) == 1
+    assert set(threads["decode"]) == parse_threads
+    assert "MainThread" not in parse_threads
+    # The first page is requested by the parse stage, the rest ahead of it.
+    assert threads["request"][0] in parse_threads
+    assert not parse_threads & set(threads["request"][1:])
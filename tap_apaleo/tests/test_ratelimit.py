@@ -0,0 +1,94 @@
+"""Tests for the adaptive request scheduler."""
+
+import threading
+import time
+
+import requests
+
+from tap_apaleo.client import SendAttempts
+from tap_apaleo.metrics import reset_metrics
+from tap_apaleo.ratelimit import (
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    RateLimiter,
+    get_retry_after,
+)
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+
+def test_throttle_halves_concurrency_and_success_grows_it_back():
+    """Concurrency follows additive increase, multiplicative decrease."""
+    limiter = RateLimiter(max_concurrency=8)
+    limiter.on_throttle(0)
+    assert limiter.concurrency == 4
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.concurrency == 5
+
+
+def test_token_bucket_spaces_requests():
+    """Requests beyond the burst wait for new tokens."""
+    limiter = RateLimiter(requests_per_second=50)
+    started = time.monotonic()
+    for _ in range(60):
+        with limiter.request():
+            pass
+    assert time.monotonic() - started >= 0.15
+
+
+def test_interactive_requests_go_before_backfill():
+    """Waiting interactive requests are served before waiting backfill ones."""
+    limiter = RateLimiter(max_concurrency=1)
+    order = []
+    limiter.acquire()
+
+    def request(priority, name):
+        with limiter.request(priority):
+            order.append(name)
+
+    threads = [threading.Thread(target=request, args=(PRIORITY_BACKFILL, "backfill"))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(
+        threading.Thread(target=request, args=(PRIORITY_INTERACTIVE, "interactive"))
+    )
+    threads[1].start()
+    time.sleep(0.05)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["interactive", "backfill"]
+
+
+def test_retry_after_header_is_honoured():
+    """Seconds from `Retry-After` win over the exponential fallback."""
+    response = requests.Response()
+    response.headers["Retry-After"] = "3"
+    assert get_retry_after(response, attempt=4) == 3.0
+    assert get_retry_after(requests.Response(), attempt=1) == 10.0
+
+
+def _get_response(status_code: int, retry_after: str = "0") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["Retry-After"] = retry_after
+    return response
+
+
+def test_send_attempts_retry_throttled_requests_and_rejected_tokens(monkeypatch):
+    """Throttled requests are retried up to the limit, a rejected token once."""
+    monkeypatch.setattr("tap_apaleo.ratelimit._rate_limiter", None)
+    metrics = reset_metrics()
+    config = {**SAMPLE_CONFIG, "max_throttle_retries": 1}
+    stream = TapApaleo(config=config).streams["units"]
+    request = requests.Request("GET", "https://api.apaleo.com/inventory/v1/units")
+    attempts = SendAttempts(stream, request.prepare(), None)
+
+    assert attempts.needs_new_token(_get_response(401))
+    assert not attempts.needs_new_token(_get_response(401))
+    assert attempts.needs_retry(_get_response(429))
+    assert attempts.rate_limiter.throttle_count == 1
+    assert not attempts.needs_retry(_get_response(429))
+    assert not attempts.needs_retry(_get_response(200))
+    assert metrics.get_partition("units", None).retries == 2
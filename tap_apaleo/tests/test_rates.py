@@ -0,0 +1,116 @@
+"""Tests for the rates child stream of rate plans."""
+
+import json
+
+import pendulum
+
+from tap_apaleo.cassette import Cassette, CassetteServer
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+RATE_PLAN_IDS = ["RP1", "RP2", "RP3"]
+# Monthly windows from the start date up to 39 days after "now", 2021-01-20.
+WINDOWS = [("2021-01-01", "2021-01-31"), ("2021-02-01", "2021-02-28")]
+
+
+def _add_rate_plans(cassette: Cassette) -> None:
+    body = {"ratePlans": [{"id": id} for id in RATE_PLAN_IDS], "count": 3}
+    cassette.add(
+        "GET",
+        "/rateplan/v1/rate-plans?pageSize=1000",
+        200,
+        "application/json",
+        json.dumps(body),
+    )
+    for rate_plan_id in RATE_PLAN_IDS:
+        for first_day, last_day in WINDOWS:
+            rate = {
+                "from": f"{first_day}T15:00:00+01:00",
+                "to": f"{pendulum.parse(first_day).add(days=1).to_date_string()}"
+                "T11:00:00+01:00",
+                "price": {"amount": 100.0, "currency": "EUR"},
+            }
+            cassette.add(
+                "GET",
+                f"/rateplan/v1/rate-plans/{rate_plan_id}/rates"
+                f"?pageSize=1000&from={first_day}&to={last_day}",
+                200,
+                "application/json",
+                json.dumps({"rates": [rate], "count": 1}),
+            )
+
+
+def test_rates_are_fanned_out_and_emitted_in_rate_plan_order(
+    monkeypatch, new_cassette, sync, get_records
+):
+    """Windows of several rate plans are requested at once, rates stay in order."""
+    monkeypatch.setattr(
+        "tap_apaleo.streams.utc_now", lambda: pendulum.datetime(2021, 1, 20, 12)
+    )
+    cassette = new_cassette()
+    _add_rate_plans(cassette)
+    settings = {"rates_days_ahead": 39, "max_parallel_partitions": 3}
+    with CassetteServer(cassette, latency=0.02) as server:
+        messages = sync(server, settings, streams=["rates"])
+        assert server.request_counts["/rateplan/v1/rate-plans/RP3/rates"] == 2
+
+    rates = [
+        (record["ratePlanId"], record["from"][:10])
+        for record in get_records(messages, "rates")
+    ]
+    assert rates == [
+        (rate_plan_id, first_day)
+        for rate_plan_id in RATE_PLAN_IDS
+        for first_day, _ in WINDOWS
+    ]
+    state = [message for message in messages if message["type"] == "STATE"][-1]
+    partitions = state["value"]["bookmarks"]["rates"]["partitions"]
+    assert [partition["context"]["ratePlanId"] for partition in partitions] == [
+        "RP1", "RP2", "RP3"
+    ]
+    # Rates before today are final, the next sync starts today.
+    assert {partition["replication_key_value"] for partition in partitions} == {
+        "2021-01-20T00:00:00Z"
+    }
+
+
+def test_rates_start_at_start_date_then_at_the_bookmark(monkeypatch, start_date):
+    """The first sync of a rate plan backfills from `start_date`, later ones not."""
+    monkeypatch.setattr(
+        "tap_apaleo.streams.utc_now", lambda: pendulum.datetime(2021, 3, 20, 12)
+    )
+    config = {**SAMPLE_CONFIG, "start_date": start_date, "rates_days_ahead": 0}
+    context = {"ratePlanId": "RP1"}
+    rates = TapApaleo(config=config).streams["rates"]
+    assert [window[0][:10] for window in rates.get_windows(context)] == [
+        "2021-01-01", "2021-02-01", "2021-03-01"
+    ]
+
+    partition = {
+        "context": context,
+        "replication_key": "from",
+        "replication_key_value": "2021-03-20T00:00:00Z",
+    }
+    state = {"bookmarks": {"rates": {"partitions": [partition]}}}
+    rates = TapApaleo(config=config, state=state).streams["rates"]
+    assert [window[0][:10] for window in rates.get_windows(context)] == [
+        "2021-03-20"
+    ]
+
+
+def test_the_last_rates_window_ends_with_rates_days_ahead(monkeypatch, start_date):
+    """Rates after the last day are not requested, even mid-way through a window."""
+    monkeypatch.setattr(
+        "tap_apaleo.streams.utc_now", lambda: pendulum.datetime(2021, 1, 20, 12)
+    )
+    config = {**SAMPLE_CONFIG, "start_date": start_date, "rates_days_ahead": 15}
+    context = {"ratePlanId": "RP1"}
+    rates = TapApaleo(config=config).streams["rates"]
+    windows = rates.get_windows(context)
+    assert windows == [
+        ("2021-01-01T00:00:00Z", "2021-02-01T00:00:00Z"),
+        ("2021-02-01T00:00:00Z", "2021-02-05T00:00:00Z"),
+    ]
+    window_context = rates.get_window_context(context, windows[-1])
+    params = rates.get_url_params(window_context, None)
+    assert (params["from"], params["to"]) == ("2021-02-01", "2021-02-04")
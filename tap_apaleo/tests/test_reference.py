@@ -0,0 +1,70 @@
+"""Tests for the on-disk cache of reference data."""
+
+import json
+
+import requests
+
+from tap_apaleo.cassette import CassetteServer
+from tap_apaleo.reference import get_reference_cache
+from tap_apaleo.tap import TapApaleo
+
+PROPERTIES_PATH = "/inventory/v1/properties?pageSize=1000"
+
+
+def test_reference_data_is_read_from_disk_within_ttl(new_cassette, tmp_path):
+    """A second run within the TTL requests no properties from the API."""
+    cassette = new_cassette()
+    body = {"properties": [{"id": "MUC"}, {"id": "BER"}], "count": 2}
+    cassette.add("GET", PROPERTIES_PATH, 200, "application/json", json.dumps(body))
+    with CassetteServer(cassette) as server:
+        config = server.get_tap_config(
+            {"cache_dir": str(tmp_path), "reference_cache_ttl": 3600}
+        )
+        assert TapApaleo(config=config).streams["properties"].get_property_ids() == [
+            "MUC", "BER"
+        ]
+        assert TapApaleo(config=config).streams["properties"].get_property_ids() == [
+            "MUC", "BER"
+        ]
+        assert server.request_counts["/inventory/v1/properties"] == 1
+
+        config["reference_cache_ttl"] = 0
+        TapApaleo(config=config).streams["properties"].get_property_ids()
+        assert server.request_counts["/inventory/v1/properties"] == 2
+
+    assert len(list((tmp_path / "reference").glob("*.json"))) == 1
+
+
+def test_not_modified_reuses_the_cached_body_and_restarts_the_ttl(
+    monkeypatch, new_cassette, tmp_path
+):
+    """After the TTL, a `304 Not Modified` answers with the cached properties."""
+    validators = []
+    send = requests.Session.send
+
+    def record_validators(session, request, **kwargs):
+        validators.append(request.headers.get("If-None-Match"))
+        return send(session, request, **kwargs)
+
+    monkeypatch.setattr(requests.Session, "send", record_validators)
+    cassette = new_cassette()
+    cassette.add("GET", PROPERTIES_PATH, 304, "application/json", "")
+    with CassetteServer(cassette) as server:
+        config = server.get_tap_config(
+            {"cache_dir": str(tmp_path), "reference_cache_ttl": 0}
+        )
+        cache = get_reference_cache(config)
+        key = cache.get_key("replay", server.url + PROPERTIES_PATH)
+        body = {"properties": [{"id": "MUC"}], "count": 1}
+        cache.touch(key, {"etag": '"v1"', "body": json.dumps(body)})
+        touched_at = cache.get(key)["fetched_at"]
+
+        properties = TapApaleo(config=config).streams["properties"]
+        assert properties.get_property_ids() == ["MUC"]
+        assert server.request_counts["/inventory/v1/properties"] == 1
+        assert validators[-1] == '"v1"'
+
+    entry = cache.get(key)
+    assert entry["fetched_at"] > touched_at
+    assert entry["etag"] == '"v1"'
+    assert json.loads(entry["body"]) == body
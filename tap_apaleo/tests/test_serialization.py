@@ -0,0 +1,54 @@
+"""Tests for JSON encoding and decoding."""
+
+import datetime
+import io
+import json
+from decimal import Decimal
+
+from singer.messages import RecordMessage, format_message
+
+from tap_apaleo import serialization
+from tap_apaleo.serialization import dump_message, loads, write_message
+
+
+def _record_message(record: dict) -> RecordMessage:
+    return RecordMessage(
+        stream="reservations",
+        record=record,
+        time_extracted=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+    )
+
+
+def test_record_messages_match_the_singer_encoder():
+    """Both backends write the same JSON values as `singer.format_message`."""
+    message = _record_message(
+        {
+            "id": "ABC-1",
+            "guest": {"name": "Zoë", "emails": ["a@example.com"]},
+            "timeSlices": [{"amount": 12.5, "nights": 1, "free": None, "ok": True}],
+        }
+    )
+    line = dump_message(message)
+    assert line.endswith(b"\n")
+    assert json.loads(line) == json.loads(format_message(message))
+
+
+def test_values_unsupported_by_the_fast_backend_fall_back():
+    """Decimals are written as numbers by the standard Singer encoder."""
+    message = _record_message({"amount": Decimal("0.1")})
+    assert dump_message(message) == (format_message(message) + "\n").encode()
+
+
+def test_loads_accepts_bytes():
+    """Response bodies are decoded from bytes."""
+    assert loads(b'{"count": 2, "items": [1.5]}') == {"count": 2, "items": [1.5]}
+
+
+def test_messages_are_written_to_the_binary_buffer(monkeypatch):
+    """Lines go to `sys.stdout.buffer` when stdout has one."""
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="ascii")
+    monkeypatch.setattr(serialization.sys, "stdout", stdout)
+    write_message(_record_message({"name": "Zoë"}))
+    stdout.flush()
+    line = stdout.buffer.getvalue()
+    assert json.loads(line)["record"] == {"name": "Zoë"}
@@ -0,0 +1,26 @@
+"""Tests for the shared HTTP session."""
+
+from tap_apaleo.session import KeepAliveAdapter, get_session, get_session_stats
+
+
+def test_session_is_shared_and_requests_gzip():
+    """All callers get the same keep-alive session asking for gzip bodies."""
+    session = get_session()
+    assert get_session(pool_size=1) is session
+    assert session.headers["Accept-Encoding"] == "gzip"
+    assert isinstance(session.get_adapter("https://api.apaleo.com"), KeepAliveAdapter)
+
+
+def test_pages_reuse_pooled_connections(
+    monkeypatch, small_pages, reservations_cassette, sync, get_records
+):
+    """A sync of several pages opens fewer connections than it sends requests."""
+    monkeypatch.setattr("tap_apaleo.session._session", None)
+    messages = sync(reservations_cassette(count=7))
+
+    assert len(get_records(messages)) == 7
+    stats = get_session_stats()
+    # The token request and four pages.
+    assert stats["requests"] == 5
+    assert stats["connections"] < stats["requests"]
+    assert stats["reused"] == stats["requests"] - stats["connections"]
@@ -0,0 +1,57 @@
+"""Tests for the reservation time slices child stream."""
+
+import json
+
+from tap_apaleo.tap import TapApaleo
+from tap_apaleo.tests.test_core import SAMPLE_CONFIG
+
+RESERVATION = {
+    "id": "ABC-1",
+    "modified": "2021-01-02T10:00:00Z",
+    "timeSlices": [
+        {"serviceDate": "2021-01-01T00:00:00Z", "ratePlan": {"id": "RP1"}},
+        {"serviceDate": "2021-01-02T00:00:00Z", "ratePlan": {"id": "RP1"}},
+    ],
+}
+
+
+def test_time_slices_are_fed_from_the_parent_record(capsys):
+    """Each slice becomes one row; the schema is written once for all parents."""
+    tap = TapApaleo(config=SAMPLE_CONFIG)
+    reservations = tap.streams["reservations"]
+    time_slices = tap.streams["reservation_time_slices"]
+    assert time_slices in reservations.child_streams
+
+    for _ in range(2):
+        time_slices.sync_from_parent(reservations.get_child_context(RESERVATION, None))
+
+    messages = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [message["type"] for message in messages] == ["SCHEMA"] + ["RECORD"] * 4
+    assert messages[1]["record"] == {
+        "reservationId": "ABC-1",
+        "serviceDate": "2021-01-01T00:00:00Z",
+        "ratePlan": {"id": "RP1"},
+    }
+
+
+def test_time_slices_are_only_expanded_when_needed(select_streams):
+    """`expand` is dropped unless `timeSlices` or the child stream is selected."""
+    tap = TapApaleo(config=SAMPLE_CONFIG)
+    assert tap.streams["reservations"].get_expand_param() == "timeSlices"
+
+    catalog = select_streams(
+        "reservations",
+        "reservation_time_slices",
+        deselected_properties=["timeSlices"],
+    )
+    reservations = TapApaleo(SAMPLE_CONFIG, catalog=catalog).streams["reservations"]
+    assert reservations.get_expand_param() == "timeSlices"
+    assert "timeSlices" not in reservations.pruned_properties
+
+    catalog = select_streams(
+        "reservations", deselected_properties=["timeSlices", "comment"]
+    )
+    reservations = TapApaleo(SAMPLE_CONFIG, catalog=catalog).streams["reservations"]
+    assert reservations.get_expand_param() is None
+    assert {"timeSlices", "comment"} <= reservations.pruned_properties
+    assert "id" not in reservations.pruned_properties
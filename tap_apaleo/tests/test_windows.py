@@ -0,0 +1,70 @@
+"""Tests for time window planning."""
+
+import json
+
+import pendulum
+import pytest
+
+from tap_apaleo.cassette import CassetteServer
+from tap_apaleo.windows import get_time_windows
+
+
+def test_windows_are_anchored_and_clipped():
+    """Windows follow the anchor grid and the first one starts at `start`."""
+    windows = get_time_windows(
+        anchor=pendulum.datetime(2021, 1, 31),
+        start=pendulum.datetime(2021, 3, 15),
+        end=pendulum.datetime(2021, 5, 1),
+        unit="month",
+    )
+    assert windows == [
+        (pendulum.datetime(2021, 3, 15), pendulum.datetime(2021, 3, 31)),
+        (pendulum.datetime(2021, 3, 31), pendulum.datetime(2021, 4, 30)),
+        (pendulum.datetime(2021, 4, 30), pendulum.datetime(2021, 5, 31)),
+    ]
+
+
+def test_unknown_window_unit_is_rejected():
+    """Only the documented units are accepted."""
+    with pytest.raises(ValueError):
+        get_time_windows(
+            anchor=pendulum.datetime(2021, 1, 1),
+            start=pendulum.datetime(2021, 1, 1),
+            end=pendulum.datetime(2021, 2, 1),
+            unit="fortnight",
+        )
+
+
+def test_completed_windows_are_skipped_on_resume(
+    monkeypatch, small_pages, new_cassette, sync, get_records
+):
+    """A resumed backfill requests no completed window and forgets them at the end."""
+    monkeypatch.setattr(
+        "tap_apaleo.client.utc_now", lambda: pendulum.datetime(2021, 3, 15)
+    )
+    cassette = new_cassette()
+    for month in ["01", "02", "03"]:
+        window_from, window_to = f"2021-{month}-01", f"2021-{int(month) + 1:02}-01"
+        reservation = {"id": f"R{month}", "modified": f"{window_from}T10:00:00Z"}
+        cassette.add(
+            "GET",
+            "/booking/v1/reservations?pageSize=2&expand=timeSlices"
+            f"&dateFilter=Modification&from={window_from}T00:00:00Z"
+            f"&to={window_to}T00:00:00Z&sort=updated%3Aasc",
+            200,
+            "application/json",
+            json.dumps({"reservations": [reservation], "count": 1}),
+        )
+    state = {
+        "bookmarks": {
+            "reservations": {"completed_windows": ["2021-02-01T00:00:00Z"]}
+        }
+    }
+    with CassetteServer(cassette) as server:
+        messages = sync(server, {"reservations_window": "month"}, state=state)
+        assert server.request_counts["/booking/v1/reservations"] == 2
+
+    assert [r["id"] for r in get_records(messages)] == ["R02", "R03"]
+    bookmark = messages[-1]["value"]["bookmarks"]["reservations"]
+    assert "completed_windows" not in bookmark
+    assert bookmark["replication_key_value"] == "2021-03-01T10:00:00Z"
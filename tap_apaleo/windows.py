@@ -0,0 +1,40 @@
+"""Time window planning for sharded syncs of date-filtered Apaleo endpoints."""
+
+from datetime import datetime
+from typing import List, Tuple
+
+import pendulum
+
+WINDOW_UNITS = {
+    "day": "days",
+    "week": "weeks",
+    "month": "months",
+    "year": "years",
+}
+
+
+def get_time_windows(
+    anchor: datetime, start: datetime, end: datetime, unit: str
+) -> List[Tuple[datetime, datetime]]:
+    """Return the `(from, to)` windows covering `start` to `end`.
+
+    Window boundaries lie on a grid of `unit` steps from `anchor`, so the same
+    window always has the same end no matter where a run starts. The first window
+    is clipped to `start`.
+    """
+    if unit not in WINDOW_UNITS:
+        raise ValueError(
+            f"Unsupported window '{unit}', expected one of {list(WINDOW_UNITS)}."
+        )
+
+    grid = pendulum.instance(anchor)
+    windows: List[Tuple[datetime, datetime]] = []
+    step = 0
+    window_from = grid
+    while window_from < end:
+        step += 1
+        window_to = grid.add(**{WINDOW_UNITS[unit]: step})
+        if window_to > start:
+            windows.append((max(window_from, pendulum.instance(start)), window_to))
+        window_from = window_to
+    return windows